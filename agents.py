@@ -2,11 +2,12 @@ from google.adk.agents import Agent, LlmAgent, SequentialAgent, ParallelAgent
 from google.adk.models.lite_llm import LiteLlm # 用于多模型支持
 from utils.config_loader import ConfigLoader
 from prompts.prompts import input_process_prompt, scheduler_prompt, customer_portrait_prompt, customer_behavior_prompt, collaborate_prompt, follow_up_prompt, get_collaborate_prompt, send_file_prompt
-from tools.callbacks import check_prompt_protection, dynamic_chat_agent_instruction_before_model
+from tools.callbacks import check_prompt_protection, dynamic_chat_agent_instruction_before_model, start_tool_calls_after_model
 from tools.input_process import speech_to_text, image_comprehension, video_comprehension
-from tools.core_logic import select_file
-from utils.db_queries import select_collaborate_matters
+from tools.core_logic import select_file, select_collaborate_matters
 from utils.db_insert import insert_customer_behavior, insert_customer_portrait
+from utils.async_db import async_db_tool
+from utils.tool_memo import memoize_tools
 
 config = ConfigLoader()
 
@@ -33,7 +34,8 @@ input_process_agent = LlmAgent(
     name="input_process_agent",
     description="对用户输入进行预处理，将用户输入的各类信息（文本、图片、视频）统一转换为标准化的结构化数据格式，然后传递给下一个team_work_agent智能体进行处理。",
     instruction=input_process_prompt,
-    tools=[speech_to_text, image_comprehension, video_comprehension],
+    tools=memoize_tools([speech_to_text, image_comprehension, video_comprehension]),
+    after_model_callback=start_tool_calls_after_model,
     before_agent_callback=check_prompt_protection,
 )
 
@@ -42,7 +44,7 @@ customer_portrait_agent = LlmAgent(
     name="customer_portrait_agent",
     description="根据历史聊天记录和用户发送的最新信息 生成或更新客户画像。",
     instruction=customer_portrait_prompt,
-    tools=[insert_customer_portrait],
+    tools=[async_db_tool(insert_customer_portrait)],
 )
 
 customer_behavior_agent = LlmAgent(
@@ -50,7 +52,7 @@ customer_behavior_agent = LlmAgent(
     name="customer_behavior_agent",
     description="根据历史聊天记录和客户发送的最新信息，生成或更新客户行为。",
     instruction=customer_behavior_prompt,
-    tools=[insert_customer_behavior],
+    tools=[async_db_tool(insert_customer_behavior)],
 )
 
 # 协作事项可以调整，1、不发送通知，最终汇总到chat_agent中；2、发送通知，chat_agent中不发送协作事项
@@ -59,7 +61,7 @@ collaborate_agent = LlmAgent(
     name="collaborate_agent",
     description="根据聊天内容，判断触发哪种协作事项。",
     instruction=collaborate_prompt,
-    tools=[select_collaborate_matters],
+    tools=memoize_tools([async_db_tool(select_collaborate_matters)]),
 )
 
 ## 跟单事项
@@ -92,7 +94,7 @@ send_file_agent = LlmAgent(
     name="send_file_agent",
     description="根据聊天内容，调用send_file工具，查询相关文件。并判断是否需要发送文件。把文件的url返回给chat_agent。",
     instruction=send_file_prompt,
-    tools=[select_file],
+    tools=memoize_tools([async_db_tool(select_file)]),
 )
 
 ## 团队并行执行
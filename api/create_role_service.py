@@ -4,6 +4,8 @@ from typing import Optional, Dict, Set
 import asyncio
 from utils.create_role import create_role_background, create_one_to_N_role_background
 from utils.logger_config import get_api_logger
+from utils.config_loader import ConfigLoader
+from utils.admission import AdmissionController, AdmissionRejected, AdmissionTicket
 import uuid
 from datetime import datetime
 import threading
@@ -15,6 +17,13 @@ logger = get_api_logger()
 
 app = FastAPI(title="角色创建服务", description="异步创建销售角色并立即响应")
 
+# 准入控制：同时进行的角色创建过多或预计排队时间过长时直接返回 429
+admission = AdmissionController.from_config(
+    "create_role",
+    concurrency=8,
+    config=ConfigLoader().get_agent_service_config('admission').get('create_role', {}),
+)
+
 # 请求ID中间件
 @app.middleware("http")
 async def add_request_id(request: Request, call_next):
@@ -46,7 +55,7 @@ def create_response(data: dict = None, message: str = "success", status: str = "
         "request_id": request_id
     }
 
-def process_role_creation_background(tenant_id: str, task_id: str, strategy_id: str, request_id: str):
+def process_role_creation_background(tenant_id: str, task_id: str, strategy_id: str, request_id: str, ticket: AdmissionTicket):
     """后台处理角色创建任务"""
     try:
         logger.info(f"开始后台处理角色创建任务 - 请求ID: {request_id}")
@@ -64,7 +73,9 @@ def process_role_creation_background(tenant_id: str, task_id: str, strategy_id:
             
     except Exception as e:
         logger.error(f"角色创建任务执行失败 - 请求ID: {request_id}, 错误: {str(e)}", exc_info=True)
-def process_one_to_N_role_creation_background(tenant_id: str, task_id: str, strategy_id: str, request_id: str):
+    finally:
+        ticket.release()
+def process_one_to_N_role_creation_background(tenant_id: str, task_id: str, strategy_id: str, request_id: str, ticket: AdmissionTicket):
     """后台处理one_to_N角色创建任务"""
     try:
         logger.info(f"开始后台处理角色创建任务 - 请求ID: {request_id}")
@@ -82,6 +93,8 @@ def process_one_to_N_role_creation_background(tenant_id: str, task_id: str, stra
             
     except Exception as e:
         logger.error(f"角色创建任务执行失败 - 请求ID: {request_id}, 错误: {str(e)}", exc_info=True)
+    finally:
+        ticket.release()
 @app.post("/create_role", response_model=CreateRoleResponse)
 async def create_role_api(request: CreateRoleRequest, req: Request):
     """
@@ -98,13 +111,15 @@ async def create_role_api(request: CreateRoleRequest, req: Request):
             logger.warning(f"参数验证失败: {error_msg}, 请求ID: {request_id}。tenant_id: {request.tenant_id}, task_id: {request.task_id}, strategy_id: {request.strategy_id}")
             raise HTTPException(status_code=400, detail=error_msg)
         
+        ticket = admission.try_acquire(request.tenant_id)
+        
         # 立即返回响应，后台线程执行角色创建
         logger.info(f"立即返回响应，启动后台线程处理角色创建 - 请求ID: {request_id}")
         
         # 启动后台线程
         thread = threading.Thread(
             target=process_role_creation_background,
-            args=(request.tenant_id, request.task_id, request.strategy_id, request_id)
+            args=(request.tenant_id, request.task_id, request.strategy_id, request_id, ticket)
         )
         thread.daemon = True
         thread.start()
@@ -124,6 +139,12 @@ async def create_role_api(request: CreateRoleRequest, req: Request):
             request_id=request_id
         )
         
+    except AdmissionRejected as e:
+        raise HTTPException(
+            status_code=429,
+            detail=f"服务繁忙（{e.reason}），请 {e.retry_after} 秒后重试",
+            headers={"Retry-After": str(e.retry_after)}
+        )
     except HTTPException:
         # 重新抛出HTTP异常
         raise
@@ -148,13 +169,15 @@ async def create_role_api_v2(request: CreateRoleRequest, req: Request):
             logger.warning(f"参数验证失败: {error_msg}, 请求ID: {request_id}。tenant_id: {request.tenant_id}, task_id: {request.task_id}, strategy_id: {request.strategy_id}")
             raise HTTPException(status_code=400, detail=error_msg)
         
+        ticket = admission.try_acquire(request.tenant_id)
+        
         # 立即返回响应，后台线程执行角色创建
         logger.info(f"立即返回响应，启动后台线程处理角色创建 - 请求ID: {request_id}")
         
         # 启动后台线程
         thread = threading.Thread(
             target=process_one_to_N_role_creation_background,
-            args=(request.tenant_id, request.task_id, request.strategy_id, request_id)
+            args=(request.tenant_id, request.task_id, request.strategy_id, request_id, ticket)
         )
         thread.daemon = True
         thread.start()
@@ -174,6 +197,12 @@ async def create_role_api_v2(request: CreateRoleRequest, req: Request):
             request_id=request_id
         )
         
+    except AdmissionRejected as e:
+        raise HTTPException(
+            status_code=429,
+            detail=f"服务繁忙（{e.reason}），请 {e.retry_after} 秒后重试",
+            headers={"Retry-After": str(e.retry_after)}
+        )
     except HTTPException:
         # 重新抛出HTTP异常
         raise
@@ -192,6 +221,7 @@ async def health_check(req: Request):
         data={
             "service": "create_role_service",
             "status": "healthy",
+            "admission": admission.stats(),
             "timestamp": datetime.now().isoformat()
         },
         message="服务运行正常",
@@ -21,8 +21,10 @@ from datetime import datetime
 import uuid
 import asyncio
 from pydantic import BaseModel
-import threading
 from utils.config_loader import ConfigLoader
+from utils.job_queue import PersistentJobQueue, JobWorkerThreads, Job
+from utils.admission import AdmissionController, AdmissionRejected, AdmissionTicket
+from core.database_core import db_manager
 
 # 获取API服务的日志记录器
 logger = get_api_logger()
@@ -114,8 +116,12 @@ def download_file(url: str) -> str:
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"下载文件失败: {str(e)}")
 
-def process_document_summary(data_id: int, tenant_id: int, url: str, file_type: int):
-    """后台处理文档总结任务"""
+def process_document_summary(data_id: int, tenant_id: int, url: str, file_type: int, final_attempt: bool = True):
+    """
+    后台处理文档总结任务
+
+    final_attempt 为 False 时，处理失败会抛出异常交给任务队列重试；为 True 时把任务状态更新为失败
+    """
     try:
         # 更新任务状态为处理中
         update_sale_ai_data_status(data_id, tenant_id, new_ai_status=1, ai_text="处理中...")
@@ -152,11 +158,63 @@ def process_document_summary(data_id: int, tenant_id: int, url: str, file_type:
         update_sale_ai_data_status(data_id, tenant_id, new_ai_status=2, ai_text=f"{result}")
         
     except Exception as e:
+        if not final_attempt:
+            logger.warning(f"任务 {data_id} 处理失败，稍后重试: {str(e)}")
+            raise
         # 更新任务状态为失败
         error_message = f"处理失败: {str(e)}"
         update_sale_ai_data_status(data_id, tenant_id, new_ai_status=3, ai_text=error_message)
         logger.error(f"任务 {data_id} 处理失败: {str(e)}", exc_info=True)
 
+def process_summary_job(job: Job):
+    """持久化任务队列的处理函数"""
+    payload = dict(job.payload)
+    admission_token = payload.pop("admission_token", None)
+    process_document_summary(**payload, final_attempt=job.final_attempt)
+    # 处理成功或最后一次尝试结束后归还准入名额；需要重试时上面会抛出异常，名额保留到重试结束
+    ticket = summary_tickets.pop(admission_token, None)
+    if ticket:
+        ticket.release()
+
+# 持久化任务队列：服务重启或发布时已提交的总结任务不会丢失，sale_ai_data 也不会停留在"处理中"
+summary_job_queue_config = config.get_agent_service_config('summary_job_queue')
+summary_job_queue = PersistentJobQueue(
+    db_manager,
+    queue_name="document_summary",
+    max_attempts=summary_job_queue_config.get('max_attempts', 3),
+    base_backoff_seconds=summary_job_queue_config.get('base_backoff_seconds', 10),
+    max_backoff_seconds=summary_job_queue_config.get('max_backoff_seconds', 300),
+    cleanup_interval_seconds=summary_job_queue_config.get('cleanup_interval_seconds', 3600),
+    retention_seconds=summary_job_queue_config.get('retention_seconds', 7 * 24 * 3600),
+)
+summary_workers = JobWorkerThreads(
+    summary_job_queue,
+    handler=process_summary_job,
+    num_workers=summary_job_queue_config.get('num_workers', 4),
+    poll_interval=summary_job_queue_config.get('poll_interval', 1),
+    lease_seconds=summary_job_queue_config.get('lease_seconds', 1800),
+)
+
+# 准入控制：积压的总结任务过多时直接返回 429，避免任务长时间停留在"待处理"
+summary_admission = AdmissionController.from_config(
+    "document_summary",
+    concurrency=summary_workers.num_workers,
+    config=config.get_agent_service_config('admission').get('document_summary', {}),
+)
+# 本进程接收的任务的准入凭证 {admission_token: 凭证}，重启后恢复的任务不再占用名额
+summary_tickets: Dict[str, AdmissionTicket] = {}
+
+@app.on_event("startup")
+async def startup_event():
+    """服务启动时恢复上次未完成的总结任务并启动消费线程"""
+    await asyncio.to_thread(summary_job_queue.recover)
+    summary_workers.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """服务关闭时停止消费线程，未完成的任务在下次启动时恢复"""
+    await asyncio.to_thread(summary_workers.stop)
+
 @app.post("/api/summarize/document-async")
 async def summarize_document_async(request: DocumentSummaryRequest):
     """异步处理文档总结请求"""
@@ -165,13 +223,22 @@ async def summarize_document_async(request: DocumentSummaryRequest):
         if request.file_type not in [0, 1, 2, 3, 4, 5]:
             raise HTTPException(status_code=400, detail="不支持的文件类型")
         
-        # 启动后台任务
-        thread = threading.Thread(
-            target=process_document_summary,
-            args=(request.data_id, request.tenant_id, request.url, request.file_type)
-        )
-        thread.daemon = True
-        thread.start()
+        ticket = summary_admission.try_acquire(request.tenant_id)
+        admission_token = str(uuid.uuid4())
+        summary_tickets[admission_token] = ticket
+        # 写入持久化任务队列，由后台消费线程处理
+        try:
+            await asyncio.to_thread(summary_job_queue.enqueue, {
+                "data_id": request.data_id,
+                "tenant_id": request.tenant_id,
+                "url": request.url,
+                "file_type": request.file_type,
+                "admission_token": admission_token,
+            })
+        except Exception:
+            summary_tickets.pop(admission_token, None)
+            ticket.release()
+            raise
         
         # 立即返回响应
         return create_response(
@@ -183,6 +250,12 @@ async def summarize_document_async(request: DocumentSummaryRequest):
             message="任务已提交，正在后台处理"
         )
         
+    except AdmissionRejected as e:
+        raise HTTPException(
+            status_code=429,
+            detail=f"服务繁忙（{e.reason}），请 {e.retry_after} 秒后重试",
+            headers={"Retry-After": str(e.retry_after)}
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -1,3 +1,5 @@
 from tools.database import DatabaseManager
+from utils.query_stats import install_query_stats
 
-db_manager = DatabaseManager('configs/database_sqlite.yaml')
\ No newline at end of file
+db_manager = DatabaseManager('configs/database_sqlite.yaml')
+install_query_stats(db_manager)
\ No newline at end of file
@@ -2,7 +2,7 @@
 import os
 import json
 import asyncio
-import threading
+from contextlib import asynccontextmanager
 from typing import Dict, Any
 from datetime import datetime
 from fastapi import FastAPI, HTTPException
@@ -14,7 +14,9 @@ from google.adk.sessions import DatabaseSessionService
 from google.adk.runners import Runner
 from agents import root_agent
 from utils.chat import call_agent_async
-from tools.notify import send_chat
+from tools.notify import send_chat, close_http_session
+from utils.agent_worker_pool import AgentWorkerPool, QueueFullError
+from utils.config_loader import ConfigLoader
 import logging
 
 # 配置日志记录器
@@ -41,7 +43,16 @@ runner = Runner(
     session_service=session_service,
 )
 
-app = FastAPI(title="AI Sales Agent Service", description="A service for AI agents to process user requests.")
+config = ConfigLoader()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 服务启动时拉起后台工作池，关闭时等待排队任务处理完成
+    worker_pool.start()
+    yield
+    await asyncio.to_thread(worker_pool.stop)
+
+app = FastAPI(title="AI Sales Agent Service", description="A service for AI agents to process user requests.", lifespan=lifespan)
 
 # 定义请求体模型
 class AgentRequest(BaseModel):
@@ -76,9 +87,9 @@ class AgentResponse(BaseModel):
     # output_data: Dict[str, Any] | None = None
     # error: str | None = None
 
-def process_agent_background(request: AgentRequest):
+async def process_agent_background(request: AgentRequest):
     """
-    后台处理智能体请求的函数
+    后台处理智能体请求的函数，由工作池在常驻事件循环中调用
     """
     user_id = request.task_id
     current_session_id = request.session_id
@@ -86,105 +97,101 @@ def process_agent_background(request: AgentRequest):
     try:
         logger.info(f"开始后台处理请求 - user_id: {user_id}, session_id: {current_session_id}")
         
-        # 创建新的事件循环来处理异步操作
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
+        # 构建查询字符串，将用户输入转换为更友好的格式
+        query_parts = []
+        for item in request.user_input:
+            timestamp = item.get('timestamp', '')
+            if item.get("type") == "text":
+                query_parts.append(f"文本内容: {item.get('content', '')} (时间: {timestamp})")
+            elif item.get("type") == "image":
+                query_parts.append(f"图片URL: {item.get('url', '')} (时间: {timestamp})")
+            elif item.get("type") == "video":
+                query_parts.append(f"视频URL: {item.get('url', '')} (时间: {timestamp})")
+            elif item.get("type") == "location":
+                query_parts.append(f"位置信息: {item.get('local_info', '')} (时间: {timestamp})")
+        
+        # 将所有输入组合成一个查询字符串
+        query = "客户输入信息:\n" + "\n".join(query_parts)
+        
+        # 调用智能体处理
+        agent_response_text = await call_agent_async(
+            query=query,
+            runner=runner,
+            user_id=user_id,
+            session_id=current_session_id,
+            request_body=request.model_dump()
+        )
+        print(f"agent_response_text: {agent_response_text}")
         
+        # 尝试解析JSON响应
         try:
-            # 构建查询字符串，将用户输入转换为更友好的格式
-            query_parts = []
-            for item in request.user_input:
-                timestamp = item.get('timestamp', '')
-                if item.get("type") == "text":
-                    query_parts.append(f"文本内容: {item.get('content', '')} (时间: {timestamp})")
-                elif item.get("type") == "image":
-                    query_parts.append(f"图片URL: {item.get('url', '')} (时间: {timestamp})")
-                elif item.get("type") == "video":
-                    query_parts.append(f"视频URL: {item.get('url', '')} (时间: {timestamp})")
-                elif item.get("type") == "location":
-                    query_parts.append(f"位置信息: {item.get('local_info', '')} (时间: {timestamp})")
+            # 移除可能的markdown代码块标记
+            cleaned_response = agent_response_text.strip()
+            if cleaned_response.startswith("```json"):
+                cleaned_response = cleaned_response[7:]
+            if cleaned_response.endswith("```"):
+                cleaned_response = cleaned_response[:-3]
+            cleaned_response = cleaned_response.strip()
             
-            # 将所有输入组合成一个查询字符串
-            query = "客户输入信息:\n" + "\n".join(query_parts)
-            
-            # 调用智能体处理
-            agent_response_text = loop.run_until_complete(call_agent_async(
-                query=query,
-                runner=runner,
-                user_id=user_id,
-                session_id=current_session_id,
-                request_body=request.model_dump()
-            ))
-            print(f"agent_response_text: {agent_response_text}")
-            
-            # 尝试解析JSON响应
-            try:
-                # 移除可能的markdown代码块标记
-                cleaned_response = agent_response_text.strip()
-                if cleaned_response.startswith("```json"):
-                    cleaned_response = cleaned_response[7:]
-                if cleaned_response.endswith("```"):
-                    cleaned_response = cleaned_response[:-3]
-                cleaned_response = cleaned_response.strip()
-                
-                agent_response = json.loads(cleaned_response)
-            except json.JSONDecodeError as e:
-                logger.error(f"JSON解析失败: {e}, 原始响应: {agent_response_text}")
-                # 如果解析失败，创建一个默认的文本响应
-                agent_response = {
-                    "content_list": [
-                        {
-                            "type": "text",
-                            "content": agent_response_text
-                        }
-                    ],
-                    "collaborate_list": [],
-                    "follow_up": {
-                        "is_follow_up": 0,
-                        "follow_up_content": []
+            agent_response = json.loads(cleaned_response)
+        except json.JSONDecodeError as e:
+            logger.error(f"JSON解析失败: {e}, 原始响应: {agent_response_text}")
+            # 如果解析失败，创建一个默认的文本响应
+            agent_response = {
+                "content_list": [
+                    {
+                        "type": "text",
+                        "content": agent_response_text
                     }
+                ],
+                "collaborate_list": [],
+                "follow_up": {
+                    "is_follow_up": 0,
+                    "follow_up_content": []
                 }
-            
-            logger.info(f"智能体处理完成 - user_id: {user_id}, session_id: {current_session_id}")
-            
-            # 发送通知给后端
-            try:
-                current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                loop.run_until_complete(send_chat(
-                    tenant_id=request.tenant_id,
-                    task_id=request.task_id,
-                    session_id=request.session_id,
-                    belong_chat_id=request.belong_chat_id,
-                    chat_content=agent_response
-                ))
-                logger.info(f"通知发送成功 - user_id: {user_id}, session_id: {current_session_id}")
-            except Exception as notify_error:
-                logger.error(f"发送通知失败 - user_id: {user_id}, session_id: {current_session_id}, error: {notify_error}")
-                
-        finally:
-            loop.close()
+            }
+        
+        logger.info(f"智能体处理完成 - user_id: {user_id}, session_id: {current_session_id}")
+        
+        # 发送通知给后端
+        try:
+            await send_chat(
+                tenant_id=request.tenant_id,
+                task_id=request.task_id,
+                session_id=request.session_id,
+                wechat_id=request.wechat_id,
+                belong_chat_id=request.belong_chat_id,
+                chat_content=agent_response
+            )
+            logger.info(f"通知发送成功 - user_id: {user_id}, session_id: {current_session_id}")
+        except Exception as notify_error:
+            logger.error(f"发送通知失败 - user_id: {user_id}, session_id: {current_session_id}, error: {notify_error}")
             
     except Exception as e:
         logger.exception(f"后台处理失败 - user_id: {user_id}, session_id: {current_session_id}, error: {e}")
         # 发送错误通知
         try:
-            current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            try:
-                loop.run_until_complete(send_chat(
-                    tenant_id=request.tenant_id,
-                    task_id=request.task_id,
-                    session_id=request.session_id,
-                    belong_chat_id=request.belong_chat_id,
-                    chat_content=f"处理失败: {str(e)}"
-
-                ))
-            finally:
-                loop.close()
+            await send_chat(
+                tenant_id=request.tenant_id,
+                task_id=request.task_id,
+                session_id=request.session_id,
+                wechat_id=request.wechat_id,
+                belong_chat_id=request.belong_chat_id,
+                chat_content=f"处理失败: {str(e)}"
+            )
         except Exception as notify_error:
             logger.error(f"发送错误通知失败 - user_id: {user_id}, session_id: {current_session_id}, error: {notify_error}")
 
+# 后台工作池：所有请求在同一个常驻事件循环上由固定数量的工作协程处理
+worker_pool_config = config.get_agent_service_config('worker_pool')
+worker_pool = AgentWorkerPool(
+    handler=process_agent_background,
+    num_workers=worker_pool_config.get('num_workers', 8),
+    max_queue_size=worker_pool_config.get('max_queue_size', 200),
+    name="agent_worker_pool",
+    on_shutdown=close_http_session,
+)
+
 @app.post("/process_user_input", response_model=AgentResponse)
 async def process_user_input(request: AgentRequest):
     user_id = request.task_id
@@ -192,14 +199,9 @@ async def process_user_input(request: AgentRequest):
     logger.info(f"收到请求 - user_id: {user_id}, session_id: {current_session_id}")
 
     try:
-        # 使用线程在后台处理任务
-        background_thread = threading.Thread(
-            target=process_agent_background,
-            args=(request,),
-            daemon=True  # 设置为守护线程，主程序退出时自动结束
-        )
-        background_thread.start()
-        
+        # 提交到后台工作池排队处理，按 ADK 会话ID（session_id+task_id）串行，同一客户的消息严格按顺序处理
+        worker_pool.submit(request, key=request.session_id + request.task_id)
+
         # 立即返回响应，不等待智能体处理完成
         return AgentResponse(
             status="processing",
@@ -210,6 +212,20 @@ async def process_user_input(request: AgentRequest):
             wechat_id=request.wechat_id,
             session_id=request.session_id
         )
+    except QueueFullError:
+        logger.warning(f"工作池排队已满，拒绝请求 - user_id: {user_id}, session_id: {current_session_id}, stats: {worker_pool.stats()}")
+        raise HTTPException(
+            status_code=503,
+            detail=AgentResponse(
+                status="rejected",
+                message="服务繁忙，请求队列已满，请稍后重试。",
+                tenant_id=request.tenant_id,
+                task_id=request.task_id,
+                belong_chat_id=request.belong_chat_id,
+                wechat_id=request.wechat_id,
+                session_id=request.session_id
+            ).model_dump_json()
+        )
     except Exception as e:
         logger.exception(f"处理请求失败 - user_id: {user_id}, session_id: {current_session_id}")
         raise HTTPException(
@@ -225,6 +241,13 @@ async def process_user_input(request: AgentRequest):
             ).model_dump_json()
         )
 
+@app.get("/worker_pool/stats")
+async def worker_pool_stats():
+    """
+    查看后台工作池的排队深度和工作协程利用率
+    """
+    return worker_pool.stats()
+
 # 运行 FastAPI 应用
 # 在终端中执行: uvicorn main:app --reload
 if __name__ == "__main__":
@@ -2,10 +2,12 @@
 import os
 import json
 import asyncio
-import threading
+import hashlib
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
 from typing import Dict, Any
 from datetime import datetime
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Header
 from pydantic import BaseModel
 
 # 导入 agents.py 中的所有内容
@@ -15,7 +17,22 @@ from google.adk.runners import Runner
 from agents import root_agent
 from one_agents import one_to_N_agent
 from utils.chat import call_agent_async
-from tools.notify import send_chat
+from tools.notify import send_chat, close_http_session
+from utils.agent_worker_pool import AgentWorkerPool, QueueFullError, current_run_control
+from utils.message_coalescer import MessageCoalescer
+from utils.job_queue import PersistentJobQueue
+from utils.admission import AdmissionController, AdmissionRejected, AdmissionTicket
+from utils.stream_json import ContentListExtractor
+from utils.ttl_cache import TTLCache
+from utils.session_cluster import current_shard
+from utils.prompt_cache import prompt_cache_stats
+from utils.llm_call_stats import llm_call_stats
+from utils.tool_memo import tool_memo_stats
+from utils.query_stats import query_stats
+from utils.reference_cache import reference_cache_stats
+from utils.db_queries import wechat_name_cache_stats
+from utils.config_loader import ConfigLoader
+from core.database_core import db_manager
 import logging
 
 # 配置日志记录器
@@ -48,7 +65,21 @@ runner = Runner(
     session_service=session_service,
 )
 
-app = FastAPI(title="AI Sales Agent Service", description="A service for AI agents to process user requests.")
+config = ConfigLoader()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 服务启动时恢复上次未完成的持久化任务并拉起后台工作池，关闭时等待排队任务处理完成
+    # 关闭时仍未处理完的任务保持租约状态，下次启动时由 recover() 重新放回队列
+    await asyncio.to_thread(agent_job_queue.recover)
+    worker_pool.start()
+    dispatcher = worker_pool.run_coroutine(dispatch_agent_jobs())
+    yield
+    dispatcher.cancel()
+    await asyncio.to_thread(message_coalescer.flush_all)
+    await asyncio.to_thread(worker_pool.stop)
+
+app = FastAPI(title="AI Sales Agent Service", description="A service for AI agents to process user requests.", lifespan=lifespan)
 
 # 定义请求体模型
 class AgentRequest(BaseModel):
@@ -58,6 +89,7 @@ class AgentRequest(BaseModel):
     wechat_id: str # 客户微信id 等于session_id, 工作机微信正在和某个客户聊天, 客户微信id是工作机微信id的客户
     session_id: str # 会话id 等于wechat_id
     user_input: list[dict] # 用户输入的各类信息（文本、图片、视频）
+    idempotency_key: str | None = None # 幂等键，网关重试同一批消息时保持不变；不传时按会话和消息内容计算
     """
     user_input: list[dict] = [
         {"type": "text", "content": "你好", "timestamp": "2025-06-10 10:00:00"},
@@ -83,9 +115,100 @@ class AgentResponse(BaseModel):
     # output_data: Dict[str, Any] | None = None
     # error: str | None = None
 
-def process_agent_background(request: AgentRequest):
+def build_agent_query(user_input: list[dict]) -> str:
+    """
+    将用户输入的各类信息拼接为发送给智能体的查询字符串
+    """
+    query_parts = []
+    for item in user_input:
+        timestamp = item.get('timestamp', '')
+        if item.get("type") == "text":
+            query_parts.append(f"文本内容: {item.get('content', '')} (时间: {timestamp})")
+        elif item.get("type") == "image":
+            query_parts.append(f"图片URL: {item.get('url', '')} (时间: {timestamp})")
+        elif item.get("type") == "video":
+            query_parts.append(f"视频URL: {item.get('url', '')} (时间: {timestamp})")
+        elif item.get("type") == "location":
+            query_parts.append(f"位置信息: {item.get('local_info', '')} (时间: {timestamp})")
+        elif item.get("type") == "file":
+            query_parts.append(f"文件内容: {item.get('content', '')} (时间: {timestamp})")
+        elif item.get("type") == "cite":
+            cite_content = json.loads(item.get('content', '{}'))
+            query_parts.append(f"对这条信息：{cite_content.get('content', '')} 的回复：{cite_content.get('title', '')} (时间: {timestamp})")
+    return "客户输入信息:\n" + "\n".join(query_parts)
+
+def merge_agent_requests(older: AgentRequest, newer: AgentRequest) -> AgentRequest:
+    """
+    合并同一会话的两次请求：以较新的请求为准，user_input 按到达顺序拼接
+    """
+    return newer.model_copy(update={"user_input": older.user_input + newer.user_input})
+
+@dataclass
+class AgentJob:
+    """
+    工作池中的处理单元：（可能由多次请求合并而成的）请求，以及对应的持久化任务ID和准入凭证
+    """
+    request: AgentRequest
+    job_ids: list[int]
+    tickets: list[AdmissionTicket] = field(default_factory=list)
+    idempotency_keys: list[str] = field(default_factory=list)
+
+def merge_agent_jobs(older: AgentJob, newer: AgentJob) -> AgentJob:
+    """
+    合并同一会话的两个处理单元，合并后的任务处理完成时一并确认
+    """
+    return AgentJob(
+        request=merge_agent_requests(older.request, newer.request),
+        job_ids=older.job_ids + newer.job_ids,
+        tickets=older.tickets + newer.tickets,
+        idempotency_keys=older.idempotency_keys + newer.idempotency_keys,
+    )
+
+def compute_idempotency_key(request: AgentRequest) -> str:
+    """
+    计算请求的幂等键：优先使用调用方提供的键，否则按租户、任务、会话以及消息内容和时间戳计算哈希
+    """
+    if request.idempotency_key:
+        return f"{request.tenant_id}:{request.idempotency_key}"
+    raw = json.dumps([request.tenant_id, request.task_id, request.session_id, request.user_input], ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+def update_idempotency_status(job: AgentJob, status: str):
+    """
+    更新处理单元对应的所有请求的处理状态，重复请求会直接返回该状态
+    """
+    for key in job.idempotency_keys:
+        record = idempotency_store.get(key)
+        if record is not None:
+            record["status"] = status
+
+def release_admission(job: AgentJob):
+    """
+    归还处理单元占用的准入名额
+    """
+    for ticket in job.tickets:
+        ticket.release()
+
+async def send_error_notify(request: AgentRequest):
+    """
+    处理最终失败时给客户发送兜底消息
+    """
+    try:
+        error_msg = "🤔，让我想想"
+        await send_chat(
+            tenant_id=request.tenant_id,
+            task_id=request.task_id,
+            session_id=request.session_id,
+            belong_chat_id=request.belong_chat_id,
+            wechat_id=request.wechat_id,
+            chat_content=error_msg
+        )
+    except Exception as notify_error:
+        logger.error(f"发送错误通知失败 - user_id: {request.task_id}, session_id: {request.session_id}, error: {notify_error}")
+
+async def process_agent_background(request: AgentRequest):
     """
-    后台处理智能体请求的函数
+    后台处理智能体请求的函数，失败时抛出异常，由 process_agent_job 决定重试还是发送兜底消息
     """
     user_id = request.task_id
     current_session_id = request.session_id
@@ -128,56 +251,85 @@ def process_agent_background(request: AgentRequest):
                     logger.error(f"JSON解析失败: {e}, 原始响应: {cleaned}")
         return responses
 
-    def send_notify(agent_response):
+    async def send_notify(agent_response):
         """
         发送通知
         """
         try:
-            asyncio.run(send_chat(
+            await send_chat(
                 tenant_id=request.tenant_id,
                 task_id=request.task_id,
                 session_id=request.session_id,
                 belong_chat_id=request.belong_chat_id,
                 wechat_id=request.wechat_id,
                 chat_content=agent_response
-            ))
+            )
             logger.info(f"通知发送成功 - user_id: {user_id}, session_id: {current_session_id}")
         except Exception as notify_error:
             logger.error(f"发送通知失败 - user_id: {user_id}, session_id: {current_session_id}, error: {notify_error}")
 
+    # 流式发送：模型每生成完 content_list 中的一条消息就立即发送，不等整段回复结束
+    extractor = ContentListExtractor()
+    final_emitted_counts: list[int] = []
+    streamed = 0
+
+    async def on_text(text: str, partial: bool):
+        nonlocal extractor, final_emitted_counts, streamed
+        if not partial:
+            # 一次模型响应结束：记录它已流式发送的条数（最后一次响应即最终回复），下一次响应重新解析
+            final_emitted_counts = extractor.emitted_counts
+            extractor = ContentListExtractor()
+            return
+        items = extractor.feed(text)
+        if not items:
+            return
+        # 开始发送后本次运行不再被取代
+        run_control = current_run_control()
+        if run_control is not None and not run_control.commit():
+            return
+        for item in items:
+            await send_notify({
+                "content_list": [item],
+                "collaborate_list": [],
+                "follow_up": {
+                    "is_follow_up": 0,
+                    "follow_up_content": []
+                }
+            })
+            streamed += 1
+
     try:
         logger.info(f"开始后台处理请求 - user_id: {user_id}, session_id: {current_session_id}")
 
         # 构建查询字符串
-        query_parts = []
-        for item in request.user_input:
-            timestamp = item.get('timestamp', '')
-            if item.get("type") == "text":
-                query_parts.append(f"文本内容: {item.get('content', '')} (时间: {timestamp})")
-            elif item.get("type") == "image":
-                query_parts.append(f"图片URL: {item.get('url', '')} (时间: {timestamp})")
-            elif item.get("type") == "video":
-                query_parts.append(f"视频URL: {item.get('url', '')} (时间: {timestamp})")
-            elif item.get("type") == "location":
-                query_parts.append(f"位置信息: {item.get('local_info', '')} (时间: {timestamp})")
-            elif item.get("type") == "file":
-                query_parts.append(f"文件内容: {item.get('content', '')} (时间: {timestamp})")
-            elif item.get("type") == "cite":
-                cite_content = json.loads(item.get('content', '{}'))
-                query_parts.append(f"对这条信息：{cite_content.get('content', '')} 的回复：{cite_content.get('title', '')} (时间: {timestamp})")
-        query = "客户输入信息:\n" + "\n".join(query_parts)
+        query = build_agent_query(request.user_input)
 
         # 调用智能体处理
-        agent_response_text = asyncio.run(call_agent_async(
+        agent_response_text = await call_agent_async(
             query=query,
             runner=runner,
             user_id=user_id,
             session_id=current_session_id,
-            request_body=request.model_dump()
-        ))
+            request_body=request.model_dump(exclude={"idempotency_key"}),
+            on_text=on_text if streaming_enabled else None
+        )
+
+        # 取代模式下，如果这次运行已被更新的客户消息取代，则放弃发送，由合并后的新任务回复
+        run_control = current_run_control()
+        if run_control is not None and not run_control.commit():
+            logger.info(f"智能体响应已过期，放弃发送 - user_id: {user_id}, session_id: {current_session_id}")
+            return
 
         responses = parse_agent_response(agent_response_text)
-        if not responses:
+        if streamed:
+            # 已流式发送过的消息不再重复发送，剩余部分（协作事项、跟单等）照常发送
+            # emitted_counts 按 content_list 数组出现的顺序记录，依次对应带 content_list 的回复对象
+            emitted_counts = iter(final_emitted_counts)
+            for index, agent_response in enumerate(responses):
+                if isinstance(agent_response, dict) and isinstance(agent_response.get("content_list"), list):
+                    responses[index] = {**agent_response, "content_list": agent_response["content_list"][next(emitted_counts, 0):]}
+            logger.info(f"已流式发送 {streamed} 条消息 - user_id: {user_id}, session_id: {current_session_id}")
+        if not responses and not streamed:
             # 解析失败，发送默认消息
             agent_response = {
                 "content_list": [
@@ -189,44 +341,191 @@ def process_agent_background(request: AgentRequest):
                     "follow_up_content": []
                 }
             }
-            send_notify(agent_response)
+            await send_notify(agent_response)
         else:
             for agent_response in responses:
-                send_notify(agent_response)
+                await send_notify(agent_response)
 
         logger.info(f"智能体处理完成 - user_id: {user_id}, session_id: {current_session_id}")
 
     except Exception as e:
+        if streamed:
+            # 已经给客户发送了部分回复，重试会导致重复消息，因此不再重试
+            logger.exception(f"后台处理失败，部分回复已发送，不再重试 - user_id: {user_id}, session_id: {current_session_id}, error: {e}")
+            return
         logger.exception(f"后台处理失败 - user_id: {user_id}, session_id: {current_session_id}, error: {e}")
-        # 发送错误通知
+        raise
+
+async def fail_agent_job(job: AgentJob, error: str):
+    """
+    处理单元失败：对应的持久化任务按退避策略重新排队，所有任务都不再重试时给客户发送兜底消息
+    """
+    will_retry = False
+    for job_id in job.job_ids:
+        will_retry = await asyncio.to_thread(agent_job_queue.nack, job_id, error) or will_retry
+    if not will_retry:
+        await send_error_notify(job.request)
+    update_idempotency_status(job, "retrying" if will_retry else "failed")
+
+def drop_agent_job(job: AgentJob):
+    """
+    合并批次因工作池排队已满被丢弃：归还准入名额，持久化任务按失败处理，稍后由 dispatch_agent_jobs 重新领取
+    """
+    release_admission(job)
+    worker_pool.run_coroutine(fail_agent_job(job, "工作池排队已满，合并批次被丢弃"))
+
+async def discard_agent_jobs(job_ids: list[int], reason: str):
+    """
+    放弃已入队但未被接收的请求对应的持久化任务，避免租约到期后被重新处理（调用方收到拒绝后会自行重试）
+    """
+    for job_id in job_ids:
         try:
-            error_msg = "🤔，让我想想"
-            asyncio.run(send_chat(
-                tenant_id=request.tenant_id,
-                task_id=request.task_id,
-                session_id=request.session_id,
-                belong_chat_id=request.belong_chat_id,
-                wechat_id=request.wechat_id,
-                chat_content=error_msg
-            ))
-        except Exception as notify_error:
-            logger.error(f"发送错误通知失败 - user_id: {user_id}, session_id: {current_session_id}, error: {notify_error}")
+            await asyncio.to_thread(agent_job_queue.discard, job_id, reason)
+        except Exception as e:
+            logger.error(f"放弃持久化任务失败 - job_id: {job_id}, error: {e}")
+
+async def process_agent_job(job: AgentJob):
+    """
+    工作池的处理函数：处理请求，成功后确认对应的持久化任务；
+    失败时按退避策略重试，所有任务都不再重试时才给客户发送兜底消息
+    """
+    try:
+        try:
+            await process_agent_background(job.request)
+        except Exception as e:
+            await fail_agent_job(job, str(e))
+            return
+        for job_id in job.job_ids:
+            await asyncio.to_thread(agent_job_queue.ack, job_id)
+        update_idempotency_status(job, "completed")
+    finally:
+        # 被取代的任务已合并进新任务，准入名额由新任务处理完成后归还
+        run_control = current_run_control()
+        if run_control is None or not run_control.superseded:
+            release_admission(job)
+
+# 持久化任务队列：请求在入队的同时被本进程领取，处理完成后确认；失败重试与崩溃恢复由 dispatch_agent_jobs 领取
+job_queue_config = config.get_agent_service_config('job_queue')
+agent_job_queue = PersistentJobQueue(
+    db_manager,
+    # 多进程会话亲和模式下每个分片使用独立的队列：重试的任务回到同一个进程，启动时的 recover() 也不会抢走其他进程的任务
+    queue_name="agent_request" if current_shard() is None else f"agent_request_{current_shard()}",
+    max_attempts=job_queue_config.get('max_attempts', 3),
+    base_backoff_seconds=job_queue_config.get('base_backoff_seconds', 5),
+    max_backoff_seconds=job_queue_config.get('max_backoff_seconds', 120),
+    cleanup_interval_seconds=job_queue_config.get('cleanup_interval_seconds', 3600),
+    retention_seconds=job_queue_config.get('retention_seconds', 7 * 24 * 3600),
+)
+job_lease_seconds = job_queue_config.get('lease_seconds', 900)
+
+async def dispatch_agent_jobs():
+    """
+    在工作池的事件循环中定期领取到期的持久化任务（失败重试、上次进程遗留的任务），提交到工作池，并按间隔清理过期任务
+    """
+    poll_interval = job_queue_config.get('poll_interval', 2)
+    while True:
+        try:
+            capacity = worker_pool.max_queue_size - worker_pool.stats()["queue_depth"]
+            jobs = await asyncio.to_thread(agent_job_queue.lease, min(capacity, 20), job_lease_seconds)
+            for index, job in enumerate(jobs):
+                request = AgentRequest(**job.payload)
+                # 重试和恢复的任务早已被接收，不再做准入检查，只计入在途请求
+                ticket = admission.try_acquire(request.tenant_id, force=True)
+                try:
+                    worker_pool.submit(
+                        AgentJob(request=request, job_ids=[job.id], tickets=[ticket], idempotency_keys=[compute_idempotency_key(request)]),
+                        key=request.session_id + request.task_id,
+                    )
+                except QueueFullError:
+                    ticket.release()
+                    # 这一批中未能提交的任务立即归还，下次轮询重新领取，而不是等租约到期
+                    await asyncio.to_thread(agent_job_queue.release, [remaining.id for remaining in jobs[index:]])
+                    raise
+        except QueueFullError:
+            logger.warning("工作池排队已满，暂停领取持久化任务")
+        except Exception as e:
+            logger.exception(f"领取持久化任务失败: {e}")
+        await asyncio.to_thread(agent_job_queue.cleanup_if_due)
+        await asyncio.sleep(poll_interval)
+
+# 后台工作池：所有请求在同一个常驻事件循环上由固定数量的工作协程处理
+worker_pool_config = config.get_agent_service_config('worker_pool')
+worker_pool = AgentWorkerPool(
+    handler=process_agent_job,
+    num_workers=worker_pool_config.get('num_workers', 8),
+    max_queue_size=worker_pool_config.get('max_queue_size', 200),
+    name="agent_worker_pool",
+    merge=merge_agent_jobs,
+    supersede=config.get_agent_service_config('supersede').get('enabled', False),
+    on_shutdown=close_http_session,
+)
+
+# 流式发送：开启后 content_list 中的消息逐条生成、逐条发送，客户收到第一条消息的时间约等于模型首段输出的延迟
+streaming_enabled = config.get_agent_service_config('streaming').get('enabled', False)
+
+# 消息合并：同一会话在防抖窗口内的连续消息合并为一次智能体调用
+debounce_config = config.get_agent_service_config('debounce')
+message_coalescer = MessageCoalescer(
+    pool=worker_pool,
+    merge=merge_agent_jobs,
+    window_seconds=debounce_config.get('window_seconds', 0),
+    max_wait_seconds=debounce_config.get('max_wait_seconds', 8),
+    on_drop=drop_agent_job,
+)
+
+# 幂等：网关超时重试时会重复推送同一批消息，在有效期内的重复请求直接返回原请求的处理状态，不再调用智能体
+idempotency_config = config.get_agent_service_config('idempotency')
+idempotency_store = TTLCache(
+    maxsize=idempotency_config.get('max_entries', 10000),
+    ttl=idempotency_config.get('ttl_seconds', 600),
+    name="idempotency",
+)
+
+# 准入控制：在途请求过多或预计排队时间过长时直接返回 429，而不是接收后在模型或数据库调用中超时
+admission = AdmissionController.from_config(
+    "agent",
+    concurrency=worker_pool.num_workers,
+    config=config.get_agent_service_config('admission').get('agent', {}),
+)
 
 @app.post("/process_user_input", response_model=AgentResponse)
-async def process_user_input(request: AgentRequest):
+async def process_user_input(request: AgentRequest, idempotency_key: str | None = Header(default=None, alias="Idempotency-Key")):
     user_id = request.task_id
     current_session_id = request.session_id 
     logger.info(f"收到请求 - user_id: {user_id}, session_id: {current_session_id}")
 
-    try:
-        # 使用线程在后台处理任务
-        background_thread = threading.Thread(
-            target=process_agent_background,
-            args=(request,),
-            daemon=True  # 设置为守护线程，主程序退出时自动结束
+    # 幂等检查：请求头中的 Idempotency-Key 优先于请求体中的 idempotency_key
+    if idempotency_key:
+        request = request.model_copy(update={"idempotency_key": idempotency_key})
+    request_key = compute_idempotency_key(request)
+    record, created = idempotency_store.setdefault(request_key, {"status": "processing", "accepted_at": datetime.now().isoformat()})
+    if not created:
+        logger.info(f"重复请求，返回原请求的处理状态 - user_id: {user_id}, session_id: {current_session_id}, status: {record['status']}")
+        return AgentResponse(
+            status=record["status"],
+            message="重复请求，已返回原请求的处理状态，不会再次处理。",
+            tenant_id=request.tenant_id,
+            task_id=request.task_id,
+            belong_chat_id=request.belong_chat_id,
+            wechat_id=request.wechat_id,
+            session_id=request.session_id
         )
-        background_thread.start()
-        
+
+    ticket = None
+    job_ids = []
+    try:
+        ticket = admission.try_acquire(request.tenant_id)
+        if worker_pool.is_full():
+            raise QueueFullError(f"排队任务数已达上限: {worker_pool.max_queue_size}")
+        # 先写入持久化任务队列，服务重启也不会丢失；数据库不可用时退化为仅内存处理
+        try:
+            job_ids = [await asyncio.to_thread(agent_job_queue.enqueue, request.model_dump(), job_lease_seconds)]
+        except Exception as e:
+            logger.error(f"写入持久化任务队列失败，仅在内存中处理 - user_id: {user_id}, session_id: {current_session_id}, error: {e}")
+            job_ids = []
+        # 经防抖窗口合并后提交到后台工作池，按 ADK 会话ID（session_id+task_id）串行，同一客户的消息严格按顺序处理
+        message_coalescer.add(request.session_id + request.task_id, AgentJob(request=request, job_ids=job_ids, tickets=[ticket], idempotency_keys=[request_key]))
+
         # 立即返回响应，不等待智能体处理完成
         return AgentResponse(
             status="processing",
@@ -237,8 +536,45 @@ async def process_user_input(request: AgentRequest):
             wechat_id=request.wechat_id,
             session_id=request.session_id
         )
+    except AdmissionRejected as e:
+        # 未被接收的请求不占用幂等键，网关可以重试
+        idempotency_store.pop(request_key)
+        raise HTTPException(
+            status_code=429,
+            detail=AgentResponse(
+                status="rejected",
+                message=f"服务繁忙（{e.reason}），请 {e.retry_after} 秒后重试。",
+                tenant_id=request.tenant_id,
+                task_id=request.task_id,
+                belong_chat_id=request.belong_chat_id,
+                wechat_id=request.wechat_id,
+                session_id=request.session_id
+            ).model_dump_json(),
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    except QueueFullError:
+        ticket.release()
+        idempotency_store.pop(request_key)
+        await discard_agent_jobs(job_ids, "工作池排队已满，请求被拒绝")
+        logger.warning(f"工作池排队已满，拒绝请求 - user_id: {user_id}, session_id: {current_session_id}, stats: {worker_pool.stats()}")
+        raise HTTPException(
+            status_code=503,
+            detail=AgentResponse(
+                status="rejected",
+                message="服务繁忙，请求队列已满，请稍后重试。",
+                tenant_id=request.tenant_id,
+                task_id=request.task_id,
+                belong_chat_id=request.belong_chat_id,
+                wechat_id=request.wechat_id,
+                session_id=request.session_id
+            ).model_dump_json()
+        )
     except Exception as e:
+        if ticket is not None:
+            ticket.release()
+        idempotency_store.pop(request_key)
         logger.exception(f"处理请求失败 - user_id: {user_id}, session_id: {current_session_id}")
+        await discard_agent_jobs(job_ids, f"请求处理失败: {e}")
         raise HTTPException(
             status_code=500,
             detail=AgentResponse(
@@ -252,6 +588,25 @@ async def process_user_input(request: AgentRequest):
             ).model_dump_json()
         )
 
+@app.get("/worker_pool/stats")
+async def worker_pool_stats():
+    """
+    查看后台工作池的排队深度和工作协程利用率
+    """
+    return {
+        **worker_pool.stats(),
+        "admission": admission.stats(),
+        "idempotency": idempotency_store.stats(),
+        "prompt_cache": prompt_cache_stats(),
+        "llm_calls": llm_call_stats(),
+        "tool_memo": tool_memo_stats(),
+        "db_queries": query_stats(),
+        "reference_cache": reference_cache_stats(),
+        "wechat_name_cache": wechat_name_cache_stats(),
+        "debounce": message_coalescer.stats(),
+        "job_queue": await asyncio.to_thread(agent_job_queue.stats),
+    }
+
 @app.post("/delete_session", response_model=AgentResponse)
 async def delete_session(request: AgentRequest):
     session_id = request.session_id
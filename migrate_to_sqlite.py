@@ -15,7 +15,7 @@ from datetime import datetime
 # 添加项目根目录到Python路径
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from tools.database_migration import DatabaseMigrator
+from tools.database_migration import DatabaseMigrator, create_hot_query_indexes
 from sqlalchemy import create_engine, text
 import json
 import logging
@@ -219,6 +219,7 @@ class SensitiveDataMigrator(DatabaseMigrator):
             except Exception as e:
                 logger.error(f"迁移表 {table_name} 失败: {e}")
         
+        create_hot_query_indexes(target_engine)
         logger.info("SQLite迁移完成（数据已脱敏）")
         return target_db_path
     
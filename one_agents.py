@@ -2,12 +2,14 @@ from google.adk.agents import Agent, LlmAgent, SequentialAgent, ParallelAgent
 from google.adk.models.lite_llm import LiteLlm # 用于多模型支持
 from utils.config_loader import ConfigLoader
 from prompts.prompts import input_process_prompt, scheduler_prompt, customer_portrait_prompt, customer_behavior_prompt, collaborate_prompt, follow_up_prompt, get_collaborate_prompt, send_file_prompt, one_to_N_prompt
-from tools.callbacks import check_prompt_protection, dynamic_one_to_N_agent_instruction_before_model
+from tools.callbacks import check_prompt_protection, dynamic_one_to_N_agent_instruction_before_model, start_tool_calls_after_model
 from tools.input_process import image_comprehension, video_comprehension, read_file, get_detailed_time
-from tools.core_logic import select_file
-from utils.db_queries import select_collaborate_matters, select_product, select_wechat_name
+from tools.core_logic import select_file, select_collaborate_matters, select_product
+from utils.db_queries import select_wechat_name
 from utils.db_insert import insert_customer_behavior
 from utils.db_queries import update_customer_portrait
+from utils.async_db import async_db_tool
+from utils.tool_memo import memoize_tools
 config = ConfigLoader()
 
 qwen_base_url = config.get_api_key('qwen', 'base_url')
@@ -34,8 +36,10 @@ one_to_N_agent = LlmAgent(
     name="one_to_N_agent",
     description="公司的销售人员，负责与客户进行沟通，并根据客户的需求，回复客户信息。完成销售任务。",
     instruction=one_to_N_prompt,
-    tools=[image_comprehension, video_comprehension,read_file,get_detailed_time,update_customer_portrait,insert_customer_behavior, select_collaborate_matters, select_file, select_product,select_wechat_name],
+    # 访问数据库的工具包装为协程，在数据库线程池中执行，不阻塞事件循环；只读工具按 tool_memo 配置缓存结果
+    tools=memoize_tools([image_comprehension, video_comprehension,read_file,get_detailed_time,async_db_tool(update_customer_portrait),async_db_tool(insert_customer_behavior), async_db_tool(select_collaborate_matters), async_db_tool(select_file), async_db_tool(select_product),async_db_tool(select_wechat_name)]),
     before_model_callback=dynamic_one_to_N_agent_instruction_before_model,
+    after_model_callback=start_tool_calls_after_model,
     before_agent_callback=check_prompt_protection,
 )
 
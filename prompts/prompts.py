@@ -1,6 +1,8 @@
-from utils.db_queries import select_ai_data
+from utils.db_queries import select_ai_data, TaskContext, get_task_context, load_task_context
 from utils.create_role import restore_content_from_database
-import random
+from utils.async_db import run_db
+import json
+import zlib
 
 strategy_prompt = """
 你是一位专业的销售策略顾问。基于以下公司信息和产品信息，请生成详细的销售策略指南：
@@ -36,6 +38,24 @@ strategy_prompt = """
 """
 
 # prompts/prompts.py
+# 三种性格模板，任务未保存系统提示词时按任务固定选择其中一种
+PERSONALITY_TEMPLATES = [
+    '''[性格特点] 专业\n语言风格应严谨、客观、干练、逻辑清晰。  \n简洁至上： 杜绝"非常感谢您的……"、"很高兴为您……"等无信息量的客套话。用"好的"、"没问题"、"收到"等词语直接回应，你的礼貌体现在为客户解决问题的效率上。  \n主动推进： 绝不让客户做"填空题"。在需要决策时，必须主动提出具体的"选择题"。例如，客户说"明天有空"，应立即追问"太好了，那明天下午2点可以吗？"，而不是反问"您看明天具体几点方便呢？"。  \n确认并推进： 不要复述客户信息进行确认。收到时间和地址后，直接推进下一步，例如："好的，那我们明天下午2点贵公司见"。  \n标点要求：回复中避免使用句号"。"结尾或不使用标点结尾，以避免生硬感，以营造干练且不生硬的对话感。''',
+    '''[性格特点] 热情\n语言风格应积极、主动、充满关怀。  \n用活力代替客套： 用"太棒啦！"、"没问题！"、"别担心！"这类充满积极情绪的词语，代替"非常感谢您……"的空洞客套。你的关怀体现在为客户带来积极体验和高效推进上。  \n主动推进： 绝不让客户费心。在需要决策时，必须主动提出具体的、充满热情的建议。例如，客户说"明天有空"，应立即追问"太好了！那下午2点怎么样？我这边刚好有空，非常期待和您聊聊~"，而不是反问"您看明天具体几点方便呢？"，把问题抛回给客户。  \n确认并推进： 不要做简单的信息复述。收到地址后，可以用热情的方式直接推进，例如："收到啦~ 明天我一定准时到！"  \n标点要求：回复中避免使用句号"。"结尾，在句末适当使用波浪号"~"，以营造亲近感和积极的对话氛围。''',
+    '''[性格特点] 幽默\n语言风格应轻松、有趣、偶尔自嘲。  \n用机智代替客套： 用"搞定！"、"妥了~"、"这事儿包在我身上"这类轻松的网络热词或俏皮话，代替一本正经的客套。你的可靠性体现在举重若轻地把事情办妥上。  \n主动破局： 绝不让沟通陷入僵局。在需要决策时，必须用一种幽默的方式主动提出具体建议。例如，客户说"明天有空"，可以追问"选日子不如撞日子，就明天下午2点，咱碰一个？"，而不是让客户自己想。  \n确认并推进： 不要做无聊的信息复述。收到地址后，可以用幽默的方式确认并推进，例如："好滴~明天2点见啦"  \n标点要求：回复中避免使用句号"。"结尾，在句末适当使用波浪号"~"，以保持轻松、有趣的对话风格。这事儿包在我身上"等来表达。回复中避免使用句号"。"，可以使用逗号"，"或在句末适当使用波浪号"~"。'''
+]
+
+
+def select_personality(tenant_id: int, task_id: int) -> str:
+    """
+    为任务选择性格模板。
+    按 (租户, 任务) 的哈希固定选择，同一任务在任何进程、任何时间得到的提示词完全相同，
+    这样模型服务端的前缀缓存才能命中。
+    """
+    index = zlib.crc32(f"{tenant_id}:{task_id}".encode("utf-8")) % len(PERSONALITY_TEMPLATES)
+    return PERSONALITY_TEMPLATES[index]
+
+
 def get_role_prompt(base_info: str, company_info: str, product_info: str, communication_style: str) -> str:
     """
     生成销售角色设计的提示词。
@@ -452,16 +472,10 @@ def get_one_to_N_chat_test_prompt(tenant_id: int, task_id: int) -> str:
     生成one_to_N提示词。
     """
     from tools.tools import restore_sale_flow_format, restore_prohibit_format
-    from utils.db_queries import select_sale_system_prompt, select_sale_process, select_forbidden_content
-    system_prompt = select_sale_system_prompt(tenant_id, task_id)
+    context = load_task_context(tenant_id, task_id)
+    system_prompt = context.system_prompt
     if not system_prompt:
-        # 定义三种性格模板
-        personality_templates = [
-            '''[性格特点] 专业\n语言风格应严谨、客观、干练、逻辑清晰。  \n简洁至上： 杜绝"非常感谢您的……"、"很高兴为您……"等无信息量的客套话。用"好的"、"没问题"、"收到"等词语直接回应，你的礼貌体现在为客户解决问题的效率上。  \n主动推进： 绝不让客户做"填空题"。在需要决策时，必须主动提出具体的"选择题"。例如，客户说"明天有空"，应立即追问"太好了，那明天下午2点可以吗？"，而不是反问"您看明天具体几点方便呢？"。  \n确认并推进： 不要复述客户信息进行确认。收到时间和地址后，直接推进下一步，例如："好的，那我们明天下午2点贵公司见"。  \n标点要求：回复中避免使用句号"。"结尾或不使用标点结尾，以避免生硬感，以营造干练且不生硬的对话感。''',
-            '''[性格特点] 热情\n语言风格应积极、主动、充满关怀。  \n用活力代替客套： 用"太棒啦！"、"没问题！"、"别担心！"这类充满积极情绪的词语，代替"非常感谢您……"的空洞客套。你的关怀体现在为客户带来积极体验和高效推进上。  \n主动推进： 绝不让客户费心。在需要决策时，必须主动提出具体的、充满热情的建议。例如，客户说"明天有空"，应立即追问"太好了！那下午2点怎么样？我这边刚好有空，非常期待和您聊聊~"，而不是反问"您看明天具体几点方便呢？"，把问题抛回给客户。  \n确认并推进： 不要做简单的信息复述。收到地址后，可以用热情的方式直接推进，例如："收到啦~ 明天我一定准时到！"  \n标点要求：回复中避免使用句号"。"结尾，在句末适当使用波浪号"~"，以营造亲近感和积极的对话氛围。''',
-            '''[性格特点] 幽默\n语言风格应轻松、有趣、偶尔自嘲。  \n用机智代替客套： 用"搞定！"、"妥了~"、"这事儿包在我身上"这类轻松的网络热词或俏皮话，代替一本正经的客套。你的可靠性体现在举重若轻地把事情办妥上。  \n主动破局： 绝不让沟通陷入僵局。在需要决策时，必须用一种幽默的方式主动提出具体建议。例如，客户说"明天有空"，可以追问"选日子不如撞日子，就明天下午2点，咱碰一个？"，而不是让客户自己想。  \n确认并推进： 不要做无聊的信息复述。收到地址后，可以用幽默的方式确认并推进，例如："好滴~明天2点见啦"  \n标点要求：回复中避免使用句号"。"结尾，在句末适当使用波浪号"~"，以保持轻松、有趣的对话风格。这事儿包在我身上"等来表达。回复中避免使用句号"。"，可以使用逗号"，"或在句末适当使用波浪号"~"。'''
-        ]
-        selected_personality = random.choice(personality_templates)
+        selected_personality = select_personality(tenant_id, task_id)
         system_prompt = f"""
 [角色与任务描述]
 你是顶尖的销售顾问，你的任务是牢记自己的销售使命，引导客户走完预设的销售流程。与客户的每一次互动，都是为了推动流程进入下一个阶段。
@@ -470,8 +484,8 @@ def get_one_to_N_chat_test_prompt(tenant_id: int, task_id: int) -> str:
 {selected_personality}
 """
    #  test_prompt = await restore_content_from_database(tenant_id, task_id)
-    origin_sale_flow = select_sale_process(tenant_id, task_id)
-    origin_prohibit = select_forbidden_content(tenant_id, task_id)
+    origin_sale_flow = context.sale_process
+    origin_prohibit = context.forbidden_content
     try:
       sale_flow = restore_sale_flow_format(origin_sale_flow)
       
@@ -515,6 +529,19 @@ async def get_one_to_N_prompt(tenant_id: int, task_id: int, wechat_name: str, re
     """
     生成one_to_N提示词。
     """
+    context = await run_db(get_task_context, tenant_id, task_id, None, True)
+    return render_one_to_N_prompt(build_one_to_N_prompt_prefix(context, wechat_name), request_data)
+
+def build_one_to_N_prompt_prefix(context: TaskContext, wechat_name: str = None, prefetch_tools: bool = False) -> str:
+    """
+    根据任务数据生成one_to_N提示词中与本次请求无关的部分，可按租户、任务缓存。
+    wechat_name 为空时使用 context 中工作机的微信昵称。
+    prefetch_tools 为 True 时把 select_collaborate_matters、select_file、select_product 的结果直接写进提示词，
+    模型不需要再为这些只读查询多走一轮工具调用。
+    各部分按稳定程度排列：所有租户通用的规则在前，任务级的销售流程、禁止事项其次，带工作机昵称的角色设定最后，
+    同一任务、同一工作机每次生成的结果逐字节相同，作为模型服务端前缀缓存的公共前缀。
+    本次请求的数据由 render_one_to_N_prompt 追加在末尾。
+    """
     priority_prompt = """
 [最高指令]
 ## 1. 角色锚定
@@ -536,17 +563,11 @@ async def get_one_to_N_prompt(tenant_id: int, task_id: int, wechat_name: str, re
 此原则的优先级高于一切，你必须严格遵守，绝不偏离。
 """
     from tools.tools import restore_sale_flow_format, restore_prohibit_format
-    from utils.db_queries import select_sale_system_prompt, select_sale_process, select_forbidden_content
-    system_prompt = select_sale_system_prompt(tenant_id, task_id)
+    wechat_name = wechat_name or context.wechat_name
+    system_prompt = context.system_prompt
     
     if not system_prompt:
-        # 定义三种性格模板
-        personality_templates = [
-            '''[性格特点] 专业\n语言风格应严谨、客观、干练、逻辑清晰。  \n简洁至上： 杜绝"非常感谢您的……"、"很高兴为您……"等无信息量的客套话。用"好的"、"没问题"、"收到"等词语直接回应，你的礼貌体现在为客户解决问题的效率上。  \n主动推进： 绝不让客户做"填空题"。在需要决策时，必须主动提出具体的"选择题"。例如，客户说"明天有空"，应立即追问"太好了，那明天下午2点可以吗？"，而不是反问"您看明天具体几点方便呢？"。  \n确认并推进： 不要复述客户信息进行确认。收到时间和地址后，直接推进下一步，例如："好的，那我们明天下午2点贵公司见"。  \n标点要求：回复中避免使用句号"。"结尾或不使用标点结尾，以避免生硬感，以营造干练且不生硬的对话感。''',
-            '''[性格特点] 热情\n语言风格应积极、主动、充满关怀。  \n用活力代替客套： 用"太棒啦！"、"没问题！"、"别担心！"这类充满积极情绪的词语，代替"非常感谢您……"的空洞客套。你的关怀体现在为客户带来积极体验和高效推进上。  \n主动推进： 绝不让客户费心。在需要决策时，必须主动提出具体的、充满热情的建议。例如，客户说"明天有空"，应立即追问"太好了！那下午2点怎么样？我这边刚好有空，非常期待和您聊聊~"，而不是反问"您看明天具体几点方便呢？"，把问题抛回给客户。  \n确认并推进： 不要做简单的信息复述。收到地址后，可以用热情的方式直接推进，例如："收到啦~ 明天我一定准时到！"  \n标点要求：回复中避免使用句号"。"结尾，在句末适当使用波浪号"~"，以营造亲近感和积极的对话氛围。''',
-            '''[性格特点] 幽默\n语言风格应轻松、有趣、偶尔自嘲。  \n用机智代替客套： 用"搞定！"、"妥了~"、"这事儿包在我身上"这类轻松的网络热词或俏皮话，代替一本正经的客套。你的可靠性体现在举重若轻地把事情办妥上。  \n主动破局： 绝不让沟通陷入僵局。在需要决策时，必须用一种幽默的方式主动提出具体建议。例如，客户说"明天有空"，可以追问"选日子不如撞日子，就明天下午2点，咱碰一个？"，而不是让客户自己想。  \n确认并推进： 不要做无聊的信息复述。收到地址后，可以用幽默的方式确认并推进，例如："好滴~明天2点见啦"  \n标点要求：回复中避免使用句号"。"结尾，在句末适当使用波浪号"~"，以保持轻松、有趣的对话风格。这事儿包在我身上"等来表达。回复中避免使用句号"。"，可以使用逗号"，"或在句末适当使用波浪号"~"。'''
-        ]
-        selected_personality = random.choice(personality_templates)
+        selected_personality = select_personality(context.tenant_id, context.task_id)
         system_prompt = f"""
 [角色与任务描述]
 你是顶尖的销售顾问{wechat_name}，你的核心任务是强力主导并推进销售流程，严禁被动应答。
@@ -556,8 +577,8 @@ async def get_one_to_N_prompt(tenant_id: int, task_id: int, wechat_name: str, re
     else:
         system_prompt = add_name_to_profile(system_prompt.strip(), wechat_name)
    #  test_prompt = await restore_content_from_database(tenant_id, task_id)
-    origin_sale_flow = select_sale_process(tenant_id, task_id)
-    origin_prohibit = select_forbidden_content(tenant_id, task_id)
+    origin_sale_flow = context.sale_process
+    origin_prohibit = context.forbidden_content
     try:
       sale_flow = restore_sale_flow_format(origin_sale_flow)
       
@@ -580,23 +601,97 @@ async def get_one_to_N_prompt(tenant_id: int, task_id: int, wechat_name: str, re
 4. 严禁使用“机器人语言”：“客套与感谢”类废话（如：非常理解.../非常感谢您的.../为了更好地服务您）；“流程解释与信息确认”类废话（如：已经收到具体位置/我将为您查询相关信息）。
 5. 标点要求：必要时多用逗号“，”或“、”；使用问号“？”或“~”或不用标点符号结尾，不使用句号“。”结尾，避免生硬感。
 """
-    tools_prompt = f"""
-[** 工具调用方法 **] <-- 这个很重要，请仔细阅读并判断是否需要使用工具。
+    output_format_prompt, attention_prompt = _one_to_N_output_prompts()
+    if prefetch_tools:
+        tools_prompt = ONE_TO_N_PREFETCHED_TOOLS_PROMPT
+        prohibit = f"{prohibit}\n---\n{_one_to_N_prefetched_data_prompt(context)}"
+    else:
+        tools_prompt = ONE_TO_N_TOOLS_PROMPT
+    return f"""
+{priority_prompt}
+---
+{communicate_prompt}
+---
+{tools_prompt}
+---
+{output_format_prompt}
+---
+{attention_prompt}
+---
+{sale_flow}
+---
+{prohibit}
+---
+{system_prompt}
+"""
+
+def render_one_to_N_prompt(prefix: str, request_data: dict, customer_name: str = None) -> str:
+    """
+    在 build_one_to_N_prompt_prefix 的结果后追加本次请求的 request_data，拼成完整的one_to_N提示词。
+    customer_name 不为空时（预取模式）一并写入客户的微信昵称。
+    """
+    customer_prompt = f"客户的微信昵称：{customer_name}\n" if customer_name is not None else ""
+    return f"""{prefix}---
+[本次请求参数]
 各种工具调用传入的参数：
    request_data:
       {request_data}
+{customer_prompt}"""
+
+def _one_to_N_prefetched_data_prompt(context: TaskContext) -> str:
+    """
+    预取模式下写进提示词的只读工具结果，格式与对应工具的返回值相同。
+    """
+    def dump(rows) -> str:
+        return json.dumps([dict(row) for row in rows], ensure_ascii=False, default=str)
+
+    files = [{"file_description": data["ai_text"], "file_url": data["url"]} for data in context.ai_data]
+    return f"""
+[已查询的资料] 以下内容与对应工具的返回结果相同，已是最新数据，不需要再调用这些工具。
+协作事项（select_collaborate_matters）：
+   {dump(context.collaborate_matters)}
+可发送给客户的文件（select_file）：
+   {dump(files)}
+产品信息（select_product）：
+   {dump(context.products)}
+"""
+
+# one_to_N 智能体的工具调用规则，开启工具预取（prefetch_tools）时只替换数据来源的说明，其余规则共用
+_ONE_TO_N_TOOLS_TEMPLATE = """
+[** 工具调用方法 **] <-- 这个很重要，请仔细阅读并判断是否需要使用工具。
+各种工具调用传入的参数见提示词末尾的 [本次请求参数]。
 你可以使用以下工具来完成你的任务(请严格遵守工具调用方法,所有工具需要的参数都可以从request_data中获取，禁止自己随便生成id，严格按照request_data中的id来使用工具)：
 1. 当客户发图片时，使用image_comprehension工具，将图片转换为文本。
 2. 当客户发视频时，使用video_comprehension工具，将视频转换为文本。
 3. 当客户发文件时，使用read_file工具，读取文件内容。
-4. 当客户咨询是否有公司或产品相关资料可看时，使用select_file工具查询文件列表，你仔细阅读查询到的每个文件描述的触发场景，判断是否有合适的文件可发送给客户，如果有则在最后的结果中添加可发送给客户的文件url。
-5. 当客户咨询产品的具体信息（如价格）时，使用select_product工具查询产品列表，你仔细阅读查询到的每个产品信息，判断是否有对应的产品信息发送给客户，如果有则在最后的结果中添加要发送给客户的文件url。在回复客户时严格按照产品的报价策略，不能出现价格不一致的情况，且一定不能低于最低价格。灵活和客户拉扯。
+4. 当客户咨询是否有公司或产品相关资料可看时，{file_source}的触发场景，判断是否有合适的文件可发送给客户，如果有则在最后的结果中添加可发送给客户的文件url。
+5. 当客户咨询产品的具体信息（如价格）时，{product_source}，判断是否有对应的产品信息发送给客户，如果有则在最后的结果中添加要发送给客户的文件url。在回复客户时严格按照产品的报价策略，不能出现价格不一致的情况，且一定不能低于最低价格。灵活和客户拉扯。
 6. 当客户透漏相关信息的时候，使用update_customer_portrait工具，更新客户画像。
 7. 当你认为客户发送的消息需要重点标出、给到后续真人销售跟进参考时，你需要按标题+内容格式输出客户行为（行为标题生成规则：提炼客户和兴行为/需求，突出客户关键诉求；行为内容生成规则：补充关联细节，如客户现状/顾虑/关注重点或使用场景等），并使用insert_customer_behavior工具，更新客户行为。
-8. 每次回答客户问题时必须使用select_collaborate_matters工具查询协作事项，你仔细阅读协作事项的每个触发场景描述，结合当前客户发送的消息判断是否需要触发协作事项（注意这个协作事项必须是你收集完核心信息才触发，比如客户答应线下见面、但仅有时间没地址则不触发）,如果需要触发则在最终的结果中添加协作事项的id和通知文本。通知文本是用于告知人类需要协作，需包含本次协作的核心信息生成一条完整的、可执行的通知文本，如“客户答应周五下午2点（yyyy-MM-DD hh：mm）在客户公司见面”（基于客户沟通中确认的相对时间，可使用get_detailed_time工具获取当前时间后计算得出具体时间）。
+8. 每次回答客户问题时必须{collaborate_source}，你仔细阅读协作事项的每个触发场景描述，结合当前客户发送的消息判断是否需要触发协作事项（注意这个协作事项必须是你收集完核心信息才触发，比如客户答应线下见面、但仅有时间没地址则不触发）,如果需要触发则在最终的结果中添加协作事项的id和通知文本。通知文本是用于告知人类需要协作，需包含本次协作的核心信息生成一条完整的、可执行的通知文本，如“客户答应周五下午2点（yyyy-MM-DD hh：mm）在客户公司见面”（基于客户沟通中确认的相对时间，可使用get_detailed_time工具获取当前时间后计算得出具体时间）。
 9. 和客户预约时间时，使用get_detailed_time工具，获取当前时间。
-10. 使用select_wechat_name工具，查询客户的微信昵称。在每个协作事项内容中都要说明是哪一个客户。例如：客户是张三，则协作事项内容中要说明是张三做了什么。
+10. {wechat_name_source}。在每个协作事项内容中都要说明是哪一个客户。例如：客户是张三，则协作事项内容中要说明是张三做了什么。
 """
+
+ONE_TO_N_TOOLS_PROMPT = _ONE_TO_N_TOOLS_TEMPLATE.format(
+    file_source="使用select_file工具查询文件列表，你仔细阅读查询到的每个文件描述",
+    product_source="使用select_product工具查询产品列表，你仔细阅读查询到的每个产品信息",
+    collaborate_source="使用select_collaborate_matters工具查询协作事项",
+    wechat_name_source="使用select_wechat_name工具，查询客户的微信昵称",
+)
+
+# 预取模式下的工具说明：协作事项、文件、产品和客户昵称已写在提示词中，对应条目改为直接阅读
+ONE_TO_N_PREFETCHED_TOOLS_PROMPT = _ONE_TO_N_TOOLS_TEMPLATE.format(
+    file_source="仔细阅读 [已查询的资料] 中每个文件描述",
+    product_source="仔细阅读 [已查询的资料] 中的每个产品信息",
+    collaborate_source="对照 [已查询的资料] 中的协作事项",
+    wechat_name_source="客户的微信昵称见 [本次请求参数]",
+)
+
+def _one_to_N_output_prompts() -> tuple[str, str]:
+    """
+    one_to_N提示词中的输出格式和注意事项部分。
+    """
     output_format_prompt = f"""
 [输出格式]
 ** 只输出json，不要输出其他内容。**
@@ -677,43 +772,32 @@ async def get_one_to_N_prompt(tenant_id: int, task_id: int, wechat_name: str, re
 9. 请勿使用“机器人语言”：“客套与感谢”类废话（如：非常理解.../非常感谢您的.../为了更好地服务您）；“流程解释与信息确认”类废话（如：已经收到具体位置/我将为您查询相关信息/
 10. **你是一个真人**
 """
-    return f"""
-{priority_prompt}
----
-{system_prompt}
----
-{communicate_prompt}
----
-{sale_flow}
----
-{tools_prompt}
----
-{prohibit}
----
-{output_format_prompt}
----
-{attention_prompt}
-"""
+    return output_format_prompt, attention_prompt
     
 
 async def get_chat_prompt(tenant_id: int, task_id: int) -> str:
     """
     生成聊天提示词。
     """
-    system_prompt = select_sale_system_prompt(tenant_id, task_id)
-    test_prompt = await restore_content_from_database(tenant_id, task_id)
+    context = await run_db(get_task_context, tenant_id, task_id)
+    system_prompt = context.system_prompt
+    # 与 restore_content_from_database 的拼接格式一致
+    sale_process = [dict(step) for step in context.sale_process]
+    test_prompt = f"{sale_process}\n\n{list(context.forbidden_content)}"
+    supplement = get_chat_prompt_supplement(tenant_id, task_id, [dict(data) for data in context.ai_data])
     return f"""
     {system_prompt}
     {test_prompt}
 
-    {get_chat_prompt_supplement(tenant_id, task_id)}
+    {supplement}
     """
 
-def get_chat_prompt_supplement(tenant_id: int, task_id: int) -> str:
+def get_chat_prompt_supplement(tenant_id: int, task_id: int, ai_data: list[dict] = None) -> str:
    """
-    生成聊天补充提示词。
+    生成聊天补充提示词。ai_data 为空时从数据库查询。
    """
-   ai_data = select_ai_data(tenant_id, task_id)
+   if ai_data is None:
+      ai_data = select_ai_data(tenant_id, task_id)
    print(f"task_id: {task_id}, tenant_id: {tenant_id}, ai_data数据是: {ai_data}")
    ai_data_str = '没有相关文件'
    if ai_data is [] :
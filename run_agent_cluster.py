@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+主对话服务多进程启动脚本（会话亲和）
+
+启动 N 个 main_v2 工作进程，并在对外端口上按会话转发请求，同一会话始终由同一个工作进程处理。
+不要对 main_v2 使用 uvicorn --workers，它会把同一会话的消息分散到不同进程。
+"""
+
+import uvicorn
+import os
+import sys
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# 导入统一的日志配置
+from utils.logger_config import get_api_logger
+
+# 获取API服务的日志记录器
+logger = get_api_logger()
+
+from utils.session_cluster import AgentCluster, create_router_app
+
+if __name__ == "__main__":
+    # 配置服务器参数
+    host = os.getenv("HOST", "0.0.0.0")
+    port = int(os.getenv("PORT", 11480))
+    num_workers = int(os.getenv("AGENT_WORKERS", os.cpu_count() or 1))
+    base_port = int(os.getenv("AGENT_WORKER_BASE_PORT", port + 100))
+    app = os.getenv("AGENT_APP", "main_v2:app")
+
+    logger.info("启动主对话服务（多进程会话亲和模式）...")
+    logger.info(f"服务地址: http://{host}:{port}")
+    logger.info(f"工作进程数: {num_workers}, 内部端口: {base_port}~{base_port + num_workers - 1}")
+
+    cluster = AgentCluster(app, num_workers, base_port)
+    cluster.start()
+    try:
+        if not cluster.wait_ready():
+            logger.warning("部分工作进程未在预期时间内就绪，路由将先行启动")
+        # 启动路由
+        uvicorn.run(
+            create_router_app(cluster.worker_urls, cluster),
+            host=host,
+            port=port,
+            log_level="info"
+        )
+    finally:
+        cluster.stop()
@@ -2,7 +2,7 @@ import os
 import requests
 import json
 from core.database_core import db_manager
-from prompts.prompts import select_ai_data
+from utils.db_queries import get_task_context
 
 def generate_customer_portrait(user_input: str) -> dict:
     """根据历史聊天记录和用户发送的最新信息 生成或更新 用户画像。
@@ -215,7 +215,7 @@ def select_file(tenant_id: int, task_id: int) -> dict:
         }
     """
     try:
-        ai_data = select_ai_data(tenant_id, task_id)
+        ai_data = get_task_context(tenant_id, task_id).ai_data
         file_list = []
         for data in ai_data:
             file_list.append({
@@ -232,3 +232,38 @@ def select_file(tenant_id: int, task_id: int) -> dict:
             "status": "error",
             "message": f"没有相关文件或者查询文件失败: {str(e)}"
         }
+
+
+def select_product(tenant_id: int, task_id: int) -> list[dict]:
+    """
+    根据租户ID和任务ID，查询任务的产品。
+
+    Args:
+        tenant_id: 租户ID
+        task_id: 任务ID
+
+    Returns:
+        list[dict]: 任务的产品
+    """
+    try:
+        return [dict(product) for product in get_task_context(tenant_id, task_id).products]
+    except Exception as e:
+        return f"查询任务的产品失败: {str(e)}"
+
+
+def select_collaborate_matters(tenant_id: int, task_id: int) -> list[dict]:
+    """
+    根据租户ID和任务ID，查询对应的协作事项的ID、标题和内容。
+
+    Args:
+        tenant_id (int): 租户ID。
+        task_id (int): 任务ID。
+
+    Returns:
+        list[dict]: 包含协作事项信息（id, title, text）的字典列表。
+                    如果查询失败或无结果，返回空列表（或根据需要处理异常）。
+    """
+    try:
+        return [dict(matter) for matter in get_task_context(tenant_id, task_id).collaborate_matters]
+    except Exception as e:
+        return [f"查询协作事项失败: {str(e)}"]
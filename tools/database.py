@@ -1,11 +1,147 @@
 import yaml
 import os
 import sqlalchemy
-from sqlalchemy import text
+from sqlalchemy import event, text
+from sqlalchemy.pool import QueuePool
 import logging
+import re
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, List, Optional, Union
+from sqlalchemy.sql.elements import TextClause
 
 logger = logging.getLogger(__name__)
 
+
+class StatementRegistry:
+    """
+    具名 SQL 语句注册表。
+
+    语句在模块导入时注册一次，编译为 TextClause，执行时只绑定参数（:name 形式）。
+    SQL 文本固定不变，SQLAlchemy 的编译缓存和驱动的语句缓存（如 sqlite3 的 cached_statements）都能命中，
+    参数由驱动转义，不再需要手工 replace("'", "''")。
+    """
+
+    def __init__(self):
+        self._statements: Dict[str, TextClause] = {}
+        self._names: Dict[int, str] = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str, sql: str) -> TextClause:
+        """
+        注册一条语句，同名同文本重复注册时返回已有的语句。
+
+        Args:
+            name (str): 语句名称，如 "select_ai_data"
+            sql (str): 使用 :参数名 占位的 SQL
+
+        Returns:
+            TextClause: 编译后的语句，可直接传给 DatabaseManager 的各个执行方法
+        """
+        with self._lock:
+            statement = self._statements.get(name)
+            if statement is not None:
+                if statement.text != sql:
+                    raise ValueError(f"SQL 语句名称重复: {name}")
+                return statement
+            statement = self._statements[name] = text(sql)
+            self._names[id(statement)] = name
+            return statement
+
+    def get(self, name: str) -> TextClause:
+        """
+        按名称获取已注册的语句。
+
+        Args:
+            name (str): 语句名称
+
+        Returns:
+            TextClause: 编译后的语句
+        """
+        return self._statements[name]
+
+    def names(self) -> list:
+        """已注册的语句名称"""
+        return sorted(self._statements)
+
+    def name_of(self, statement: TextClause) -> Optional[str]:
+        """
+        已注册语句的名称。
+
+        Args:
+            statement (TextClause): 语句
+
+        Returns:
+            Optional[str]: 名称，未注册的语句返回 None
+        """
+        return self._names.get(id(statement))
+
+
+statements = StatementRegistry()
+
+
+def _statement(query: Union[str, TextClause]) -> TextClause:
+    return query if isinstance(query, TextClause) else text(query)
+
+
+_LITERAL_PATTERN = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+_COMMENT_PATTERN = re.compile(r"--[^\n]*")
+_SPACE_PATTERN = re.compile(r"\s+")
+
+
+def compact_sql(sql: str) -> str:
+    """去掉 SQL 中的行注释并把空白压缩为单个空格，用于日志和统计"""
+    return _SPACE_PATTERN.sub(" ", _COMMENT_PATTERN.sub("", sql)).strip()
+
+
+def statement_name(statement: TextClause) -> str:
+    """
+    语句的统计名称：注册过的语句用注册名称，其余用去掉字面量后的 SQL 开头，
+    使拼接了不同参数的同一条 SQL 归为一类。
+    """
+    name = statements.name_of(statement)
+    if name is not None:
+        return name
+    return _LITERAL_PATTERN.sub("?", compact_sql(statement.text))[:80]
+
+
+@dataclass
+class QueryEvent:
+    """一次语句执行的记录，传给 DatabaseManager.add_query_hook 注册的钩子"""
+    name: str                 # 统计名称，见 statement_name
+    sql: str                  # SQL 文本
+    params: Any               # 绑定参数（批量执行时为参数列表）
+    elapsed_ms: float         # 执行并取回结果的耗时
+    rows: int                 # 查询返回的行数，或写入影响的行数
+    pool_wait_ms: float       # 从连接池取得连接的耗时，同一连接上后续的语句为 0
+    error: Optional[str] = None
+
+
+_PRAGMA_NAME_PATTERN = re.compile(r"^[A-Za-z_]+$")
+_PRAGMA_VALUE_PATTERN = re.compile(r"^-?[\w.]+$")
+
+
+def _sqlite_pragmas(pragmas: Dict[str, Any]) -> List[str]:
+    """
+    把配置中的 pragmas 转成 PRAGMA 语句，名称和取值只允许字母、数字、下划线（取值可带负号和小数点）。
+
+    Args:
+        pragmas (Dict[str, Any]): {名称: 取值}，如 {"journal_mode": "WAL", "busy_timeout": 5000}
+
+    Returns:
+        List[str]: PRAGMA 语句
+    """
+    result = []
+    for name, value in pragmas.items():
+        value = str(value)
+        if not _PRAGMA_NAME_PATTERN.match(str(name)) or not _PRAGMA_VALUE_PATTERN.match(value):
+            raise ValueError(f"无效的 SQLite PRAGMA 配置: {name}={value}")
+        result.append(f"PRAGMA {name}={value}")
+    return result
+
+
 class DatabaseConnector:
     def __init__(self, config_path='configs/database.yaml'):
         self.config_path = config_path
@@ -31,14 +167,31 @@ class DatabaseConnector:
             if db_dir:  # 只有当目录不为空时才创建
                 os.makedirs(db_dir, exist_ok=True)
             url = f"sqlite:///{database_path}"
-            
-            # SQLite不需要复杂的连接池配置
-            return sqlalchemy.create_engine(
+
+            # 多个连接共享同一个数据库文件：WAL 模式（journal_mode）下读连接并发执行，写入由 DatabaseManager 的写锁串行
+            engine = sqlalchemy.create_engine(
                 url,
-                pool_size=1,
-                max_overflow=0,
-                pool_pre_ping=True
+                poolclass=QueuePool,
+                pool_size=db_conf.get('pool_size', 8),
+                max_overflow=db_conf.get('max_overflow', 4),
+                pool_recycle=db_conf.get('pool_recycle', 3600),
+                pool_pre_ping=db_conf.get('pool_pre_ping', True),
+                pool_timeout=db_conf.get('pool_timeout', 30),
+                connect_args={'check_same_thread': False, 'timeout': db_conf.get('connect_timeout', 10)}
             )
+            # journal_mode 单独配置：它会持久写入数据库文件，只对明确设置的数据库生效
+            journal_mode = db_conf.get('journal_mode')
+            pragmas = _sqlite_pragmas({'journal_mode': journal_mode} if journal_mode else {}) + _sqlite_pragmas(db_conf.get('pragmas') or {})
+            if pragmas:
+                @event.listens_for(engine, "connect")
+                def _apply_pragmas(dbapi_connection, connection_record):
+                    cursor = dbapi_connection.cursor()
+                    try:
+                        for pragma in pragmas:
+                            cursor.execute(pragma)
+                    finally:
+                        cursor.close()
+            return engine
         else:
             # MySQL配置
             user = db_conf.get('username', 'root')
@@ -69,6 +222,12 @@ class DatabaseConnector:
                 connect_args={'connect_timeout': connect_timeout}
             )
 
+    @property
+    def serialize_writes(self) -> bool:
+        """是否在进程内串行写入（仅 SQLite：同一时刻只能有一个写事务）"""
+        db_conf = self.config.get('database', {})
+        return db_conf.get('driver') == 'sqlite' and db_conf.get('serialize_writes', True)
+
     def get_engine(self):
         """
         获取当前实例的引擎对象。
@@ -109,6 +268,102 @@ class DatabaseManager:
         """
         self.connector = DatabaseConnector(config_path)
         self.engine = self.connector.get_engine()
+        # 是否在 INFO 日志中输出完整的查询结果（结果中常有很长的提示词、知识库文本，默认关闭）
+        self.log_rows = False
+        self._query_hooks: List[Callable[[QueryEvent], None]] = []
+        # SQLite 同一时刻只允许一个写事务，写入在进程内排队，读连接不受影响
+        self._write_lock = threading.RLock() if self.connector.serialize_writes else None
+
+    def add_query_hook(self, hook: Callable[[QueryEvent], None]):
+        """
+        注册语句执行钩子，每条语句执行后以 QueryEvent 调用（在执行语句的线程中，需自行保证线程安全）。
+        钩子抛出的异常只记录日志，不影响查询。
+
+        Args:
+            hook (Callable[[QueryEvent], None]): 钩子
+        """
+        self._query_hooks.append(hook)
+
+    def remove_query_hook(self, hook: Callable[[QueryEvent], None]):
+        """移除 add_query_hook 注册的钩子"""
+        if hook in self._query_hooks:
+            self._query_hooks.remove(hook)
+
+    @contextmanager
+    def connect(self, begin: bool = False, write: bool = False):
+        """
+        从连接池取得连接，并记录等待连接的耗时（计入该连接上第一条语句的 QueryEvent）。
+
+        Args:
+            begin (bool): 是否开启事务，为 True 时 with 块正常结束提交、出现异常回滚
+            write (bool): 是否为写入，SQLite 下写入先取得进程内的写锁，等待写锁的耗时计入等待连接的耗时
+
+        Yields:
+            Connection: 数据库连接
+        """
+        started = time.perf_counter()
+        with self._writing(write):
+            with self.engine.connect() as connection:
+                connection.info["pool_wait_ms"] = (time.perf_counter() - started) * 1000
+                if begin:
+                    with connection.begin():
+                        yield connection
+                else:
+                    yield connection
+
+    @contextmanager
+    def _writing(self, write: bool):
+        if write and self._write_lock is not None:
+            with self._write_lock:
+                yield
+        else:
+            yield
+
+    def execute_on(self, connection, query, params=None):
+        """
+        在给定连接上执行一条语句，并把耗时、行数交给已注册的钩子。
+
+        Args:
+            connection (Connection): connect() 或 transaction() 得到的连接
+            query (str | TextClause): SQL语句，或 statements 中注册的语句
+            params (dict | list, optional): SQL参数，传入参数列表时批量执行
+
+        Returns:
+            list | int: 查询语句返回全部行（Row 对象列表），写入语句返回影响的行数
+        """
+        statement = _statement(query)
+        started = time.perf_counter()
+        rows = 0
+        error = None
+        try:
+            result = connection.execute(statement, params or {})
+            if result.returns_rows:
+                data = result.fetchall()
+                rows = len(data)
+                return data
+            rows = result.rowcount
+            return rows
+        except Exception as e:
+            error = str(e)
+            raise
+        finally:
+            if self._query_hooks:
+                self._emit(QueryEvent(
+                    name=statement_name(statement),
+                    sql=statement.text,
+                    params=params,
+                    elapsed_ms=(time.perf_counter() - started) * 1000,
+                    rows=rows,
+                    pool_wait_ms=connection.info.pop("pool_wait_ms", 0.0),
+                    error=error,
+                ))
+
+    def _emit(self, event: QueryEvent):
+        for hook in list(self._query_hooks):
+            try:
+                hook(event)
+            except Exception as e:
+                logging.error(f"查询统计钩子执行失败: {e}")
 
     def get_table_names(self):
         """
@@ -124,44 +379,48 @@ class DatabaseManager:
             result = connection.execute(text("SHOW TABLES"))
             return [row[0] for row in result]
 
-    def execute_query(self, query):
+    def execute_query(self, query, params: dict = None):
         """
         执行数据库查询并返回所有结果。
 
         Args:
-            query (str): 要执行的SQL查询语句。
+            query (str | TextClause): 要执行的SQL查询语句，或 statements 中注册的语句。
+            params (dict, optional): SQL参数，用于参数化查询
 
         Returns:
             list: 包含所有查询结果的列表，其中每个元素都是一个包含一行数据的元组。
+                不返回行的语句（INSERT/UPDATE/DELETE/DDL）返回空列表；本方法不提交事务，写入请使用 execute_insert/execute_update 或 transaction()。
 
         """
-        with self.engine.connect() as connection:
-            result = connection.execute(text(query))
+        with self.connect() as connection:
+            result = self.execute_on(connection, query, params)
+            if isinstance(result, int):
+                return []
             formatted_results = []
-            columns = result.keys() # 获取列名
             
             for row in result:
                 # 将元组形式的行数据与列名打包成字典
                 # row 是一个 Row 对象，它表现得像一个元组，也可以通过属性或索引访问
                 # row._asdict() 是最方便的方式来将其转换为字典
                 formatted_results.append(row._asdict())
-            logging.info(f"查询数据成功: {formatted_results}")
+            if self.log_rows:
+                logging.info(f"查询数据成功: {formatted_results}")
             return formatted_results
 
-    def execute_insert(self, query: str) -> int:
+    def execute_insert(self, query, params: dict = None) -> int:
         """
         执行插入操作。
 
         Args:
-            query (str): 完整的INSERT SQL语句
+            query (str | TextClause): 完整的INSERT SQL语句，或 statements 中注册的语句
             params (dict, optional): SQL参数，用于参数化查询
 
         Returns:
             int: 插入操作影响的行数
         """
         try:
-            with self.engine.connect() as connection:
-                result = connection.execute(text(query))
+            with self.connect(write=True) as connection:
+                result = self.execute_on(connection, query, params)
                 connection.commit()
                 logging.info(f"插入数据成功: {result}")
                 return "插入成功"
@@ -169,84 +428,230 @@ class DatabaseManager:
             logging.error(f"插入数据失败: {str(e)}")
             return str(e)
 
-    def execute_update(self, query: str) -> int:
+    def execute_update(self, query, params: dict = None) -> int:
         """
         执行更新操作。
 
         Args:
-            query (str): 完整的UPDATE SQL语句
+            query (str | TextClause): 完整的UPDATE SQL语句，或 statements 中注册的语句
+            params (dict, optional): SQL参数，用于参数化查询
         Returns:
             int: 更新操作影响的行数
         """
         try:
-            with self.engine.connect() as connection:
-                result = connection.execute(text(query))
+            with self.connect(write=True) as connection:
+                result = self.execute_on(connection, query, params)
                 connection.commit()
                 logging.info(f"更新数据成功: {result}")
-                return result.rowcount
+                return result
         except Exception as e:
             logging.error(f"更新数据失败: {str(e)}")
             raise Exception(f"更新数据失败: {str(e)}")
 
-    def execute_delete(self, query: str, params: dict = None) -> int:
+    def execute_delete(self, query, params: dict = None) -> int:
         """
         执行删除操作。
 
         Args:
-            query (str): 完整的DELETE SQL语句
+            query (str | TextClause): 完整的DELETE SQL语句，或 statements 中注册的语句
             params (dict, optional): SQL参数，用于参数化查询
 
         Returns:
             int: 删除操作影响的行数
         """
         try:
-            with self.engine.connect() as connection:
-                result = connection.execute(text(query), params or {})
+            with self.connect(write=True) as connection:
+                result = self.execute_on(connection, query, params)
                 connection.commit()
                 logging.info(f"删除数据成功: {result}")
-                return result.rowcount
+                return result
         except Exception as e:
             logging.error(f"删除数据失败: {str(e)}")
             raise Exception(f"删除数据失败: {str(e)}")
 
-    def fetch_one(self, query: str, params: dict = None):
+    def execute_many(self, query, params_list: Iterable[dict]) -> int:
+        """
+        用同一条语句批量写入多行，所有行在同一个连接、同一个事务中执行（驱动的 executemany），
+        任意一行失败时整体回滚。
+
+        Args:
+            query (str | TextClause): INSERT/UPDATE SQL语句，或 statements 中注册的语句
+            params_list (Iterable[dict]): 每行一组参数
+
+        Returns:
+            int: 影响的行数
+        """
+        params_list = list(params_list)
+        if not params_list:
+            return 0
+        with self.connect(begin=True, write=True) as connection:
+            result = self.execute_on(connection, query, params_list)
+            logging.info(f"批量写入数据成功: {len(params_list)} 行")
+            return result
+
+    @contextmanager
+    def transaction(self):
+        """
+        工作单元：with 块内的所有语句在同一个连接、同一个事务中执行，正常结束时提交，出现异常时整体回滚。
+        SQLite 下整个 with 块持有写锁，直接使用 engine 的写入也应通过这里进入写事务。
+
+        用法:
+            with db_manager.transaction() as connection:
+                db_manager.execute_on(connection, statement, params)          # 单行
+                db_manager.execute_on(connection, statement, [params, ...])   # 多行（executemany）
+
+        Yields:
+            Connection: 开启了事务的数据库连接
+        """
+        with self.connect(begin=True, write=True) as connection:
+            yield connection
+
+    def fetch_one(self, query, params: dict = None):
         """
         执行查询并返回单条记录。
 
         Args:
-            query (str): 要执行的SQL查询语句
+            query (str | TextClause): 要执行的SQL查询语句，或 statements 中注册的语句
             params (dict, optional): SQL参数，用于参数化查询
 
         Returns:
             tuple: 包含单行数据的元组，如果没有找到记录则返回None
         """
         try:
-            with self.engine.connect() as connection:
-                result = connection.execute(text(query), params or {})
-                row = result.fetchone()
+            with self.connect() as connection:
+                result = self.execute_on(connection, query, params)
+                row = result[0] if result else None
                 if row:
-                    logging.info(f"查询数据成功: {row}")
+                    if self.log_rows:
+                        logging.info(f"查询数据成功: {row}")
                     return tuple(row)  # 返回元组格式
                 return None
         except Exception as e:
             logging.error(f"查询数据失败: {str(e)}")
             raise Exception(f"查询数据失败: {str(e)}")
 
-    def fetch_all(self, query: str, params: dict = None):
+    def fetch_all(self, query, params: dict = None):
         """
         执行查询并返回所有记录。
 
         Args:
-            query (str): 要执行的SQL查询语句
+            query (str | TextClause): 要执行的SQL查询语句，或 statements 中注册的语句
             params (dict, optional): SQL参数，用于参数化查询
 
         Returns:
             list: 包含所有查询结果的列表，其中每个元素都是一个包含一行数据的元组
         """
         try:
-            with self.engine.connect() as connection:
-                result = connection.execute(text(query), params or {})
-                rows = result.fetchall()
+            with self.connect() as connection:
+                rows = self.execute_on(connection, query, params)
                 return [tuple(row) for row in rows]
         except Exception as e:
-            raise Exception(f"查询数据失败: {str(e)}")
\ No newline at end of file
+            raise Exception(f"查询数据失败: {str(e)}")
+
+if __name__ == "__main__":
+    # 并发基准：对数据库文件的副本，比较原来的单连接配置和 configs/database_sqlite.yaml 中的 WAL 配置
+    # 用法: python -m tools.database [数据库文件，默认 database/sale.db] [线程数 ...]
+    import random
+    import shutil
+    import sqlite3
+    import sys
+    import tempfile
+    from concurrent.futures import ThreadPoolExecutor
+
+    source_path = sys.argv[1] if len(sys.argv) > 1 else 'database/sale.db'
+    thread_counts = [int(arg) for arg in sys.argv[2:]] or [1, 4, 8, 16]
+    ops_per_thread = 300
+    write_ratio = 0.1
+    seed_rows = 20000
+
+    with open('configs/database_sqlite.yaml', 'r') as f:
+        tuned_conf = yaml.safe_load(f)['database']
+    profiles = {
+        "单连接(原配置)": {'driver': 'sqlite', 'pool_size': 1, 'max_overflow': 0, 'pool_pre_ping': True,
+                       'serialize_writes': False, 'pragmas': {}},
+        # 副本上总是开启 WAL，比较的是部署时建议的配置
+        "WAL+连接池": dict(tuned_conf, journal_mode='WAL', pragmas=dict(tuned_conf.get('pragmas') or {}, synchronous='NORMAL')),
+    }
+
+    read_statement = statements.register("bench_read", """
+        SELECT id, payload, create_time FROM bench_write
+        WHERE worker = :worker AND id > :from_id ORDER BY id LIMIT 50
+        """)
+    table_statement = statements.register("bench_tables", "SELECT name FROM sqlite_master WHERE type = 'table' ORDER BY name")
+    insert_statement = statements.register("bench_insert", "INSERT INTO bench_write (worker, payload, create_time) VALUES (:worker, :payload, :create_time)")
+    update_statement = statements.register("bench_update", "UPDATE bench_write SET create_time = :create_time WHERE id = :id")
+
+    def prepare(path: str):
+        # 用 backup 复制，源库处于 WAL 模式时也能得到一致的副本
+        with sqlite3.connect(source_path) as source, sqlite3.connect(path) as target:
+            source.backup(target)
+        with sqlite3.connect(path) as connection:
+            connection.execute("CREATE TABLE bench_write (id INTEGER PRIMARY KEY, worker INTEGER, payload TEXT, create_time REAL)")
+            connection.execute("CREATE INDEX idx_bench_write_worker ON bench_write (worker, id)")
+            connection.executemany(
+                "INSERT INTO bench_write (worker, payload, create_time) VALUES (?, ?, ?)",
+                [(i % 16, "x" * 200, time.time()) for i in range(seed_rows)],
+            )
+
+    def run(manager: DatabaseManager, threads: int) -> Dict[str, Any]:
+        latencies: Dict[str, List[float]] = {"read": [], "write": []}
+        errors = []
+        lock = threading.Lock()
+
+        def worker(worker_id: int):
+            rng = random.Random(worker_id)
+            local = {"read": [], "write": []}
+            for _ in range(ops_per_thread):
+                kind = "write" if rng.random() < write_ratio else "read"
+                started = time.perf_counter()
+                try:
+                    if kind == "write":
+                        with manager.transaction() as connection:
+                            manager.execute_on(connection, insert_statement, {"worker": worker_id, "payload": "y" * 200, "create_time": time.time()})
+                            manager.execute_on(connection, update_statement, {"id": rng.randint(1, seed_rows), "create_time": time.time()})
+                    else:
+                        manager.fetch_all(read_statement, {"worker": rng.randrange(16), "from_id": rng.randint(0, seed_rows)})
+                        manager.fetch_all(table_statement)
+                except Exception as e:
+                    with lock:
+                        errors.append(str(e))
+                    continue
+                local[kind].append((time.perf_counter() - started) * 1000)
+            with lock:
+                for key in local:
+                    latencies[key].extend(local[key])
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            list(executor.map(worker, range(threads)))
+        elapsed = time.perf_counter() - started
+
+        def p95(values: List[float]) -> float:
+            return sorted(values)[int(len(values) * 0.95)] if values else 0.0
+
+        return {
+            "ops": round((len(latencies["read"]) + len(latencies["write"])) / elapsed),
+            "read_p95": p95(latencies["read"]),
+            "write_p95": p95(latencies["write"]),
+            "errors": len(errors),
+            "sample_error": errors[0] if errors else "",
+        }
+
+    workdir = tempfile.mkdtemp(prefix="sqlite_bench_")
+    try:
+        print(f"数据库: {source_path}，每线程 {ops_per_thread} 次操作，写入占 {write_ratio:.0%}")
+        print(f"{'配置':<14} {'线程':>4} {'操作/秒':>8} {'读p95(ms)':>10} {'写p95(ms)':>10} {'错误':>4}")
+        for label, conf in profiles.items():
+            for threads in thread_counts:
+                db_path = os.path.join(workdir, f"bench_{len(os.listdir(workdir))}.db")
+                prepare(db_path)
+                config_path = db_path + ".yaml"
+                with open(config_path, 'w') as f:
+                    yaml.safe_dump({'database': dict(conf, database_path=db_path)}, f)
+                manager = DatabaseManager(config_path)
+                result = run(manager, threads)
+                manager.engine.dispose()
+                print(f"{label:<14} {threads:>4} {result['ops']:>8} {result['read_p95']:>10.2f} {result['write_p95']:>10.2f} {result['errors']:>4}"
+                      + (f"  {result['sample_error'][:80]}" if result['errors'] else ""))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
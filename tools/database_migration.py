@@ -12,6 +12,7 @@ import pymysql
 import pandas as pd
 from sqlalchemy import create_engine, text, MetaData, Table, Column, inspect
 from sqlalchemy.types import String, Integer, Text, DateTime, Boolean, Float
+from tools.database import DatabaseManager, statements
 import logging
 from datetime import datetime
 import json
@@ -151,6 +152,7 @@ class DatabaseMigrator:
             except Exception as e:
                 logger.error(f"迁移表 {table_name} 失败: {e}")
         
+        create_hot_query_indexes(target_engine)
         logger.info("SQLite迁移完成")
         return target_db_path
     
@@ -372,6 +374,123 @@ class DatabaseMigrator:
         logger.info(f"迁移报告已生成: {output_path}")
         return output_path
 
+# 热点查询的索引：utils/db_queries 中每轮对话都会执行的多表关联查询，按过滤和关联的列建立。
+# (索引名, 表名, 列)。MySQL 的表有主键，按 id 关联无需索引；迁移得到的 SQLite 副本没有主键，
+# 已有主键或索引以这些列开头时跳过，因此同一组定义对两种数据库都适用。
+HOT_QUERY_INDEXES = [
+    ("idx_sale_task_id", "sale_task", ("id",)),
+    ("idx_sale_strategy_id", "sale_strategy", ("id",)),
+    ("idx_sale_ai_data_id", "sale_ai_data", ("id",)),
+    ("idx_sale_knowledge_id", "sale_knowledge", ("id",)),
+    ("idx_sale_product_id", "sale_product", ("id",)),
+    ("idx_sale_task_data_task", "sale_task_data", ("task_id", "is_del", "data_id")),
+    ("idx_sale_task_knowledge_task", "sale_task_knowledge", ("task_id", "is_del", "knowledge_id")),
+    ("idx_sale_task_product_task", "sale_task_product", ("task_id", "is_del", "product_id")),
+    ("idx_sale_strategy_tenant_task", "sale_strategy", ("tenant_id", "task_id", "is_del")),
+    ("idx_sale_process_strategy", "sale_process", ("strategy_id", "is_del", "sort")),
+    ("idx_sale_forbidden_strategy", "sale_forbidden", ("strategy_id", "is_del")),
+    ("idx_sale_collaborate_task", "sale_collaborate", ("task_id", "is_del")),
+    ("idx_sale_prompt_tenant_task", "sale_prompt", ("tenant_id", "task_id", "is_del")),
+    ("idx_sale_wechat_account_tenant_wechat", "sale_wechat_account", ("tenant_id", "wechat_id")),
+    ("idx_sale_wechat_contact_owner", "sale_wechat_contact", ("tenant_id", "belong_wechat_id", "wechat_id")),
+]
+
+# EXPLAIN 检查的热点语句（statements 中注册的名称）。update_customer_portrait 按更新的列动态注册，
+# 用条件相同的 probe_customer_portrait 代替
+HOT_QUERIES = [
+    "select_ai_data",
+    "select_knowledge",
+    "select_product",
+    "select_sale_process",
+    "select_forbidden_content",
+    "select_collaborate_matters",
+    "select_sale_system_prompt",
+    "select_wechat_name",
+    "probe_customer_portrait",
+]
+
+_PROBE_CUSTOMER_PORTRAIT_SQL = statements.register("probe_customer_portrait", """
+    SELECT id FROM sale_wechat_contact
+    WHERE tenant_id = :tenant_id AND belong_wechat_id = :belong_wechat_id AND wechat_id = :wechat_id
+    """)
+
+# EXPLAIN 时使用的示例参数，取值不影响执行计划
+_EXPLAIN_PARAMS = {"tenant_id": 1, "task_id": 1, "wechat_id": "wxid_explain", "belong_wechat_id": "wxid_explain"}
+
+
+def create_hot_query_indexes(engine, indexes=HOT_QUERY_INDEXES):
+    """
+    创建热点查询的索引，可重复执行：表不存在、缺少列，或已有主键/索引以相同的列开头时跳过
+
+    Args:
+        engine: SQLAlchemy 引擎（MySQL 或 SQLite）
+        indexes: (索引名, 表名, 列) 列表，默认 HOT_QUERY_INDEXES
+
+    Returns:
+        list: 本次新建的索引名
+    """
+    inspector = inspect(engine)
+    tables = set(inspector.get_table_names())
+    created = []
+    for index_name, table_name, columns in indexes:
+        if table_name not in tables:
+            logger.warning(f"跳过索引 {index_name}，表 {table_name} 不存在")
+            continue
+        table_columns = {column['name'] for column in inspector.get_columns(table_name)}
+        missing = [column for column in columns if column not in table_columns]
+        if missing:
+            logger.warning(f"跳过索引 {index_name}，表 {table_name} 缺少列 {missing}")
+            continue
+        existing = [inspector.get_pk_constraint(table_name).get('constrained_columns') or []]
+        existing += [index['column_names'] for index in inspector.get_indexes(table_name)]
+        if any(tuple(existing_columns[:len(columns)]) == tuple(columns) for existing_columns in existing):
+            continue
+        with engine.begin() as connection:
+            connection.execute(text(f"CREATE INDEX {index_name} ON {table_name} ({', '.join(columns)})"))
+        logger.info(f"创建索引 {index_name} ON {table_name} ({', '.join(columns)})")
+        created.append(index_name)
+    return created
+
+
+def explain_hot_queries(engine, names=HOT_QUERIES):
+    """
+    用 EXPLAIN 检查热点语句是否使用索引（SQLite 为 EXPLAIN QUERY PLAN）
+
+    Args:
+        engine: SQLAlchemy 引擎（MySQL 或 SQLite）
+        names: 要检查的语句名称，默认 HOT_QUERIES
+
+    Returns:
+        dict: {语句名称: 全表扫描的步骤列表}，列表为空表示每张表都通过索引访问；
+              语句无法 EXPLAIN 时列表中是错误信息
+    """
+    # 导入时注册 select_* 语句
+    import utils.db_queries  # noqa: F401
+
+    sqlite = engine.dialect.name == 'sqlite'
+    report = {}
+    with engine.connect() as connection:
+        for name in names:
+            statement = statements.get(name)
+            try:
+                rows = connection.execute(
+                    text(("EXPLAIN QUERY PLAN " if sqlite else "EXPLAIN ") + statement.text.strip().rstrip(';')),
+                    _EXPLAIN_PARAMS,
+                ).mappings().fetchall()
+            except Exception as e:
+                report[name] = [f"EXPLAIN 失败: {e}"]
+                continue
+            if sqlite:
+                # SEARCH 为按索引查找，SCAN 为逐行扫描整张表（或整个索引）
+                report[name] = [row['detail'] for row in rows if row['detail'].startswith('SCAN ')]
+            else:
+                report[name] = [
+                    f"{row['table']}: type={row['type']}, key={row['key']}"
+                    for row in rows if row['table'] and row['type'] in ('ALL', 'index')
+                ]
+    return report
+
+
 def main():
     """主函数 - 演示如何使用迁移工具"""
     try:
@@ -395,4 +514,17 @@ def main():
         print(f"迁移失败: {e}")
 
 if __name__ == "__main__":
+    # python -m tools.database_migration                       迁移 MySQL 到 SQLite
+    # python -m tools.database_migration indexes [配置文件]     为配置的数据库创建热点查询索引，并检查执行计划
+    # python -m tools.database_migration explain [配置文件]     只检查热点查询的执行计划
+    import sys
+
+    if len(sys.argv) > 1 and sys.argv[1] in ('indexes', 'explain'):
+        engine = DatabaseManager(sys.argv[2] if len(sys.argv) > 2 else 'configs/database_sqlite.yaml').engine
+        if sys.argv[1] == 'indexes':
+            print(f"新建索引: {create_hot_query_indexes(engine) or '无'}")
+        report = explain_hot_queries(engine)
+        for name, scans in report.items():
+            print(f"{'✅' if not scans else '❌'} {name}" + "".join(f"\n    {scan}" for scan in scans))
+        sys.exit(0 if not any(report.values()) else 1)
     main() 
\ No newline at end of file
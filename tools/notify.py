@@ -3,11 +3,16 @@ import json
 import os 
 import aiohttp
 import asyncio
+import weakref
 from datetime import datetime
 from core.database_core import db_manager
+from tools.database import statements
 from utils.logger_config import get_utils_logger
 from utils.db_queries import select_wechat_name
+from utils.prompt_cache import bump_prompt_version
+from utils.reference_cache import invalidate_references
 from utils.config_loader import ConfigLoader
+from utils.async_db import run_db
 
 config = ConfigLoader()
 
@@ -15,6 +20,28 @@ send_url = config.get_api_key('send_url', 'url')
 
 logger = get_utils_logger()
 
+# 每个事件循环复用一个 aiohttp 会话（及其连接池），避免每次发送都新建会话和 TCP 连接
+_http_sessions: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, aiohttp.ClientSession]" = weakref.WeakKeyDictionary()
+
+def get_http_session() -> aiohttp.ClientSession:
+    """
+    获取当前事件循环共享的 aiohttp 会话，不存在或已关闭时创建
+    """
+    loop = asyncio.get_running_loop()
+    session = _http_sessions.get(loop)
+    if session is None or session.closed:
+        session = aiohttp.ClientSession()
+        _http_sessions[loop] = session
+    return session
+
+async def close_http_session():
+    """
+    关闭当前事件循环共享的 aiohttp 会话，在事件循环结束前调用
+    """
+    session = _http_sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None and not session.closed:
+        await session.close()
+
 async def send_order_notification(tenant_id,task_id,session_id,order_notification):
     """
     发送订单通知
@@ -103,23 +130,9 @@ async def send_customer_behavior(tenant_id,task_id,session_id,customer_behavior)
     response = requests.post(url, headers=headers, data=json.dumps(data))
     return response.json()
 
-async def send_prohibit_notify(tenant_id,task_id,strategy_id,prohibit_list, sale_flow, status=2):
-    """
-    发送禁止做的事情 && 销售流程通知
-    Args:
-        tenant_id: 租户ID
-        task_id: 任务ID
-        strategy_id: 策略ID
-        prohibit_list: 禁止做的事情列表
-        sale_flow: 销售流程
-        status: 状态 2 成功 1 失败
-    Returns:
-        response: 响应
-    """
-    for prohibit in prohibit_list:
-        # 将一个单引号替换为两个单引号
-        escaped_prohibit = prohibit.replace("'", "''")
-        insert_query = f"""
+# 角色策略（禁止事项、销售流程、策略状态）的写入语句。
+# VALUES 中全部是占位参数，pymysql 的 executemany 会把多行合并成一条多值 INSERT
+_INSERT_FORBIDDEN_SQL = statements.register("insert_sale_forbidden", """
         INSERT INTO sale_forbidden (
         strategy_id,
         text,
@@ -128,21 +141,16 @@ async def send_prohibit_notify(tenant_id,task_id,strategy_id,prohibit_list, sale
         create_time,
         is_del
     ) VALUES (
-        '{strategy_id}',
-        '{escaped_prohibit}',
-        '{tenant_id}',
-        'admin',
-        NOW(),
-        0
+        :strategy_id,
+        :text,
+        :tenant_id,
+        :create_by,
+        :create_time,
+        :is_del
     );
-        """
-        db_manager.execute_insert(insert_query)
-    logger.info(f"待插入销售流程: {sale_flow}")
-    for i,flow in enumerate(sale_flow):
-        # 将一个单引号替换为两个单引号
-        escaped_title = flow['title'].replace("'", "''")
-        escaped_description = str(flow['description']).replace("'", "''")
-        insert_query = f"""
+        """)
+
+_INSERT_SALE_PROCESS_SQL = statements.register("insert_sale_process", """
         INSERT INTO sale_process (
             strategy_id,
             title,
@@ -153,29 +161,94 @@ async def send_prohibit_notify(tenant_id,task_id,strategy_id,prohibit_list, sale
             create_time,
             is_del
         ) VALUES (
-            '{strategy_id}',
-            '{escaped_title}',
-            '{escaped_description}',
-            '{i}',
-            '{tenant_id}',
-            'admin',
-            NOW(),
-            0
+            :strategy_id,
+            :title,
+            :text,
+            :sort,
+            :tenant_id,
+            :create_by,
+            :create_time,
+            :is_del
         );
+        """)
+
+_UPDATE_STRATEGY_SQL = statements.register("update_sale_strategy", """
+    UPDATE sale_strategy SET status = :status, reply_cycle = 72, reply_times = 2 WHERE id = :strategy_id AND tenant_id = :tenant_id AND task_id = :task_id;
+    """)
+
+def write_sale_strategy(tenant_id, task_id, strategy_id, prohibit_list, sale_flow, status=2) -> int:
+    """
+    在一个事务中写入角色策略：批量插入禁止事项和销售流程，并更新策略状态和回复设置，
+    任意一步失败时整体回滚，不会留下只写了一半的策略。
+    Args:
+        tenant_id: 租户ID
+        task_id: 任务ID
+        strategy_id: 策略ID
+        prohibit_list: 禁止做的事情列表
+        sale_flow: 销售流程
+        status: 状态 2 成功 1 失败
+    Returns:
+        int: 写入的禁止事项和销售流程行数
+    """
+    common = {
+        "strategy_id": strategy_id,
+        "tenant_id": tenant_id,
+        "create_by": "admin",
+        "create_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "is_del": 0,
+    }
+    forbidden_rows = [dict(common, text=prohibit) for prohibit in prohibit_list]
+    process_rows = [
+        dict(common, title=flow['title'], text=str(flow['description']), sort=i)
+        for i, flow in enumerate(sale_flow)
+    ]
+    with db_manager.transaction() as connection:
+        if forbidden_rows:
+            db_manager.execute_on(connection, _INSERT_FORBIDDEN_SQL, forbidden_rows)
+        if process_rows:
+            db_manager.execute_on(connection, _INSERT_SALE_PROCESS_SQL, process_rows)
+        db_manager.execute_on(connection, _UPDATE_STRATEGY_SQL, {"status": status, "strategy_id": strategy_id, "tenant_id": tenant_id, "task_id": task_id})
+    return len(forbidden_rows) + len(process_rows)
 
-        """
-        logger.info(f"插入销售流程: {insert_query}")
-        db_manager.execute_insert(insert_query)
-    update_status_query = f"""
-    UPDATE sale_strategy SET status = {status} WHERE id = {strategy_id} AND tenant_id = {tenant_id} AND task_id = {task_id};
+async def send_prohibit_notify(tenant_id,task_id,strategy_id,prohibit_list, sale_flow, status=2):
     """
-    db_manager.execute_update(update_status_query)
-    update_reply_query = f"""
-    UPDATE sale_strategy SET reply_cycle = 72, reply_times = 2 WHERE id = {strategy_id} AND tenant_id = {tenant_id} AND task_id = {task_id};
+    发送禁止做的事情 && 销售流程通知
+    Args:
+        tenant_id: 租户ID
+        task_id: 任务ID
+        strategy_id: 策略ID
+        prohibit_list: 禁止做的事情列表
+        sale_flow: 销售流程
+        status: 状态 2 成功 1 失败
+    Returns:
+        response: 响应
     """
-    db_manager.execute_update(update_reply_query)
+    logger.info(f"待插入销售流程: {sale_flow}")
+    rows = await run_db(write_sale_strategy, tenant_id, task_id, strategy_id, prohibit_list, sale_flow, status)
+    logger.info(f"角色策略写入完成: strategy_id={strategy_id}, 禁止事项和销售流程共 {rows} 行, status={status}")
+    await run_db(bump_prompt_version, tenant_id, task_id)
+    invalidate_references(tenant_id, task_id, ("sale_process", "forbidden_content"))
     return True
 
+async def send_strategy_status_notify(tenant_id, task_id, strategy_id, status=3):
+    """
+    只更新策略状态（禁止事项和销售流程写入失败时使用），更新失败只记录日志
+    Args:
+        tenant_id: 租户ID
+        task_id: 任务ID
+        strategy_id: 策略ID
+        status: 状态 3 写入失败
+    Returns:
+        bool: 是否更新成功
+    """
+    try:
+        await run_db(db_manager.execute_update, _UPDATE_STRATEGY_SQL, {"status": status, "strategy_id": strategy_id, "tenant_id": tenant_id, "task_id": task_id})
+        logger.info(f"策略状态已更新: strategy_id={strategy_id}, status={status}")
+        return True
+    except Exception as e:
+        logger.error(f"更新策略状态失败: strategy_id={strategy_id}, status={status}, error: {e}")
+        return False
+
 async def send_chat_test(tenant_id,task_id,chat_test):
     """
     发送聊天测试通知
@@ -198,6 +271,26 @@ async def send_chat_test(tenant_id,task_id,chat_test):
     response = requests.post(url, headers=headers, data=json.dumps(data))
     return response.json()
 
+_INSERT_WECHAT_MATTER_SQL = statements.register("insert_sale_wechat_matter", """
+        INSERT INTO sale_wechat_matter (
+            content,
+            belong_wechat_id,
+            wechat_id,
+            tenant_id,
+            create_by,
+            create_time,
+            is_del
+        ) VALUES (
+            :content,
+            :belong_wechat_id,
+            :wechat_id,
+            :tenant_id,
+            'admin',
+            NOW(),
+            0
+        );
+        """)
+
 async def send_chat(tenant_id,task_id,session_id,wechat_id,belong_chat_id,chat_content):
     """
     发送聊天内容通知
@@ -243,32 +336,19 @@ async def send_chat(tenant_id,task_id,session_id,wechat_id,belong_chat_id,chat_c
         collaborate_list = []
     else:
         collaborate_dic = chat_content.get("collaborate_list", [])
-        wechat_name = select_wechat_name(tenant_id, wechat_id)
+        # 昵称缓存未命中时会查询数据库（首次还会预热整个租户），放到数据库线程池执行，不阻塞工作池的事件循环
+        wechat_name = await run_db(select_wechat_name, tenant_id, wechat_id)
         collaborate_list = [collaborate['content'].replace("客户", wechat_name) for collaborate in collaborate_dic]
     for collaborate in collaborate_list:
-        escaped_collaborate = collaborate.replace("'", "''")
-        insert_query = f"""
-        INSERT INTO sale_wechat_matter (
-            content,
-            belong_wechat_id,
-            wechat_id,
-            tenant_id,
-            create_by,
-            create_time,
-            is_del
-        ) VALUES (
-            '{escaped_collaborate}',
-            '{belong_chat_id}',
-            '{session_id}',
-            '{tenant_id}',
-            'admin',
-            NOW(),
-            0
-        );
-        """
-        logger.info(f"插入协作事项: {insert_query}")
+        params = {
+            "content": collaborate,
+            "belong_wechat_id": belong_chat_id,
+            "wechat_id": session_id,
+            "tenant_id": tenant_id,
+        }
+        logger.info(f"插入协作事项: {params}")
         try:
-            await asyncio.to_thread(db_manager.execute_insert, insert_query)
+            await asyncio.to_thread(db_manager.execute_insert, _INSERT_WECHAT_MATTER_SQL, params)
         except Exception as e:
             logger.error(f"插入协作事项失败: {e}")
     url = send_url
@@ -285,9 +365,8 @@ async def send_chat(tenant_id,task_id,session_id,wechat_id,belong_chat_id,chat_c
     }
     logger.info(f"发送聊天通知: {data}")
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, headers=headers, json=data) as response:
-                return await response.json()
+        async with get_http_session().post(url, headers=headers, json=data) as response:
+            return await response.json()
     except Exception as e:
         logger.error(f"发送聊天通知失败: {e}")
         return {"status": "failed",
@@ -0,0 +1,176 @@
+"""
+准入控制与过载保护
+
+在接口入口按"在途请求数"和"预计排队等待时间"决定是否接收请求，超过阈值时立即拒绝并给出重试等待时间，
+而不是接收后在深处的模型或数据库超时中失败。同时支持按租户限制在途请求数，避免单个大租户挤占其他租户。
+"""
+
+import math
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from utils.logger_config import get_utils_logger
+
+logger = get_utils_logger()
+
+
+class AdmissionRejected(Exception):
+    """请求被准入控制拒绝"""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionTicket:
+    """一个已接收请求的准入凭证，请求处理结束后调用 release() 归还名额（可重复调用）"""
+
+    def __init__(self, controller: "AdmissionController", tenant_id: str):
+        self.controller = controller
+        self.tenant_id = tenant_id
+        self.acquired_at = time.monotonic()
+        self._released = False
+
+    def release(self):
+        if self._released:
+            return
+        self._released = True
+        self.controller._release(self)
+
+
+class AdmissionController:
+    def __init__(self, name: str, concurrency: int, max_in_flight: int = 200, max_queue_wait_seconds: float = 60,
+                 tenant_max_in_flight: Optional[int] = None, tenant_overrides: Optional[Dict[str, int]] = None,
+                 initial_service_seconds: float = 5, smoothing: float = 0.2):
+        """
+        初始化准入控制器
+
+        Args:
+            name: 名称，用于日志
+            concurrency: 后端实际并发处理能力（工作协程数或线程数），用于估算排队等待时间
+            max_in_flight: 全局在途请求数上限
+            max_queue_wait_seconds: 预计排队等待时间上限（秒）
+            tenant_max_in_flight: 单个租户的在途请求数上限，None 表示不限制
+            tenant_overrides: 按租户覆盖的在途请求数上限 {tenant_id: 上限}
+            initial_service_seconds: 还没有样本时假定的单个请求处理时间（秒）
+            smoothing: 处理时间指数移动平均的平滑系数
+        """
+        self.name = name
+        self.concurrency = max(concurrency, 1)
+        self.max_in_flight = max_in_flight
+        self.max_queue_wait_seconds = max_queue_wait_seconds
+        self.tenant_max_in_flight = tenant_max_in_flight
+        self.tenant_overrides = {str(k): v for k, v in (tenant_overrides or {}).items()}
+        self.smoothing = smoothing
+
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._tenant_in_flight: Dict[str, int] = {}
+        self._avg_service_seconds = initial_service_seconds
+        self._admitted = 0
+        self._rejected = 0
+
+    @classmethod
+    def from_config(cls, name: str, concurrency: int, config: Dict[str, Any]) -> "AdmissionController":
+        """
+        按 agent_service.yaml 中 admission 下的配置创建准入控制器
+
+        Args:
+            name: 名称，用于日志
+            concurrency: 后端实际并发处理能力，配置中的 concurrency 优先
+            config: 配置字典
+
+        Returns:
+            AdmissionController: 准入控制器
+        """
+        return cls(
+            name=name,
+            concurrency=config.get('concurrency', concurrency),
+            max_in_flight=config.get('max_in_flight', 200),
+            max_queue_wait_seconds=config.get('max_queue_wait_seconds', 60),
+            tenant_max_in_flight=config.get('tenant_max_in_flight'),
+            tenant_overrides=config.get('tenant_overrides'),
+            initial_service_seconds=config.get('initial_service_seconds', 5),
+        )
+
+    def try_acquire(self, tenant_id: Any, force: bool = False) -> AdmissionTicket:
+        """
+        申请接收一个请求
+
+        Args:
+            tenant_id: 租户ID
+            force: 为 True 时不做检查，只计入在途请求（用于恢复的历史任务）
+
+        Returns:
+            AdmissionTicket: 准入凭证
+
+        Raises:
+            AdmissionRejected: 超过全局/租户上限或预计排队时间过长
+        """
+        tenant_id = str(tenant_id)
+        with self._lock:
+            if not force:
+                retry_after = self._retry_after_locked()
+                if self._in_flight >= self.max_in_flight:
+                    self._reject_locked(tenant_id, "在途请求数已达上限", retry_after)
+                if self._estimated_wait_locked() > self.max_queue_wait_seconds:
+                    self._reject_locked(tenant_id, "预计排队时间过长", retry_after)
+                tenant_limit = self.tenant_overrides.get(tenant_id, self.tenant_max_in_flight)
+                if tenant_limit is not None and self._tenant_in_flight.get(tenant_id, 0) >= tenant_limit:
+                    self._reject_locked(tenant_id, "租户在途请求数已达上限", retry_after)
+            self._in_flight += 1
+            self._tenant_in_flight[tenant_id] = self._tenant_in_flight.get(tenant_id, 0) + 1
+            self._admitted += 1
+        return AdmissionTicket(self, tenant_id)
+
+    def estimated_wait(self) -> float:
+        """按当前在途请求数和平均处理时间估算新请求的排队等待时间（秒）"""
+        with self._lock:
+            return self._estimated_wait_locked()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        获取准入控制状态
+
+        Returns:
+            Dict[str, Any]: 在途请求数、各租户在途请求数、平均处理时间、预计等待时间及接收/拒绝计数
+        """
+        with self._lock:
+            return {
+                "name": self.name,
+                "in_flight": self._in_flight,
+                "max_in_flight": self.max_in_flight,
+                "tenant_in_flight": dict(self._tenant_in_flight),
+                "avg_service_seconds": round(self._avg_service_seconds, 3),
+                "estimated_wait_seconds": round(self._estimated_wait_locked(), 3),
+                "admitted": self._admitted,
+                "rejected": self._rejected,
+            }
+
+    def _estimated_wait_locked(self) -> float:
+        return self._in_flight / self.concurrency * self._avg_service_seconds
+
+    def _retry_after_locked(self) -> int:
+        # 大致等到当前积压处理掉一轮后再重试，限制在 1~300 秒之间
+        wait = max(self._estimated_wait_locked() - self.max_queue_wait_seconds, self._avg_service_seconds)
+        return min(max(int(math.ceil(wait)), 1), 300)
+
+    def _reject_locked(self, tenant_id: str, reason: str, retry_after: int):
+        self._rejected += 1
+        logger.warning(f"[准入控制:{self.name}] 拒绝请求 - 租户: {tenant_id}, 原因: {reason}, 在途: {self._in_flight}, 建议 {retry_after} 秒后重试")
+        raise AdmissionRejected(reason, retry_after)
+
+    def _release(self, ticket: AdmissionTicket):
+        elapsed = time.monotonic() - ticket.acquired_at
+        with self._lock:
+            self._in_flight -= 1
+            remaining = self._tenant_in_flight.get(ticket.tenant_id, 1) - 1
+            if remaining > 0:
+                self._tenant_in_flight[ticket.tenant_id] = remaining
+            else:
+                self._tenant_in_flight.pop(ticket.tenant_id, None)
+            # 在途时间包含排队时间，按并发数折算为单个请求的处理时间
+            service_seconds = elapsed / max(1.0, self._in_flight / self.concurrency + 1)
+            self._avg_service_seconds += self.smoothing * (service_seconds - self._avg_service_seconds)
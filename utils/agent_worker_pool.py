@@ -0,0 +1,357 @@
+"""
+智能体后台工作池
+
+在一个常驻的事件循环线程上运行固定数量的工作协程，替代"每条消息一个线程 + asyncio.run"的处理方式：
+- 排队长度有上限，队列满时 submit 直接抛出 QueueFullError，由接口层返回明确的拒绝状态
+- 同一个 key（如 ADK 会话）的任务严格按提交顺序串行执行，不同 key 之间并行执行
+- 可选的"取代"模式：同一 key 有新任务到达时，取消尚未提交结果的旧任务，并把新旧输入合并后重新执行
+- 通过 stats() 暴露排队深度和工作协程利用率
+- 事件循环由服务生命周期持有，run_coroutine() 可以从任意线程把其他协程提交到同一个循环上执行，
+  循环上创建的连接池（如 aiohttp 会话）在多次调用之间复用，关闭时通过 on_shutdown 统一释放
+"""
+
+import asyncio
+import concurrent.futures
+import contextvars
+import threading
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, Optional, Set
+
+from utils.logger_config import get_utils_logger
+
+logger = get_utils_logger()
+
+
+class QueueFullError(Exception):
+    """工作池排队已满，请求被拒绝"""
+
+
+class RunControl:
+    """
+    单次任务执行的控制信息，handler 通过 current_run_control() 获取。
+    handler 在产生外部副作用（如发送消息）之前调用 commit()：返回 False 表示该任务已被新任务取代，应放弃副作用；
+    返回 True 后该任务不会再被取代。
+    """
+
+    def __init__(self, key: Optional[Hashable], job: Any):
+        self.key = key
+        self.job = job
+        self.superseded = False
+        self.committed = False
+        self.task: Optional[asyncio.Task] = None
+
+    def commit(self) -> bool:
+        if self.superseded:
+            return False
+        self.committed = True
+        return True
+
+
+_current_run: contextvars.ContextVar[Optional[RunControl]] = contextvars.ContextVar("current_run", default=None)
+
+
+def current_run_control() -> Optional[RunControl]:
+    """获取当前正在执行的任务的控制信息，不在工作池中执行时返回 None"""
+    return _current_run.get()
+
+
+class AgentWorkerPool:
+    def __init__(self, handler: Callable[[Any], Awaitable[Any]], num_workers: int = 8, max_queue_size: int = 200, name: str = "agent_worker_pool",
+                 merge: Optional[Callable[[Any, Any], Any]] = None, supersede: bool = False,
+                 on_shutdown: Optional[Callable[[], Awaitable[Any]]] = None):
+        """
+        初始化工作池（需调用 start() 后才能提交任务）
+
+        Args:
+            handler: 处理单个任务的协程函数，在工作池的事件循环中执行
+            num_workers: 工作协程数量，即同时处理的任务数
+            max_queue_size: 等待处理的任务数上限
+            name: 工作池名称，用于线程名和日志
+            merge: 合并函数 merge(较早的任务, 较新的任务) -> 合并后的任务，取代模式下必须提供
+            supersede: 是否开启取代模式
+            on_shutdown: 停止时在事件循环中执行的清理协程函数（如关闭 HTTP 会话）
+        """
+        if num_workers < 1:
+            raise ValueError("num_workers 必须大于0")
+        if max_queue_size < 1:
+            raise ValueError("max_queue_size 必须大于0")
+        if supersede and merge is None:
+            raise ValueError("开启取代模式时必须提供 merge 函数")
+        self.handler = handler
+        self.num_workers = num_workers
+        self.max_queue_size = max_queue_size
+        self.name = name
+        self.merge = merge
+        self.supersede = supersede
+        self.on_shutdown = on_shutdown
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._thread: Optional[threading.Thread] = None
+        self._started = threading.Event()
+
+        # 按 key 串行：正在执行（或已在队列中）的 key，以及每个 key 后续等待的任务
+        # 这两个结构只在事件循环线程中修改
+        self._active_keys: Set[Hashable] = set()
+        self._backlog: Dict[Hashable, Deque[Any]] = {}
+        self._running: Dict[Hashable, RunControl] = {}
+
+        # 以下计数器会被接口线程和事件循环线程同时访问，统一由 _lock 保护
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._busy = 0
+        self._processed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._superseded = 0
+        self._busy_seconds = 0.0
+        self._start_time = 0.0
+
+    @property
+    def loop(self) -> Optional[asyncio.AbstractEventLoop]:
+        """工作池所使用的事件循环"""
+        return self._loop
+
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """启动事件循环线程和工作协程"""
+        if self.is_running():
+            return
+        self._started.clear()
+        self._thread = threading.Thread(target=self._run_loop, name=self.name, daemon=True)
+        self._thread.start()
+        self._started.wait()
+        logger.info(f"[{self.name}] 工作池已启动 - 工作协程数: {self.num_workers}, 排队上限: {self.max_queue_size}")
+
+    def stop(self, timeout: float = 30):
+        """
+        停止工作池，最多等待 timeout 秒让已排队的任务处理完成
+
+        Args:
+            timeout: 等待排队任务完成的最长时间（秒）
+        """
+        if not self.is_running():
+            return
+        drain = asyncio.run_coroutine_threadsafe(self._queue.join(), self._loop)
+        try:
+            drain.result(timeout=timeout)
+        except Exception:
+            logger.warning(f"[{self.name}] 等待排队任务完成超时，剩余任务将被丢弃 - 排队数: {self._pending}")
+        if self.on_shutdown is not None:
+            try:
+                self.run_coroutine(self.on_shutdown()).result(timeout=timeout)
+            except Exception:
+                logger.exception(f"[{self.name}] 执行关闭清理失败")
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=timeout)
+        self._thread = None
+        logger.info(f"[{self.name}] 工作池已停止")
+
+    def is_full(self) -> bool:
+        """排队任务数是否已达上限"""
+        with self._lock:
+            return self._pending >= self.max_queue_size
+
+    def submit(self, job: Any, key: Optional[Hashable] = None):
+        """
+        提交任务（线程安全，可在任意线程或事件循环中调用）
+
+        Args:
+            job: 交给 handler 处理的任务对象
+            key: 串行键，相同 key 的任务按提交顺序逐个执行；为 None 时不做串行约束
+
+        Raises:
+            QueueFullError: 排队任务数已达上限
+        """
+        if not self.is_running():
+            raise RuntimeError(f"[{self.name}] 工作池未启动")
+        with self._lock:
+            if self._pending >= self.max_queue_size:
+                self._rejected += 1
+                raise QueueFullError(f"排队任务数已达上限: {self.max_queue_size}")
+            self._pending += 1
+        self._loop.call_soon_threadsafe(self._enqueue, key, job)
+
+    def run_coroutine(self, coro: Awaitable[Any]) -> concurrent.futures.Future:
+        """
+        把协程提交到工作池的事件循环上执行（线程安全），不占用工作协程和排队名额
+
+        Args:
+            coro: 协程对象
+
+        Returns:
+            concurrent.futures.Future: 可在其他线程中等待结果或取消
+        """
+        if not self.is_running():
+            raise RuntimeError(f"[{self.name}] 工作池未启动")
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        获取工作池运行状态
+
+        Returns:
+            Dict[str, Any]: 排队深度、忙碌协程数、当前利用率、累计利用率及处理计数
+        """
+        with self._lock:
+            uptime = time.monotonic() - self._start_time if self._start_time else 0.0
+            capacity_seconds = uptime * self.num_workers
+            return {
+                "name": self.name,
+                "running": self.is_running(),
+                "queue_depth": self._pending,
+                "max_queue_size": self.max_queue_size,
+                "num_workers": self.num_workers,
+                "busy_workers": self._busy,
+                "active_sessions": len(self._active_keys),
+                "waiting_sessions": len(self._backlog),
+                "utilization": round(self._busy / self.num_workers, 4),
+                "avg_utilization": round(self._busy_seconds / capacity_seconds, 4) if capacity_seconds else 0.0,
+                "processed": self._processed,
+                "failed": self._failed,
+                "rejected": self._rejected,
+                "superseded": self._superseded,
+            }
+
+    def _run_loop(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        self._loop = loop
+        self._queue = asyncio.Queue()
+        self._start_time = time.monotonic()
+        for index in range(self.num_workers):
+            loop.create_task(self._worker(index))
+        self._started.set()
+        try:
+            loop.run_forever()
+        finally:
+            tasks = asyncio.all_tasks(loop)
+            for task in tasks:
+                task.cancel()
+            loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            loop.close()
+
+    def _enqueue(self, key: Optional[Hashable], job: Any):
+        # 在事件循环线程中执行：同一 key 已有任务在队列中或执行中时，先放入该 key 的等待队列
+        if key is None:
+            self._queue.put_nowait((None, job))
+        elif key in self._active_keys:
+            if self.supersede:
+                job = self._supersede(key, job)
+            self._backlog.setdefault(key, deque()).append(job)
+        else:
+            self._active_keys.add(key)
+            self._queue.put_nowait((key, job))
+
+    def _supersede(self, key: Hashable, job: Any) -> Any:
+        # 在事件循环线程中执行：把该 key 尚未开始的任务以及可取消的运行中任务合并进新任务
+        absorbed = 0
+        backlog = self._backlog.pop(key, None)
+        if backlog:
+            while backlog:
+                job = self.merge(backlog.pop(), job)
+                absorbed += 1
+        run = self._running.get(key)
+        if run is not None and not run.committed and not run.superseded:
+            run.superseded = True
+            run.task.cancel()
+            job = self.merge(run.job, job)
+            logger.info(f"[{self.name}] 任务 {key} 被新消息取代，已取消正在执行的旧任务")
+            with self._lock:
+                self._superseded += 1
+        if absorbed:
+            with self._lock:
+                self._pending -= absorbed
+                self._superseded += absorbed
+        return job
+
+    def _release(self, key: Optional[Hashable]):
+        # 在事件循环线程中执行：key 的当前任务结束后，把它的下一个任务放到队尾，保证各 key 之间公平
+        if key is None:
+            return
+        backlog = self._backlog.get(key)
+        if backlog:
+            self._queue.put_nowait((key, backlog.popleft()))
+            if not backlog:
+                del self._backlog[key]
+        else:
+            self._active_keys.discard(key)
+
+    async def _worker(self, index: int):
+        while True:
+            key, job = await self._queue.get()
+            with self._lock:
+                self._pending -= 1
+                self._busy += 1
+            started = time.monotonic()
+            failed = False
+            run = RunControl(key, job)
+            try:
+                # handler 在独立的子任务中执行，取代模式下可以只取消这一次执行而不影响工作协程
+                token = _current_run.set(run)
+                try:
+                    run.task = asyncio.ensure_future(self.handler(job))
+                finally:
+                    _current_run.reset(token)
+                if key is not None:
+                    self._running[key] = run
+                await run.task
+            except asyncio.CancelledError:
+                # 只吞掉"被取代"导致的取消，工作池关闭时的取消照常抛出
+                if not run.superseded or asyncio.current_task().cancelling():
+                    raise
+            except Exception:
+                failed = True
+                logger.exception(f"[{self.name}] 工作协程 {index} 处理任务失败")
+            finally:
+                if key is not None and self._running.get(key) is run:
+                    del self._running[key]
+                with self._lock:
+                    self._busy -= 1
+                    self._busy_seconds += time.monotonic() - started
+                    if failed:
+                        self._failed += 1
+                    elif not run.superseded:
+                        self._processed += 1
+                self._release(key)
+                self._queue.task_done()
+
+
+if __name__ == "__main__":
+    # 压测自检：大量会话并发提交，验证同一会话内严格有序、不同会话之间并行
+    # 运行方式: python -m utils.agent_worker_pool
+    import random
+
+    num_sessions = 300
+    messages_per_session = 5
+    records: Dict[int, list] = {}
+    running_per_session: Dict[int, int] = {}
+    violations = []
+
+    async def fake_handler(job):
+        session, seq = job
+        running_per_session[session] = running_per_session.get(session, 0) + 1
+        if running_per_session[session] > 1:
+            violations.append(f"会话 {session} 出现并发执行")
+        await asyncio.sleep(random.uniform(0.001, 0.01))
+        records.setdefault(session, []).append(seq)
+        running_per_session[session] -= 1
+
+    pool = AgentWorkerPool(fake_handler, num_workers=32, max_queue_size=num_sessions * messages_per_session)
+    pool.start()
+    started = time.monotonic()
+    jobs = [(session, seq) for seq in range(messages_per_session) for session in range(num_sessions)]
+    for job in jobs:
+        pool.submit(job, key=job[0])
+    pool.stop(timeout=120)
+    elapsed = time.monotonic() - started
+
+    for session in range(num_sessions):
+        if records.get(session) != list(range(messages_per_session)):
+            violations.append(f"会话 {session} 顺序错误: {records.get(session)}")
+    serial_lower_bound = messages_per_session * 0.001 * num_sessions
+    print(f"任务数: {len(jobs)}, 耗时: {elapsed:.2f}s (完全串行至少 {serial_lower_bound:.2f}s), 统计: {pool.stats()}")
+    print("检查通过" if not violations else "\n".join(violations[:20]))
@@ -0,0 +1,139 @@
+"""
+数据库访问的异步封装
+
+DatabaseManager 基于同步驱动，在 ADK 回调、提示词拼装和智能体工具这些运行在事件循环上的代码里直接调用，
+一次慢查询会卡住同一事件循环上的所有会话。这里把数据库操作放到独立的有界线程池中执行，
+事件循环只等待结果；线程数在 configs/agent_service.yaml 的 db_executor 中配置，
+应与数据库连接池大小相当，多出的线程只会在连接池上排队。
+"""
+
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, TypeVar
+
+from core.database_core import db_manager
+from utils.config_loader import ConfigLoader
+
+T = TypeVar("T")
+
+_config = ConfigLoader().get_agent_service_config('db_executor')
+db_executor = ThreadPoolExecutor(max_workers=_config.get('max_workers', 8), thread_name_prefix="db_executor")
+
+
+async def run_db(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """
+    在数据库线程池中执行同步函数并等待结果
+
+    Args:
+        func: 同步的数据库访问函数
+        *args: 位置参数
+        **kwargs: 关键字参数
+
+    Returns:
+        func 的返回值
+    """
+    loop = asyncio.get_running_loop()
+    # 复制当前上下文，使 ContextVar（如运行控制、分片）在线程中可见
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(db_executor, functools.partial(context.run, func, *args, **kwargs))
+
+
+def async_db_tool(func: Callable[..., T]) -> Callable[..., Any]:
+    """
+    把同步的数据库函数包装成协程函数，供 ADK 作为工具使用
+
+    名称、参数签名和文档字符串保持不变，模型看到的工具声明与原函数一致；
+    ADK 对协程工具直接 await，对同步工具则在事件循环上调用。
+    """
+    @functools.wraps(func)
+    async def wrapper(*args: Any, **kwargs: Any) -> T:
+        return await run_db(func, *args, **kwargs)
+
+    return wrapper
+
+
+class AsyncDatabaseManager:
+    """DatabaseManager 的异步版本，方法与 DatabaseManager 一一对应"""
+
+    def __init__(self, manager=db_manager):
+        self.manager = manager
+
+    async def execute_query(self, query, params: dict = None) -> List[dict]:
+        return await run_db(self.manager.execute_query, query, params)
+
+    async def execute_insert(self, query, params: dict = None) -> int:
+        return await run_db(self.manager.execute_insert, query, params)
+
+    async def execute_update(self, query, params: dict = None) -> int:
+        return await run_db(self.manager.execute_update, query, params)
+
+    async def execute_many(self, query, params_list) -> int:
+        return await run_db(self.manager.execute_many, query, params_list)
+
+    async def execute_delete(self, query, params: dict = None) -> int:
+        return await run_db(self.manager.execute_delete, query, params)
+
+    async def fetch_one(self, query, params: dict = None):
+        return await run_db(self.manager.fetch_one, query, params)
+
+    async def fetch_all(self, query, params: dict = None):
+        return await run_db(self.manager.fetch_all, query, params)
+
+
+async_db_manager = AsyncDatabaseManager()
+
+
+if __name__ == "__main__":
+    # 自检：模拟一个慢查询，比较直接调用与经线程池调用时事件循环的最大卡顿
+    import time
+
+    SLOW_SECONDS = 0.5
+    CONCURRENT_QUERIES = 4
+
+    def slow_query(query: str) -> List[dict]:
+        time.sleep(SLOW_SECONDS)
+        return [{"query": query}]
+
+    async def measure(label: str, query_coro: Callable[[int], Any]):
+        max_lag = 0.0
+        stop = asyncio.Event()
+
+        async def ticker():
+            nonlocal max_lag
+            interval = 0.01
+            while not stop.is_set():
+                started = time.perf_counter()
+                await asyncio.sleep(interval)
+                max_lag = max(max_lag, time.perf_counter() - started - interval)
+
+        tick_task = asyncio.create_task(ticker())
+        await asyncio.sleep(0.05)
+        started = time.perf_counter()
+        await asyncio.gather(*(query_coro(i) for i in range(CONCURRENT_QUERIES)))
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await tick_task
+        print(f"{label}: {CONCURRENT_QUERIES} 个慢查询耗时 {elapsed:.2f}s, 事件循环最大卡顿 {max_lag * 1000:.0f}ms")
+        return max_lag
+
+    async def blocking(i: int):
+        return slow_query(f"select {i}")
+
+    class SlowManager:
+        def execute_query(self, query: str, params: dict = None) -> List[dict]:
+            return slow_query(query)
+
+    slow_manager = AsyncDatabaseManager(SlowManager())
+
+    async def non_blocking(i: int):
+        return await slow_manager.execute_query(f"select {i}")
+
+    async def main():
+        blocking_lag = await measure("直接调用", blocking)
+        async_lag = await measure("线程池调用", non_blocking)
+        assert async_lag < SLOW_SECONDS / 5 < blocking_lag, "线程池调用时事件循环仍被阻塞"
+        print("自检通过")
+
+    asyncio.run(main())
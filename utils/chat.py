@@ -1,13 +1,18 @@
 import time
 import json
+import asyncio
+from contextlib import aclosing
 from openai import OpenAI
 import logging
 from google.genai import types # For creating message Content/Parts
 from google.adk.runners import Runner # 导入 Runner 用于类型提示
 from google.adk.events import Event, EventActions
+from google.adk.agents.run_config import RunConfig, StreamingMode
 from utils.config_loader import ConfigLoader
+from utils.llm_call_stats import TurnCounter
+from utils.tool_memo import begin_invocation, end_invocation
 
-from typing import Dict, Any # 用于 Dict 和 Any 类型提示
+from typing import Dict, Any, Awaitable, Callable, Optional # 用于类型提示
 
 # 配置日志记录器
 logger = logging.getLogger(__name__)
@@ -95,7 +100,8 @@ async def call_agent_async_v1(query, runner, user_id, session_id):
     logger.info(f"Agent Response: {final_response_text}")
     return final_response_text
 
-async def call_agent_async(query: str, runner: Runner, user_id: str, session_id: str, request_body: Dict[str, Any]) -> str:
+async def call_agent_async(query: str, runner: Runner, user_id: str, session_id: str, request_body: Dict[str, Any],
+                           on_text: Optional[Callable[[str, bool], Awaitable[None]]] = None) -> str:
     """
     向智能体发送查询并打印最终响应。
     Args:
@@ -104,6 +110,8 @@ async def call_agent_async(query: str, runner: Runner, user_id: str, session_id:
         user_id: 用户ID //对应我们的task_id
         session_id: 会话ID //对应我们的session_id
         request_body: 整个请求体，将被存储到session.state
+        on_text: 可选的流式回调 on_text(文本, 是否增量)。提供时以 SSE 流式模式运行智能体，
+                 模型每生成一段文本调用一次 on_text(增量文本, True)，每次模型响应完整结束时调用 on_text(完整文本, False)
     Returns:
         final_response_text: 最终响应
     """
@@ -149,30 +157,55 @@ async def call_agent_async(query: str, runner: Runner, user_id: str, session_id:
     # 应该已经包含了 request_body 中的所有字段。
     # 由于我们在此处手动管理了会话状态的更新，Runner.run_async 不再需要额外的 state 参数。
     print(f"content的类型: {type(content)}")
-    async for event in runner.run_async(
-        user_id=user_id,
-        session_id=session_id+user_id,
-        new_message=content,
-    ):
-        # 记录所有事件，帮助调试
-        logger.info(f"事件: 作者={event.author}, 类型={type(event).__name__}, 最终={event.is_final_response()}")
-        
-        if event.content and event.content.parts:
-            current_response = event.content.parts[0].text
-            logger.info(f"当前响应: {current_response}")
-            
-            # 更新最后的响应
-            last_response_text = current_response
-            
-            # 如果是最终响应，更新final_response_text
-            if event.is_final_response():
-                final_response_text = current_response
-                logger.info(f"找到最终响应: {final_response_text}")
-        
-        elif event.actions and event.actions.escalate:
-            final_response_text = f"智能体升级：{event.error_message or '无特定消息。'}"
-            logger.info(f"智能体升级: {final_response_text}")
-            break
+    # 使用 aclosing 确保任务被取消（如被新消息取代）时，run_async 生成器也会被及时关闭，不再继续调用模型
+    run_config = RunConfig(streaming_mode=StreamingMode.SSE) if on_text else RunConfig()
+    turn_counter = TurnCounter()
+    # 本轮对话内相同参数的只读工具调用只执行一次
+    memo_token = begin_invocation()
+    try:
+        async with aclosing(runner.run_async(
+            user_id=user_id,
+            session_id=session_id+user_id,
+            new_message=content,
+            run_config=run_config,
+        )) as events:
+            async for event in events:
+                # 流式模式下的增量事件只转交给 on_text，完整文本以随后的非增量事件为准
+                if event.partial:
+                    if event.content and event.content.parts:
+                        delta = "".join(part.text for part in event.content.parts if part.text)
+                        if delta:
+                            await on_text(delta, True)
+                    continue
+
+                turn_counter.observe(event)
+                # 记录所有事件，帮助调试
+                logger.info(f"事件: 作者={event.author}, 类型={type(event).__name__}, 最终={event.is_final_response()}")
+                
+                if event.content and event.content.parts:
+                    current_response = event.content.parts[0].text
+                    logger.info(f"当前响应: {current_response}")
+                    
+                    # 更新最后的响应
+                    last_response_text = current_response
+                    if on_text:
+                        await on_text(current_response or "", False)
+                    
+                    # 如果是最终响应，更新final_response_text
+                    if event.is_final_response():
+                        final_response_text = current_response
+                        logger.info(f"找到最终响应: {final_response_text}")
+                
+                elif event.actions and event.actions.escalate:
+                    final_response_text = f"智能体升级：{event.error_message or '无特定消息。'}"
+                    logger.info(f"智能体升级: {final_response_text}")
+                    break
+    except asyncio.CancelledError:
+        logger.info(f"智能体运行已取消 - user_id: {user_id}, session_id: {session_id}")
+        raise
+    finally:
+        end_invocation(memo_token)
+        turn_counter.finish()
     
     # 如果没有找到明确的最终响应，使用最后一个响应
     if final_response_text == "智能体没有产生最终响应。" and last_response_text != final_response_text:
@@ -31,6 +31,12 @@ class ConfigLoader:
             with open(db_config_path, 'r', encoding='utf-8') as f:
                 self._config['database'] = yaml.safe_load(f)['database']
 
+        # 加载智能体服务配置
+        agent_service_path = 'configs/agent_service.yaml'
+        if os.path.exists(agent_service_path):
+            with open(agent_service_path, 'r', encoding='utf-8') as f:
+                self._config['agent_service'] = yaml.safe_load(f)['agent_service'] or {}
+
     def get_api_key(self, service: str, key_type: str = 'api_key') -> str:
         """
         获取指定服务的API密钥或base_url
@@ -54,4 +60,16 @@ class ConfigLoader:
         Returns:
             Dict[str, Any]: 数据库配置字典
         """
-        return self._config.get('database', {}) 
\ No newline at end of file
+        return self._config.get('database', {})
+
+    def get_agent_service_config(self, section: str) -> Dict[str, Any]:
+        """
+        获取智能体服务的某一项配置
+
+        Args:
+            section (str): 配置项名称 (如 worker_pool)
+
+        Returns:
+            Dict[str, Any]: 配置字典，未配置时返回空字典
+        """
+        return self._config.get('agent_service', {}).get(section) or {}
@@ -2,12 +2,13 @@ import os
 import json
 import asyncio
 from concurrent.futures import ThreadPoolExecutor
-from tools.notify import send_prohibit_notify
+from tools.notify import send_prohibit_notify, send_strategy_status_notify
 from utils.chat import chat_qwen, chat_ernie, chat_ark
 from utils.db_queries import select_base_info, select_talk_style, select_knowledge, select_product
 from utils.db_queries import select_forbidden_content, select_sale_process
 from utils.db_insert import insert_sale_prompt, insert_opening_remarks
 from utils.logger_config import get_utils_logger
+from utils.async_db import run_db
 
 # 获取工具模块的日志记录器
 logger = get_utils_logger()
@@ -42,13 +43,13 @@ async def restore_content_from_database(tenant_id: int, task_id: int, save_to_fi
         
         # 1. 读取禁止事项
         logger.info("1. 读取禁止事项...")
-        forbidden_content = select_forbidden_content(tenant_id, task_id)
+        forbidden_content = await run_db(select_forbidden_content, tenant_id, task_id)
         result['forbidden_content'] = forbidden_content
         logger.info(f"✓ 禁止事项读取成功: {forbidden_content}")
         
         # 2. 读取销售流程
         logger.info("2. 读取销售流程...")
-        sale_process_content = select_sale_process(tenant_id, task_id)
+        sale_process_content = await run_db(select_sale_process, tenant_id, task_id)
         result['sale_process_content'] = sale_process_content
         logger.info(f"✓ 销售流程读取成功: {sale_process_content}")
         
@@ -214,8 +215,8 @@ async def create_role(tenant_id, task_id, strategy_id):
             logger.info("通知发送成功")
         except Exception as notify_error:
             logger.error(f"发送通知失败: {str(notify_error)}", exc_info=True)
-            await send_prohibit_notify(tenant_id, task_id, strategy_id, prohibit, sale_flow, status=3)
-            # 通知失败不影响角色创建流程
+            # 写入失败时不再重试整批写入，只把策略状态标记为失败；通知失败不影响角色创建流程
+            await send_strategy_status_notify(tenant_id, task_id, strategy_id, status=3)
         
         logger.info(f"角色创建完成 - 租户ID: {tenant_id}, 任务ID: {task_id}, 策略ID: {strategy_id}")
         return content
@@ -335,8 +336,8 @@ async def create_one_to_N_role(tenant_id, task_id, strategy_id):
             logger.info("通知发送成功")
         except Exception as notify_error:
             logger.error(f"发送通知失败: {str(notify_error)}", exc_info=True)
-            await send_prohibit_notify(tenant_id, task_id, strategy_id, prohibit, sale_flow, status=3)
-            # 通知失败不影响角色创建流程
+            # 写入失败时不再重试整批写入，只把策略状态标记为失败；通知失败不影响角色创建流程
+            await send_strategy_status_notify(tenant_id, task_id, strategy_id, status=3)
         
         logger.info(f"角色创建完成 - 租户ID: {tenant_id}, 任务ID: {task_id}, 策略ID: {strategy_id}")
         return content
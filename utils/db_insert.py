@@ -1,36 +1,36 @@
 from core.database_core import db_manager
+from tools.database import statements
 from typing import Dict, Any
 from utils.logger_config import get_database_logger
+from utils.prompt_cache import bump_prompt_version
+from utils.reference_cache import invalidate_references
 import json
 
 logger = get_database_logger()
 
 
+_INSERT_SALE_PROMPT_SQL = statements.register("insert_sale_prompt", """
+    INSERT INTO sale_prompt (tenant_id, task_id, test_prompt, system_prompt, create_by, create_time, update_time, is_del)
+    VALUES (:tenant_id, :task_id, :test_prompt, :system_prompt, :create_by, NOW(), NOW(), 0);
+    """)
+
 def insert_sale_prompt(tenant_id: int, task_id: int, system_prompt: str, test_prompt: str, create_by: str = 'system') -> bool:
     """
     插入销售提示词。
     """
-    escaped_system_prompt = system_prompt.replace("'", "''")
-    escaped_test_prompt = test_prompt.replace("'", "''")
-    insert_sql = f"""
-    INSERT INTO sale_prompt (tenant_id, task_id, test_prompt, system_prompt, create_by, create_time, update_time, is_del)
-    VALUES ({tenant_id}, {task_id}, '{escaped_test_prompt}', '{escaped_system_prompt}', '{create_by}', NOW(), NOW(), 0);
-    """
-    db_manager.execute_insert(insert_sql)
+    db_manager.execute_insert(_INSERT_SALE_PROMPT_SQL, {
+        "tenant_id": tenant_id,
+        "task_id": task_id,
+        "test_prompt": test_prompt,
+        "system_prompt": system_prompt,
+        "create_by": create_by,
+    })
+    bump_prompt_version(tenant_id, task_id)
+    # 系统提示词不在引用数据缓存中，只需丢弃缓存的任务数据
+    invalidate_references(tenant_id, task_id, kinds=())
     return True
 
-def insert_opening_remarks(tenant_id: int, strategy_id: int, opening_remarks: str, create_by: str = 'system') -> bool:
-    """
-    插入开场白内容。
-    """
-    opening_remarks = json.loads(opening_remarks)
-    for item in opening_remarks:
-        if item['type'] == 'file':
-            content = item['url']
-        else:
-            content = item['content']
-        escaped_content = content.replace("'", "''")
-        insert_sql = f"""
+_INSERT_OPENING_REMARKS_SQL = statements.register("insert_opening_remarks", """
         INSERT INTO sale_prologue (
             -- 核心字段
             type,
@@ -49,14 +49,14 @@ def insert_opening_remarks(tenant_id: int, strategy_id: int, opening_remarks: st
             is_valid
         ) VALUES (
             -- 核心字段的值
-            '{item['type']}',         -- 例如: 'greeting'
-            '{escaped_content}', -- 例如: '您好，请问有什么可以帮助您的吗？'
+            :type,         -- 例如: 'greeting'
+            :content, -- 例如: '您好，请问有什么可以帮助您的吗？'
 
             -- 其他必填字段的值
-            {strategy_id},
-            '{create_by}',                 -- 例如: 'admin'
-            '{create_by}',                 -- 例如: 'admin'
-            {tenant_id},
+            :strategy_id,
+            :create_by,                 -- 例如: 'admin'
+            :create_by,                 -- 例如: 'admin'
+            :tenant_id,
 
             -- 具有默认值的字段的值
             NOW(),
@@ -64,39 +64,78 @@ def insert_opening_remarks(tenant_id: int, strategy_id: int, opening_remarks: st
             0,
             1
         );
-        """
+        """)
+
+def insert_opening_remarks(tenant_id: int, strategy_id: int, opening_remarks: str, create_by: str = 'system') -> bool:
+    """
+    插入开场白内容。
+    """
+    opening_remarks = json.loads(opening_remarks)
+    for item in opening_remarks:
+        if item['type'] == 'file':
+            content = item['url']
+        else:
+            content = item['content']
+        params = {
+            "type": item['type'],
+            "content": content,
+            "strategy_id": strategy_id,
+            "create_by": create_by,
+            "tenant_id": tenant_id,
+        }
         try:
-            db_manager.execute_insert(insert_sql)
+            db_manager.execute_insert(_INSERT_OPENING_REMARKS_SQL, params)
             logger.info(f"成功插入开场白内容：tenant_id={tenant_id}, strategy_id={strategy_id}, type={item['type']}, content={item['content'] if item['type'] != 'file' else item['url']}")
         except Exception as e:
             logger.error(f"插入开场白内容失败：{e}", exc_info=True)
             continue
     return True
 
+_UPDATE_SALE_SYSTEM_PROMPT_SQL = statements.register("update_sale_system_prompt", """
+    UPDATE sale_prompt SET system_prompt = :system_prompt, update_time = NOW() WHERE tenant_id = :tenant_id AND task_id = :task_id AND is_del = 0;
+    """)
+
 def update_sale_system_prompt(tenant_id: int, task_id: int, system_prompt: str, create_by: str = 'system') -> bool:
     """
     更新销售提示词。
     """
-    escaped_system_prompt = system_prompt.replace("'", "''")
-    update_sql = f"""
-    UPDATE sale_prompt SET system_prompt = '{escaped_system_prompt}', update_time = NOW() WHERE tenant_id = {tenant_id} AND task_id = {task_id} AND is_del = 0;
-    """
-    db_manager.execute_update(update_sql)
+    db_manager.execute_update(_UPDATE_SALE_SYSTEM_PROMPT_SQL, {"system_prompt": system_prompt, "tenant_id": tenant_id, "task_id": task_id})
+    bump_prompt_version(tenant_id, task_id)
+    invalidate_references(tenant_id, task_id, kinds=())
     return True
 
+_SELECT_SALE_SYSTEM_PROMPT_SQL = statements.register("select_sale_system_prompt_row", """
+    SELECT system_prompt FROM sale_prompt WHERE tenant_id = :tenant_id AND task_id = :task_id AND is_del = 0;
+    """)
+
 def select_sale_system_prompt(tenant_id: int, task_id: int) -> str:
     """
     查询销售提示词。
     """
-    select_sql = f"""
-    SELECT system_prompt FROM sale_prompt WHERE tenant_id = {tenant_id} AND task_id = {task_id} AND is_del = 0;
-    """
-    result = db_manager.execute_query(select_sql)
+    result = db_manager.execute_query(_SELECT_SALE_SYSTEM_PROMPT_SQL, {"tenant_id": tenant_id, "task_id": task_id})
     if result:
         return result[0]
     else:
         return None
 
+_INSERT_SALE_AI_DATA_SQL = statements.register("insert_sale_ai_data_record", """
+    INSERT INTO sale_ai_data (
+        type,
+        ai_text,
+        ai_status,
+        tenant_id,
+        create_by,
+        is_del -- 明确指定 is_del，使用其默认值 0
+    ) VALUES (
+        :ai_type,
+        :ai_text,
+        :ai_status,
+        :tenant_id,
+        :create_by,
+        0
+    );
+    """)
+
 def insert_sale_ai_data_record(ai_type: int, ai_text: str, ai_status: int, tenant_id: int, create_by: str = 'system') -> bool:
     """
     向 sale_ai_data 表中插入一条新的 AI 数据记录。
@@ -112,37 +151,37 @@ def insert_sale_ai_data_record(ai_type: int, ai_text: str, ai_status: int, tenan
     Returns:
         bool: True 表示插入成功，False 表示插入失败。
     """
-    # SQL INSERT 语句
-    # 注意：为了防止SQL注入，对字符串类型的值进行单引号转义。
-    # 在生产环境中，更推荐使用参数绑定（如：VALUES (:type, :text, ...)）
-    escaped_ai_text = ai_text.replace("'", "''") if ai_text else None
-    escaped_create_by = create_by.replace("'", "''") if create_by else None
-
-    query = f"""
-    INSERT INTO sale_ai_data (
-        type,
-        ai_text,
-        ai_status,
-        tenant_id,
-        create_by,
-        is_del -- 明确指定 is_del，使用其默认值 0
-    ) VALUES (
-        {ai_type},
-        '{escaped_ai_text}',
-        {ai_status},
-        {tenant_id},
-        '{escaped_create_by}',
-        0
-    );
-    """
+    params = {
+        "ai_type": ai_type,
+        "ai_text": ai_text,
+        "ai_status": ai_status,
+        "tenant_id": tenant_id,
+        "create_by": create_by,
+    }
     try:
-        db_manager.execute_query(query)
+        # execute_insert 会吞掉异常，这里用事务执行，失败时抛出异常并回滚
+        with db_manager.transaction() as connection:
+            db_manager.execute_on(connection, _INSERT_SALE_AI_DATA_SQL, params)
         logger.info(f"成功插入 AI 数据记录：tenant_id={tenant_id}, type={ai_type}, status={ai_status}")
+        # AI 文件按任务关联，这里不知道任务，失效租户下所有任务的 AI 文件
+        invalidate_references(tenant_id, kinds=("ai_data",))
         return True
     except Exception as e:
         logger.error(f"插入 AI 数据记录失败：{e}", exc_info=True)
         return False
     
+_UPDATE_SALE_AI_DATA_STATUS_SQL = statements.register("update_sale_ai_data_status", """
+    UPDATE sale_ai_data
+    SET
+        ai_status = :new_ai_status,
+        ai_text = :ai_text,
+        update_time = CURRENT_TIMESTAMP
+    WHERE
+        id = :record_id
+        AND tenant_id = :tenant_id
+        AND is_del = 0; -- 仅更新未被逻辑删除的记录
+    """)
+
 def update_sale_ai_data_status(record_id: int, tenant_id: int, new_ai_status: int = 1, ai_text: str = None) -> bool:
     """
     更新 sale_ai_data 表中指定记录的 AI 处理状态。
@@ -156,63 +195,53 @@ def update_sale_ai_data_status(record_id: int, tenant_id: int, new_ai_status: in
     Returns:
         bool: True 表示更新成功，False 表示更新失败。
     """
-    escaped_ai_text = ai_text.replace("'", "''") if ai_text else None
-
-    query = f"""
-    UPDATE sale_ai_data
-    SET
-        ai_status = {new_ai_status},
-        ai_text = '{escaped_ai_text}',
-        update_time = CURRENT_TIMESTAMP
-    WHERE
-        id = {record_id}
-        AND tenant_id = {tenant_id}
-        AND is_del = 0; -- 仅更新未被逻辑删除的记录
-    """
+    params = {
+        "new_ai_status": new_ai_status,
+        "ai_text": ai_text,
+        "record_id": record_id,
+        "tenant_id": tenant_id,
+    }
     try:
-        db_manager.execute_update(query)
+        db_manager.execute_update(_UPDATE_SALE_AI_DATA_STATUS_SQL, params)
         logger.info(f"成功更新 AI 数据记录 ID={record_id} 的状态为 {new_ai_status}")
+        invalidate_references(tenant_id, kinds=("ai_data",))
         return True
     except Exception as e:
         logger.error(f"更新 AI 数据记录 ID={record_id} 状态失败：{e}", exc_info=True)
         return False
     
 
+_INSERT_FILE_DESCRIPTION_SQL = statements.register("insert_file_description", """
+    INSERT INTO file_description (tenant_id, task_id, file_id, file_name, file_description)
+    VALUES (:tenant_id, :task_id, :file_id, :file_name, :file_description)
+    """)
+
 def insert_file_description(tenant_id: int, task_id: int, file_id: int, file_name: str, file_description: str):
     """
     插入文件描述信息。
     """
-    insert_sql = """
-    INSERT INTO file_description (tenant_id, task_id, file_id, file_name, file_description)
-    VALUES (%s, %s, %s, %s, %s)
-    """
-    db_manager.execute_query(insert_sql, (tenant_id, task_id, file_id, file_name, file_description))
+    with db_manager.transaction() as connection:
+        db_manager.execute_on(connection, _INSERT_FILE_DESCRIPTION_SQL, {
+            "tenant_id": tenant_id,
+            "task_id": task_id,
+            "file_id": file_id,
+            "file_name": file_name,
+            "file_description": file_description,
+        })
+
+_INSERT_CHAT_STYLE_SQL = statements.register("insert_chat_style", """
+    INSERT INTO chat_style (tenant_id, task_id, chat_style)
+    VALUES (:tenant_id, :task_id, :chat_style)
+    """)
 
 def insert_chat_style(tenant_id: int, task_id: int, chat_style: str):
     """
     插入聊天风格信息。
     """
-    insert_sql = """
-    INSERT INTO chat_style (tenant_id, task_id, chat_style)
-    VALUES (%s, %s, %s)
-    """
-    db_manager.execute_query(insert_sql, (tenant_id, task_id, chat_style))
+    with db_manager.transaction() as connection:
+        db_manager.execute_on(connection, _INSERT_CHAT_STYLE_SQL, {"tenant_id": tenant_id, "task_id": task_id, "chat_style": chat_style})
 
-def insert_customer_behavior(tenant_id: int, belong_wechat_id: str, wechat_id: str, title: str, content: str, create_by: str = 'system') -> str:
-    """
-    插入客户行为信息。 
-    Args:
-        tenant_id: 租户id
-        belong_wechat_id: 所属微信id
-        wechat_id: 微信id
-        title: 客户行为标题
-        content: 客户行为内容
-        create_by: 创建人
-    return: 插入客户行为成功
-    """
-    escaped_title = title.replace("'", "''")
-    escaped_content = content.replace("'", "''")
-    insert_sql = f"""
+_INSERT_CUSTOMER_BEHAVIOR_SQL = statements.register("insert_customer_behavior", """
             INSERT INTO sale_wechat_behavior (
             belong_wechat_id,
             wechat_id,
@@ -223,19 +252,40 @@ def insert_customer_behavior(tenant_id: int, belong_wechat_id: str, wechat_id: s
             is_del,
             create_time
         ) VALUES (
-            '{belong_wechat_id}',
-            '{wechat_id}',
-            '{escaped_title}',
-            '{escaped_content}',
-            '{create_by}',
-            '{tenant_id}',
+            :belong_wechat_id,
+            :wechat_id,
+            :title,
+            :content,
+            :create_by,
+            :tenant_id,
             0,
             NOW()
         );
+    """)
+
+def insert_customer_behavior(tenant_id: int, belong_wechat_id: str, wechat_id: str, title: str, content: str, create_by: str = 'system') -> str:
     """
+    插入客户行为信息。 
+    Args:
+        tenant_id: 租户id
+        belong_wechat_id: 所属微信id
+        wechat_id: 微信id
+        title: 客户行为标题
+        content: 客户行为内容
+        create_by: 创建人
+    return: 插入客户行为成功
+    """
+    params = {
+        "belong_wechat_id": belong_wechat_id,
+        "wechat_id": wechat_id,
+        "title": title,
+        "content": content,
+        "create_by": create_by,
+        "tenant_id": tenant_id,
+    }
     try:
-        logger.info(f"插入客户行为sql是: {insert_sql}")
-        result = db_manager.execute_insert(insert_sql)
+        logger.info(f"插入客户行为参数是: {params}")
+        result = db_manager.execute_insert(_INSERT_CUSTOMER_BEHAVIOR_SQL, params)
         logger.info(f"插入客户行为结果：{result}")
         logger.info(f"成功插入客户行为：tenant_id={tenant_id}, belong_wechat_id={belong_wechat_id}, wechat_id={wechat_id}, title={title}, content={content}")
         return "插入客户行为成功"
@@ -243,6 +293,37 @@ def insert_customer_behavior(tenant_id: int, belong_wechat_id: str, wechat_id: s
         logger.error(f"插入客户行为失败：{e}", exc_info=True)
         return "插入客户行为失败"
 
+_INSERT_CUSTOMER_PORTRAIT_SQL = statements.register("insert_customer_portrait", """
+    INSERT INTO sale_wechat_contact (
+        belong_wechat_id,   -- 联系人所属的微信账号ID（如机器人账号）
+        wechat_id,          -- 联系人本身的微信ID
+        name,               -- 姓名
+        phone,              -- 手机号
+        industry,           -- 行业
+        department,         -- 部门
+        company,            -- 公司
+        post,               -- 职位
+        company_size,       -- 公司规模
+        city,               -- 城市
+        create_by,          -- 创建人
+        tenant_id           -- 租户ID
+        -- 其他字段如 create_time 和 is_del 通常有默认值，可省略
+    ) VALUES (
+        :belong_wechat_id,
+        :wechat_id,
+        :name,
+        :phone,
+        :industry,
+        :department,
+        :company,
+        :post,
+        :company_size,
+        :city,
+        :create_by,
+        :tenant_id
+    );
+    """)
+
 def insert_customer_portrait(tenant_id: int, belong_wechat_id: int, wechat_id: int, phone: str, name: str, industry: str, department: str, company: str, post: str, company_size: int, city: str, create_by: str = 'system') -> str:
     """
     插入客户画像信息。
@@ -261,52 +342,36 @@ def insert_customer_portrait(tenant_id: int, belong_wechat_id: int, wechat_id: i
         create_by: 创建人
     return: 插入客户画像成功
     """
-    escaped_name = name.replace("'", "''")
-    escaped_phone = phone.replace("'", "''")
-    escaped_industry = industry.replace("'", "''")
-    escaped_department = department.replace("'", "''")
-    escaped_company = company.replace("'", "''")
-    escaped_post = post.replace("'", "''")
-    escaped_city = city.replace("'", "''")
-    escaped_create_by = create_by.replace("'", "''")
-    insert_sql = f"""
-    INSERT INTO sale_wechat_contact (
-        belong_wechat_id,   -- 联系人所属的微信账号ID（如机器人账号）
-        wechat_id,          -- 联系人本身的微信ID
-        name,               -- 姓名
-        phone,              -- 手机号
-        industry,           -- 行业
-        department,         -- 部门
-        company,            -- 公司
-        post,               -- 职位
-        company_size,       -- 公司规模
-        city,               -- 城市
-        create_by,          -- 创建人
-        tenant_id           -- 租户ID
-        -- 其他字段如 create_time 和 is_del 通常有默认值，可省略
-    ) VALUES (
-        '{belong_wechat_id}',
-        '{wechat_id}',
-        '{escaped_name}',
-        '{escaped_phone}',
-        '{escaped_industry}',
-        '{escaped_department}',
-        '{escaped_company}',
-        '{escaped_post}',
-        {company_size},
-        '{escaped_city}',
-        '{escaped_create_by}',
-        {tenant_id}
-    );
-    """
+    params = {
+        "belong_wechat_id": belong_wechat_id,
+        "wechat_id": wechat_id,
+        "name": name,
+        "phone": phone,
+        "industry": industry,
+        "department": department,
+        "company": company,
+        "post": post,
+        "company_size": company_size,
+        "city": city,
+        "create_by": create_by,
+        "tenant_id": tenant_id,
+    }
     try:
-        db_manager.execute_insert(insert_sql)
+        db_manager.execute_insert(_INSERT_CUSTOMER_PORTRAIT_SQL, params)
         logger.info(f"成功插入客户画像：tenant_id={tenant_id}, belong_wechat_id={belong_wechat_id}, wechat_id={wechat_id}, phone={phone}, name={name}, industry={industry}, department={department}, company={company}, post={post}, company_size={company_size}, city={city}")
         return "插入客户画像成功"
     except Exception as e:
         logger.error(f"插入客户画像失败：{e}", exc_info=True)
         return "插入客户画像失败"
 
+_TASK_STATUS_SQL = statements.register("get_task_status", """
+    SELECT id, tenant_id, type, ai_status, ai_text, create_time, update_time
+    FROM sale_ai_data
+    WHERE id = :record_id
+    AND tenant_id = :tenant_id
+    AND is_del = 0
+    """)
+
 def get_task_status(record_id: int, tenant_id: int) -> Dict[str, Any]:
     """
     获取任务处理状态。
@@ -318,15 +383,8 @@ def get_task_status(record_id: int, tenant_id: int) -> Dict[str, Any]:
     Returns:
         Dict[str, Any]: 包含任务状态信息的字典，如果未找到则返回None。
     """
-    query = f"""
-    SELECT id, tenant_id, type, ai_status, ai_text, create_time, update_time
-    FROM sale_ai_data
-    WHERE id = {record_id}
-    AND tenant_id = {tenant_id}
-    AND is_del = 0
-    """
     try:
-        result = db_manager.fetch_one(query)
+        result = db_manager.fetch_one(_TASK_STATUS_SQL, {"record_id": record_id, "tenant_id": tenant_id})
         if result:
             return {
                 "id": result[0],
@@ -343,6 +401,8 @@ def get_task_status(record_id: int, tenant_id: int) -> Dict[str, Any]:
         logger.error(f"查询任务状态失败：{e}", exc_info=True)
         return None
 
+_LAST_INSERT_ID_SQL = statements.register("get_last_insert_id", "SELECT LAST_INSERT_ID()")
+
 def get_last_insert_id() -> int:
     """
     获取最后插入记录的ID。
@@ -350,9 +410,8 @@ def get_last_insert_id() -> int:
     Returns:
         int: 最后插入记录的ID。
     """
-    query = "SELECT LAST_INSERT_ID()"
     try:
-        result = db_manager.fetch_one(query)
+        result = db_manager.fetch_one(_LAST_INSERT_ID_SQL)
         if result:
             return result[0]
         else:
@@ -1,13 +1,17 @@
 import logging
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Any, Mapping, Optional, Tuple
 from core.database_core import db_manager
+from tools.database import statements
+from utils.config_loader import ConfigLoader
+from utils.prompt_cache import bump_prompt_version
+from utils.reference_cache import REFERENCE_KINDS, add_invalidation_hook, invalidate_references, load_reference, store_reference
+from utils.ttl_cache import ReadThroughCache, TTLCache
 
 
-def select_ai_data(tenant_id: int, task_id: int) -> list[dict]:
-    """
-    根据租户ID和任务ID，查询任务的AI发送的文件数据。
-    """
-    try:
-        query = f"""
+# AI发送的文件数据的查询语句
+_AI_DATA_SQL = statements.register("select_ai_data", """
                 SELECT
                     sad.ai_text,
                     sad.url
@@ -18,24 +22,25 @@ def select_ai_data(tenant_id: int, task_id: int) -> list[dict]:
                 JOIN
                     sale_task st ON std.task_id = st.id
                 WHERE
-                    st.id = {task_id}
-                    AND st.tenant_id = {tenant_id}
+                    st.id = :task_id
+                    AND st.tenant_id = :tenant_id
                     AND sad.is_del = 0
                     AND std.is_del = 0
                     AND sad.ai_status = 2
                     AND st.is_del = 0;
-                """
-        result = db_manager.execute_query(query)
-        return result
-    except Exception as e:
-        return [f"查询AI发送的文件数据失败: {str(e)}"]
+                """)
 
-def select_base_info(tenant_id: int, task_id: int) -> list[dict]:
+def select_ai_data(tenant_id: int, task_id: int) -> list[dict]:
     """
-    根据租户ID和任务ID，查询任务的基本信息。
+    根据租户ID和任务ID，查询任务的AI发送的文件数据。
     """
     try:
-        query = f"""
+        return [dict(row) for row in _reference("ai_data", tenant_id, task_id)]
+    except Exception as e:
+        return [f"查询AI发送的文件数据失败: {str(e)}"]
+
+# 任务基本信息的查询语句
+_BASE_INFO_SQL = statements.register("select_base_info", """
             SELECT DISTINCT
                 swa.wechat_nickname
             FROM
@@ -45,40 +50,144 @@ def select_base_info(tenant_id: int, task_id: int) -> list[dict]:
             JOIN
                 sale_user_role sur ON su.id = sur.user_id
             WHERE
-                su.tenant_id = {tenant_id}       -- 筛选特定租户
-                AND sur.id = {task_id}         -- 筛选特定角色
+                su.tenant_id = :tenant_id       -- 筛选特定租户
+                AND sur.id = :task_id         -- 筛选特定角色
                 AND swa.is_del = 0                -- 确保微信账号未被逻辑删除
                 AND su.is_del = 0                 -- 确保用户未被逻辑删除
                 AND sur.is_del = 0                -- 确保用户-角色关联未被逻辑删除
-        """
-        result = db_manager.execute_query(query)
+        """)
+
+def select_base_info(tenant_id: int, task_id: int) -> list[dict]:
+    """
+    根据租户ID和任务ID，查询任务的基本信息。
+    """
+    try:
+        result = db_manager.execute_query(_BASE_INFO_SQL, {"tenant_id": tenant_id, "task_id": task_id})
         return result
     except Exception as e:
         return f"查询任务的基本信息失败: {str(e)}"
 
+# 工作机微信昵称的查询语句
+_WECHAT_NAME_SQL = statements.register("select_wechat_name", """
+            SELECT
+                swa.wechat_nickname
+            FROM
+                sale_wechat_account swa
+            WHERE
+                swa.tenant_id = :tenant_id
+                AND swa.wechat_id = :wechat_id
+        """)
+
+# 按租户预热昵称的查询语句
+_WECHAT_NAMES_SQL = statements.register("select_wechat_names_by_tenant", """
+            SELECT
+                swa.wechat_id,
+                swa.wechat_nickname
+            FROM
+                sale_wechat_account swa
+            WHERE
+                swa.tenant_id = :tenant_id
+            LIMIT :limit
+        """)
+
+# 微信昵称缓存：{(租户ID, 微信ID): 昵称}，查不到的微信ID缓存为 None（有效期较短），不再每次查询数据库
+_wechat_name_config = ConfigLoader().get_agent_service_config('wechat_name_cache')
+_wechat_name_enabled = _wechat_name_config.get('enabled', True)
+_wechat_name_ttl = _wechat_name_config.get('ttl_seconds', 600)
+_wechat_name_negative_ttl = _wechat_name_config.get('negative_ttl_seconds', 60)
+_wechat_names = ReadThroughCache(
+    maxsize=_wechat_name_config.get('max_entries', 10000),
+    ttl=_wechat_name_ttl,
+    name="wechat_name",
+)
+# 已预热的租户：{租户ID: 预热读入的条数}，过期后再次查询该租户的昵称时重新预热
+_warmed_tenants = ReadThroughCache(
+    maxsize=_wechat_name_config.get('max_tenants', 1024),
+    ttl=_wechat_name_ttl,
+    name="wechat_name_tenants",
+)
+
+
+def _wechat_name_ttl_of(nickname: Optional[str]) -> float:
+    return _wechat_name_ttl if nickname else _wechat_name_negative_ttl
+
+
+def warm_wechat_names(tenant_id: int) -> int:
+    """
+    一次查询读入租户的工作机微信昵称（最多 warm_max_rows 条），写入昵称缓存
+
+    Args:
+        tenant_id: 租户ID
+
+    Returns:
+        int: 读入的条数
+    """
+    rows = db_manager.execute_query(_WECHAT_NAMES_SQL, {"tenant_id": tenant_id, "limit": _wechat_name_config.get('warm_max_rows', 2000)})
+    for row in rows:
+        nickname = row['wechat_nickname'] or None
+        _wechat_names.set((str(tenant_id), str(row['wechat_id'])), nickname, ttl=_wechat_name_ttl_of(nickname))
+    logging.info(f"微信昵称预热完成 - tenant_id: {tenant_id}, 共 {len(rows)} 条")
+    return len(rows)
+
+
+def _wechat_name(tenant_id: int, wechat_id: str, fetch=None, refresh: bool = False) -> Optional[str]:
+    """
+    查询微信昵称，优先使用昵称缓存，租户第一次查询时先按租户预热
+
+    Args:
+        tenant_id: 租户ID
+        wechat_id: 微信ID
+        fetch: 在已有连接上执行语句的函数，为空时单独查询
+        refresh: 是否绕过缓存重新查询（查询结果写回缓存）
+
+    Returns:
+        Optional[str]: 昵称，查不到时为 None
+    """
+    def load() -> Optional[str]:
+        if fetch is not None:
+            rows = fetch(_WECHAT_NAME_SQL)
+        else:
+            rows = db_manager.execute_query(_WECHAT_NAME_SQL, {"tenant_id": tenant_id, "wechat_id": wechat_id})
+        return (rows[0]['wechat_nickname'] or None) if rows else None
+
+    if not _wechat_name_enabled:
+        return load()
+    key = (str(tenant_id), str(wechat_id))
+    if refresh:
+        nickname = load()
+        _wechat_names.set(key, nickname, ttl=_wechat_name_ttl_of(nickname))
+        return nickname
+    if key not in _wechat_names:
+        try:
+            _warmed_tenants.get_or_load(str(tenant_id), lambda: warm_wechat_names(tenant_id))
+        except Exception as e:
+            logging.warning(f"微信昵称预热失败 - tenant_id: {tenant_id}: {e}")
+    return _wechat_names.get_or_load(key, load, ttl=_wechat_name_ttl_of)
+
+
+def wechat_name_cache_stats() -> dict:
+    """微信昵称缓存和租户预热的命中统计"""
+    return {"names": _wechat_names.stats(), "tenants": _warmed_tenants.stats()}
+
+
 def select_wechat_name(tenant_id: int,  wechat_id: str) -> str:
     """
     根据租户ID、任务ID和微信ID，查询微信昵称。
+    结果按 (租户ID, 微信ID) 缓存 wechat_name_cache.ttl_seconds，查不到的微信ID缓存 negative_ttl_seconds。
     Args:
         tenant_id: 租户ID
         wechat_id: 微信ID
     Returns:
-        str: 微信昵称
+        str: 微信昵称，查不到或查询失败时为"客户"
     """
     try:
-        query = f"""
-            SELECT
-                swa.wechat_nickname
-            FROM
-                sale_wechat_account swa
-            WHERE
-                swa.tenant_id = {tenant_id}
-                AND swa.wechat_id = '{wechat_id}'
-        """
-        result = db_manager.execute_query(query)
-        return result[0]['wechat_nickname']
+        return _wechat_name(tenant_id, wechat_id) or "客户"
     except Exception as e:
-        return f"客户"
+        logging.warning(f"查询微信昵称失败 - tenant_id: {tenant_id}, wechat_id: {wechat_id}: {e}")
+        return "客户"
+
+# 任务聊天风格的查询语句
+_TALK_STYLE_SQL = statements.register("select_talk_style", "SELECT talk_style FROM sale_strategy WHERE tenant_id = :tenant_id AND task_id = :task_id")
 
 def select_talk_style(tenant_id: int, task_id: int) -> list[dict]:
     """
@@ -92,25 +201,13 @@ def select_talk_style(tenant_id: int, task_id: int) -> list[dict]:
         list[dict]: 任务的聊天风格
     """
     try:
-        query = f"SELECT talk_style FROM sale_strategy WHERE tenant_id = {tenant_id} AND task_id = {task_id}"
-        result = db_manager.execute_query(query)
+        result = db_manager.execute_query(_TALK_STYLE_SQL, {"tenant_id": tenant_id, "task_id": task_id})
         return result
     except Exception as e:
         return f"查询任务的聊天风格失败: {str(e)}"
     
-def select_knowledge(tenant_id: int, task_id: int) -> list[dict]:
-    """
-    根据租户ID和任务ID，查询任务的知识库。
-
-    Args:
-        tenant_id: 租户ID
-        task_id: 任务ID
-
-    Returns:
-        list[dict]: 任务的知识库
-    """
-    try:
-        query = f"""
+# 任务的知识库的查询语句
+_KNOWLEDGE_SQL = statements.register("select_knowledge", """
             SELECT
                 sk.title,
                 sk.text
@@ -121,30 +218,31 @@ def select_knowledge(tenant_id: int, task_id: int) -> list[dict]:
             JOIN
                 sale_task st ON stk.task_id = st.id
             WHERE
-                st.tenant_id = {tenant_id}
-                AND st.id = {task_id}
+                st.tenant_id = :tenant_id
+                AND st.id = :task_id
                 AND sk.is_del = 0  -- 考虑逻辑删除，只查询未删除的知识
                 AND stk.is_del = 0 -- 考虑逻辑删除，只查询未删除的任务-知识关联
                 AND st.is_del = 0; -- 考虑逻辑删除，只查询未删除的任务
-"""
-        result = db_manager.execute_query(query)
-        return result
-    except Exception as e:
-        return f"查询任务的知识库失败: {str(e)}"
-    
-def select_product(tenant_id: int, task_id: int) -> list[dict]:
+""")
+
+def select_knowledge(tenant_id: int, task_id: int) -> list[dict]:
     """
-    根据租户ID和任务ID，查询任务的产品。
+    根据租户ID和任务ID，查询任务的知识库。
 
     Args:
         tenant_id: 租户ID
         task_id: 任务ID
 
     Returns:
-        list[dict]: 任务的产品
+        list[dict]: 任务的知识库
     """
     try:
-        query = f"""
+        return [dict(row) for row in _reference("knowledge", tenant_id, task_id)]
+    except Exception as e:
+        return f"查询任务的知识库失败: {str(e)}"
+    
+# 任务的产品的查询语句
+_PRODUCT_SQL = statements.register("select_product", """
             SELECT
                 sp.id,
                 sp.name,
@@ -163,17 +261,41 @@ def select_product(tenant_id: int, task_id: int) -> list[dict]:
             JOIN
                 sale_task st ON stp.task_id = st.id
             WHERE
-                st.tenant_id = {tenant_id}
-                AND st.id = {task_id}
+                st.tenant_id = :tenant_id
+                AND st.id = :task_id
                 AND sp.is_del = 0   -- 考虑逻辑删除，只查询未删除的产品
                 AND stp.is_del = 0  -- 考虑逻辑删除，只查询未删除的任务-产品关联
                 AND st.is_del = 0;  -- 考虑逻辑删除，只查询未删除的任务
-"""
-        result = db_manager.execute_query(query)
-        return result
+""")
+
+def select_product(tenant_id: int, task_id: int) -> list[dict]:
+    """
+    根据租户ID和任务ID，查询任务的产品。
+
+    Args:
+        tenant_id: 租户ID
+        task_id: 任务ID
+
+    Returns:
+        list[dict]: 任务的产品
+    """
+    try:
+        return [dict(row) for row in _reference("products", tenant_id, task_id)]
     except Exception as e:
         return f"查询任务的产品失败: {str(e)}" 
     
+# 销售测试提示词的查询语句
+_SALE_PROMPT_SQL = statements.register("select_sale_prompt", """
+            SELECT
+                sp.test_prompt
+            FROM
+                sale_prompt sp
+            WHERE
+                sp.task_id = :task_id
+                AND sp.tenant_id = :tenant_id
+                AND sp.is_del = 0;
+        """)
+
 def select_sale_prompt(tenant_id : int, task_id : int) -> str:
     """
     查询销售提示词, 测试使用
@@ -184,49 +306,36 @@ def select_sale_prompt(tenant_id : int, task_id : int) -> str:
         str: 销售提示词
     """
     try:
-        query = f"""
+        result = db_manager.execute_query(_SALE_PROMPT_SQL, {"tenant_id": tenant_id, "task_id": task_id})
+        return result[0]['test_prompt']
+    except Exception as e:
+        return f"查询销售提示词失败: {str(e)}"
+
+# 销售系统提示词的查询语句
+_SALE_SYSTEM_PROMPT_SQL = statements.register("select_sale_system_prompt", """
             SELECT
-                sp.test_prompt
+                sp.system_prompt
             FROM
                 sale_prompt sp
             WHERE
-                sp.task_id = {task_id}
-                AND sp.tenant_id = {tenant_id}
+                sp.task_id = :task_id
+                AND sp.tenant_id = :tenant_id
                 AND sp.is_del = 0;
-        """
-        result = db_manager.execute_query(query)
-        return result[0]['test_prompt']
-    except Exception as e:
-        return f"查询销售提示词失败: {str(e)}"
+        """)
 
 def select_sale_system_prompt(tenant_id : int, task_id : int) -> str:
     """
     查询销售系统提示词
     """
     try:
-        query = f"""
-            SELECT
-                sp.system_prompt
-            FROM
-                sale_prompt sp
-            WHERE
-                sp.task_id = {task_id}
-                AND sp.tenant_id = {tenant_id}
-                AND sp.is_del = 0;
-        """
-        result = db_manager.execute_query(query)
+        result = db_manager.execute_query(_SALE_SYSTEM_PROMPT_SQL, {"tenant_id": tenant_id, "task_id": task_id})
         logging.info(f"销售系统提示词是: {result}")
         return result[0]['system_prompt']
     except Exception as e:
         return ""
 
-def select_forbidden_content(tenant_id : int, task_id : int) -> list:
-    """
-    查询禁止内容
-    """
-    try:
-        from tools.tools import format_forbidden_content
-        query = f"""
+# 禁止内容的查询语句
+_FORBIDDEN_CONTENT_SQL = statements.register("select_forbidden_content", """
             SELECT
                 sf.text AS forbidden_content
             FROM
@@ -234,28 +343,34 @@ def select_forbidden_content(tenant_id : int, task_id : int) -> list:
             JOIN
                 sale_strategy ss ON sf.strategy_id = ss.id
             WHERE
-                ss.tenant_id = "{tenant_id}"
-                AND ss.task_id = "{task_id}"
+                ss.tenant_id = :tenant_id
+                AND ss.task_id = :task_id
                 AND sf.is_del = 0  -- 确保禁止事项未被逻辑删除
                 AND ss.is_del = 0; -- 确保销售策略未被逻辑删除
-        """
-        result = db_manager.execute_query(query)
-        forbidden_content = []
-        if result:
-            for item in result:
-                forbidden_content.append(item['forbidden_content'])
+        """)
+
+def _forbidden_content_rows(result: list[dict]) -> list:
+    """把禁止内容的查询结果转换为文本列表"""
+    forbidden_content = []
+    if result:
+        for item in result:
+            forbidden_content.append(item['forbidden_content'])
+    return forbidden_content
+
+def select_forbidden_content(tenant_id : int, task_id : int) -> list:
+    """
+    查询禁止内容
+    """
+    try:
+        from tools.tools import format_forbidden_content
+        forbidden_content = list(_reference("forbidden_content", tenant_id, task_id))
         # return format_forbidden_content(forbidden_content)
         return forbidden_content
     except Exception as e:
         return [f"查询禁止内容失败: {str(e)}"]
     
-def select_sale_process(tenant_id : int, task_id : int) -> str:
-    """
-    查询销售流程
-    """
-    try:
-        from tools.tools import format_sale_process
-        query = f"""
+# 销售流程的查询语句
+_SALE_PROCESS_SQL = statements.register("select_sale_process", """
             SELECT
                 sp.title AS process_title,
                 sp.text AS process_text,
@@ -265,26 +380,55 @@ def select_sale_process(tenant_id : int, task_id : int) -> str:
             JOIN
                 sale_strategy ss ON sp.strategy_id = ss.id
             WHERE
-                ss.tenant_id = {tenant_id}
-                AND ss.task_id = {task_id}
+                ss.tenant_id = :tenant_id
+                AND ss.task_id = :task_id
                 AND sp.is_del = 0
                 AND ss.is_del = 0
             ORDER BY
                 sp.sort;
-        """
-        result = db_manager.execute_query(query)
-        sale_process = []
-        if result:
-            for item in result:
-                sale_process.append({
-                    'title': item['process_title'],
-                    'description': item['process_text'],
-                    'sort': item['sort']
-                })
-        return sale_process
+        """)
+
+def _sale_process_rows(result: list[dict]) -> list[dict]:
+    """把销售流程的查询结果转换为 {'title', 'description', 'sort'} 列表"""
+    sale_process = []
+    if result:
+        for item in result:
+            sale_process.append({
+                'title': item['process_title'],
+                'description': item['process_text'],
+                'sort': item['sort']
+            })
+    return sale_process
+
+def select_sale_process(tenant_id : int, task_id : int) -> str:
+    """
+    查询销售流程
+    """
+    try:
+        from tools.tools import format_sale_process
+        return [dict(step) for step in _reference("sale_process", tenant_id, task_id)]
     except Exception as e:
         return []
 
+# 协作事项的查询语句，过滤掉的标题是固定的，直接写在语句中
+_COLLABORATE_FILTER_TITLES = ["客户追问价格", "客户发送不同消息类型", "回复不确定项处理"]
+_COLLABORATE_MATTERS_SQL = statements.register("select_collaborate_matters", f"""
+            SELECT
+                sc.id AS collaborate_id,
+                sc.title,
+                sc.text
+            FROM
+                sale_collaborate sc
+            JOIN
+                sale_task st ON sc.task_id = st.id
+            WHERE
+                st.tenant_id = :tenant_id
+                AND st.id = :task_id
+                AND sc.is_del = 0
+                AND st.is_del = 0
+                AND sc.title NOT IN ('{"', '".join(_COLLABORATE_FILTER_TITLES)}');
+            """)
+
 def select_collaborate_matters(tenant_id : int, task_id : int) -> list[dict]:
     """
     根据租户ID和任务ID，查询对应的协作事项的ID、标题和内容。
@@ -298,47 +442,154 @@ def select_collaborate_matters(tenant_id : int, task_id : int) -> list[dict]:
                     如果查询失败或无结果，返回空列表（或根据需要处理异常）。
     """
     try:
-        filter_res = ["客户追问价格", "客户发送不同消息类型", "回复不确定项处理"]
-        filter_titles = "', '".join(filter_res)
-        query = f"""
-            SELECT
-                sc.id AS collaborate_id,
-                sc.title,
-                sc.text
-            FROM
-                sale_collaborate sc
-            JOIN
-                sale_task st ON sc.task_id = st.id
-            WHERE
-                st.tenant_id = {tenant_id}
-                AND st.id = {task_id}
-                AND sc.is_del = 0
-                AND st.is_del = 0
-                AND sc.title NOT IN ('{filter_titles}');
-            """
-        result = db_manager.execute_query(query)
-        return result
+        return [dict(row) for row in _reference("collaborate_matters", tenant_id, task_id)]
     except Exception as e:
         return [f"查询协作事项失败: {str(e)}"]
             
 
-def insert_sale_prompt( task_id: int, tenant_id: int, system_prompt: str, test_prompt: str, create_by: str = 'system'):
+@dataclass(frozen=True)
+class TaskContext:
     """
-    向 sale_prompt 表中插入一条新的提示词记录。
+    一个任务在一轮对话中需要的全部数据，由 load_task_context 一次性查询得到，只读。
+    各列表字段的元素与对应 select_* 函数的返回值格式相同。
+    """
+    tenant_id: Any
+    task_id: Any
+    wechat_id: Optional[str]
+    wechat_name: str
+    system_prompt: str
+    sale_process: Tuple[Mapping[str, Any], ...]
+    forbidden_content: Tuple[str, ...]
+    collaborate_matters: Tuple[Mapping[str, Any], ...]
+    products: Tuple[Mapping[str, Any], ...]
+    ai_data: Tuple[Mapping[str, Any], ...]
+    knowledge: Tuple[Mapping[str, Any], ...]
+
+
+def _frozen_rows(rows: list[dict]) -> Tuple[Mapping[str, Any], ...]:
+    return tuple(MappingProxyType(dict(row)) for row in rows)
+
+
+# 任务引用数据的查询语句和结果转换，结果为只读数据，经 utils.reference_cache 按 (种类, 租户, 任务) 缓存
+_REFERENCE_QUERIES = {
+    "knowledge": (_KNOWLEDGE_SQL, _frozen_rows),
+    "products": (_PRODUCT_SQL, _frozen_rows),
+    "collaborate_matters": (_COLLABORATE_MATTERS_SQL, _frozen_rows),
+    "sale_process": (_SALE_PROCESS_SQL, lambda rows: _frozen_rows(_sale_process_rows(rows))),
+    "forbidden_content": (_FORBIDDEN_CONTENT_SQL, lambda rows: tuple(_forbidden_content_rows(rows))),
+    "ai_data": (_AI_DATA_SQL, _frozen_rows),
+}
+
+
+def _reference(kind: str, tenant_id: int, task_id: int, fetch=None, refresh: bool = False) -> tuple:
+    """
+    读取一种任务引用数据（只读元组），优先使用缓存
 
     Args:
-        db_manager (DatabaseManager): DatabaseManager 类的实例。
-        task_id (int): 任务ID。
-        tenant_id (int): 租户ID。
-        system_prompt (str): 系统提示内容。
-        test_prompt (str): 测试提示内容。
-        create_by (str, optional): 创建人。默认为 'system'。
+        kind: 数据种类，见 utils.reference_cache.REFERENCE_KINDS
+        tenant_id: 租户ID
+        task_id: 任务ID
+        fetch: 在已有连接上执行语句的函数，为空时单独查询
+        refresh: 是否绕过缓存重新查询（查询结果写回缓存）
+    """
+    statement, convert = _REFERENCE_QUERIES[kind]
+
+    def load() -> tuple:
+        if fetch is not None:
+            return convert(fetch(statement))
+        return convert(db_manager.execute_query(statement, {"tenant_id": tenant_id, "task_id": task_id}))
+
+    if refresh:
+        value = load()
+        store_reference(kind, tenant_id, task_id, value)
+        return value
+    return load_reference(kind, tenant_id, task_id, load)
+
+
+def load_task_context(tenant_id: int, task_id: int, wechat_id: Optional[str] = None, refresh: bool = False) -> TaskContext:
+    """
+    在同一个数据库连接上依次执行任务所需的全部查询，组装成 TaskContext。
+    代替一轮对话中分散调用的 select_wechat_name、select_sale_system_prompt、select_sale_process、
+    select_forbidden_content、select_collaborate_matters、select_product、select_ai_data、select_knowledge。
+    销售流程、禁止事项、协作事项、产品、AI 文件和知识库优先使用引用数据缓存，只查询未缓存的部分。
+
+    Args:
+        tenant_id: 租户ID
+        task_id: 任务ID
+        wechat_id: 工作机微信ID，为空时 wechat_name 为默认值"客户"
+        refresh: 是否绕过引用数据缓存重新查询全部数据
 
     Returns:
-        bool: True 表示插入成功，False 表示插入失败（例如违反唯一约束）。
+        TaskContext: 任务数据
     """
-    # SQL INSERT 语句
-    query = f"""
+    params = {"tenant_id": tenant_id, "task_id": task_id, "wechat_id": wechat_id}
+    with db_manager.connect() as connection:
+        def fetch(statement) -> list[dict]:
+            return [row._asdict() for row in db_manager.execute_on(connection, statement, params)]
+
+        wechat_name = _wechat_name(tenant_id, wechat_id, fetch, refresh) if wechat_id else None
+        system_prompt_rows = fetch(_SALE_SYSTEM_PROMPT_SQL)
+        references = {kind: _reference(kind, tenant_id, task_id, fetch, refresh) for kind in REFERENCE_KINDS}
+    logging.info(f"任务数据加载完成 - tenant_id: {tenant_id}, task_id: {task_id}")
+    return TaskContext(
+        tenant_id=tenant_id,
+        task_id=task_id,
+        wechat_id=wechat_id,
+        wechat_name=wechat_name or "客户",
+        system_prompt=(system_prompt_rows[0]['system_prompt'] or "") if system_prompt_rows else "",
+        **references,
+    )
+
+
+_task_context_config = ConfigLoader().get_agent_service_config('task_context')
+# 最近加载的任务数据，同一轮对话中提示词拼装和工具调用共用一份
+_task_contexts = TTLCache(
+    maxsize=_task_context_config.get('max_entries', 1024),
+    ttl=_task_context_config.get('ttl_seconds', 30),
+    name="task_context",
+)
+
+
+def get_task_context(tenant_id: int, task_id: int, wechat_id: Optional[str] = None, refresh: bool = False) -> TaskContext:
+    """
+    获取任务数据，ttl_seconds 内复用最近一次 load_task_context 的结果
+
+    Args:
+        tenant_id: 租户ID
+        task_id: 任务ID
+        wechat_id: 工作机微信ID
+        refresh: 是否忽略已加载的数据和引用数据缓存重新查询（拼装会被长期缓存的提示词时使用）
+
+    Returns:
+        TaskContext: 任务数据
+    """
+    key = (str(tenant_id), str(task_id), wechat_id)
+    if not refresh:
+        context = _task_contexts.get(key)
+        if context is not None:
+            return context
+        # 工具调用时一般不知道工作机微信ID，复用任意一份同任务的数据即可
+        if wechat_id is None:
+            context = _task_contexts.get((str(tenant_id), str(task_id), "*"))
+            if context is not None:
+                return context
+    context = load_task_context(tenant_id, task_id, wechat_id, refresh)
+    _task_contexts.set(key, context)
+    _task_contexts.set((str(tenant_id), str(task_id), "*"), context)
+    return context
+
+
+
+def _discard_task_contexts(tenant_id, task_id, kinds):
+    """引用数据失效时，同时丢弃包含这些数据的任务数据"""
+    tenant, task = str(tenant_id), None if task_id is None else str(task_id)
+    _task_contexts.discard_where(lambda key: key[0] == tenant and (task is None or key[1] == task))
+
+
+add_invalidation_hook(_discard_task_contexts)
+
+# 新增提示词记录的语句，参数由驱动转义
+_INSERT_SALE_PROMPT_SQL = statements.register("insert_sale_prompt_record", """
     INSERT INTO sale_prompt (
         task_id,
         tenant_id,
@@ -346,19 +597,44 @@ def insert_sale_prompt( task_id: int, tenant_id: int, system_prompt: str, test_p
         test_prompt,
         create_by
     ) VALUES (
-        {task_id},
-        {tenant_id},
-        '{system_prompt.replace("'", "''")}', -- 转义单引号以防止SQL注入问题
-        '{test_prompt.replace("'", "''")}',    -- 同上
-        '{create_by.replace("'", "''")}'
+        :task_id,
+        :tenant_id,
+        :system_prompt,
+        :test_prompt,
+        :create_by
     );
+    """)
+
+def insert_sale_prompt( task_id: int, tenant_id: int, system_prompt: str, test_prompt: str, create_by: str = 'system'):
     """
+    向 sale_prompt 表中插入一条新的提示词记录。
+
+    Args:
+        db_manager (DatabaseManager): DatabaseManager 类的实例。
+        task_id (int): 任务ID。
+        tenant_id (int): 租户ID。
+        system_prompt (str): 系统提示内容。
+        test_prompt (str): 测试提示内容。
+        create_by (str, optional): 创建人。默认为 'system'。
+
+    Returns:
+        bool: True 表示插入成功，False 表示插入失败（例如违反唯一约束）。
+    """
+    params = {
+        "task_id": task_id,
+        "tenant_id": tenant_id,
+        "system_prompt": system_prompt,
+        "test_prompt": test_prompt,
+        "create_by": create_by,
+    }
     try:
-        # execute_query 方法可以执行 INSERT 语句
-        # 对于 INSERT, UPDATE, DELETE 操作，execute_query 返回的列表通常是空的
-        # 但如果执行成功，不会抛出异常
-        db_manager.execute_query(query)
+        # execute_query 不提交事务，写入需通过 transaction() 执行，失败时抛出异常并回滚
+        with db_manager.transaction() as connection:
+            db_manager.execute_on(connection, _INSERT_SALE_PROMPT_SQL, params)
         print(f"成功插入提示词：任务ID={task_id}, 租户ID={tenant_id}") # Successfully inserted prompt
+        # 与 db_insert.insert_sale_prompt 相同：更新提示词版本号，丢弃缓存的任务数据
+        bump_prompt_version(tenant_id, task_id)
+        invalidate_references(tenant_id, task_id, kinds=())
         return True
     except Exception as e:
         print(f"插入提示词失败，任务ID={task_id}, 租户ID={tenant_id}: {e}") # Failed to insert prompt
@@ -379,41 +655,41 @@ def update_sale_prompt(task_id: int, tenant_id: int, system_prompt: str = None,
     Returns:
         bool: True 表示更新成功，False 表示更新失败。
     """
-    updates = []
-    if system_prompt is not None:
-        safe_system_prompt = system_prompt.replace("'", "''")
-        updates.append(f"system_prompt = '{safe_system_prompt}'")
-    if test_prompt is not None:
-        safe_test_prompt = test_prompt.replace("'", "''")
-        updates.append(f"test_prompt = '{safe_test_prompt}'")
-    if update_by is not None:
-        safe_update_by = update_by.replace("'", "''")
-        updates.append(f"update_by = '{safe_update_by}'")
+    values = {
+        "system_prompt": system_prompt,
+        "test_prompt": test_prompt,
+        "update_by": update_by,
+    }
+    updates = [column for column, value in values.items() if value is not None]
     # update_time 字段已经在 CREATE TABLE 语句中设置为 ON UPDATE CURRENT_TIMESTAMP，所以无需手动设置
 
     if not updates:
         print("没有提供要更新的字段。") # No fields provided for update.
         return False
 
-    update_clause = ", ".join(updates)
+    update_clause = ", ".join(f"{column} = :{column}" for column in updates)
     
-    # SQL UPDATE 语句
-    query = f"""
+    # SQL UPDATE 语句，列名只来自上面的固定列表，每种列组合注册一条语句
+    query = statements.register(f"update_sale_prompt[{','.join(updates)}]", f"""
     UPDATE sale_prompt
     SET
         {update_clause}
     WHERE
-        task_id = {task_id}
-        AND tenant_id = {tenant_id}
+        task_id = :task_id
+        AND tenant_id = :tenant_id
         AND is_del = 0; -- 仅更新未被逻辑删除的记录
-    """
+    """)
+    params = {column: values[column] for column in updates}
+    params.update(task_id=task_id, tenant_id=tenant_id)
     try:
-        db_manager.execute_query(query)
+        db_manager.execute_update(query, params)
         print(f"成功更新提示词：任务ID={task_id}, 租户ID={tenant_id}") # Successfully updated prompt
-        # return True
+        bump_prompt_version(tenant_id, task_id)
+        invalidate_references(tenant_id, task_id, kinds=())
+        return True
     except Exception as e:
         print(f"更新提示词失败，任务ID={task_id}, 租户ID={tenant_id}: {e}") # Failed to update prompt
-        pass
+        return False
 
 from typing import Optional # 确保有这一行
 
@@ -466,70 +742,103 @@ def update_customer_portrait(tenant_id: int, belong_wechat_id: str, wechat_id: s
         update_by = kwargs.get('update_by', 'ai_sale_v2')
         
         # 构建动态更新字段
-        update_fields = []
+        candidates = {
+            "phone": phone,
+            "name": name,
+            "industry": industry,
+            "department": department,
+            "company": company,
+            "post": post,
+            "company_size": company_size,
+            "city": city,
+        }
         
         # 检查每个字段是否有值，有值则添加到更新列表中
-        if phone is not None and phone.strip():
-            safe_phone = phone.strip().replace("'", "''")  # 转义单引号
-            update_fields.append(f"phone = '{safe_phone}'")
-            
-        if name is not None and name.strip():
-            safe_name = name.strip().replace("'", "''")
-            update_fields.append(f"name = '{safe_name}'")
-            
-        if industry is not None and industry.strip():
-            safe_industry = industry.strip().replace("'", "''")
-            update_fields.append(f"industry = '{safe_industry}'")
-            
-        if department is not None and department.strip():
-            safe_department = department.strip().replace("'", "''")
-            update_fields.append(f"department = '{safe_department}'")
-            
-        if company is not None and company.strip():
-            safe_company = company.strip().replace("'", "''")
-            update_fields.append(f"company = '{safe_company}'")
-            
-        if post is not None and post.strip():
-            safe_post = post.strip().replace("'", "''")
-            update_fields.append(f"post = '{safe_post}'")
-            
-        if company_size is not None and company_size.strip():
-            safe_company_size = company_size.strip().replace("'", "''")
-            update_fields.append(f"company_size = '{safe_company_size}'")
-            
-        if city is not None and city.strip():
-            safe_city = city.strip().replace("'", "''")
-            update_fields.append(f"city = '{safe_city}'")
+        params = {}
+        for column, value in candidates.items():
+            if value is not None and value.strip():
+                params[column] = value.strip()
         
         # 如果没有需要更新的字段，直接返回成功
-        if not update_fields:
+        if not params:
             return "没有需要更新的字段"
         
+        updated_fields = list(params)
         # 添加固定的更新字段
-        safe_update_by = update_by.replace("'", "''")
-        update_fields.append(f"update_by = '{safe_update_by}'")
+        update_fields = [f"{column} = :{column}" for column in updated_fields]
+        update_fields.append("update_by = :update_by")
         update_fields.append("update_time = NOW()")
         
-        # 构建SQL查询
-        query = f"""
+        # 构建SQL查询，列名只来自上面的固定列表，每种列组合注册一条语句
+        query = statements.register(f"update_customer_portrait[{','.join(updated_fields)}]", f"""
             UPDATE sale_wechat_contact
             SET
                 {', '.join(update_fields)}
             WHERE
-                tenant_id = {tenant_id} AND
-                belong_wechat_id = '{belong_wechat_id}' AND
-                wechat_id = '{wechat_id}';
-        """
+                tenant_id = :tenant_id AND
+                belong_wechat_id = :belong_wechat_id AND
+                wechat_id = :wechat_id;
+        """)
+        params.update(update_by=update_by, tenant_id=tenant_id, belong_wechat_id=belong_wechat_id, wechat_id=wechat_id)
         
         # 执行更新
-        db_manager.execute_update(query)
-        logging.info(f"更新客户画像的sql是: {query}")
+        db_manager.execute_update(query, params)
+        logging.info(f"更新客户画像的sql是: {query.text}")
         # 记录日志
-        updated_fields = [field.split(' = ')[0] for field in update_fields if ' = ' in field and 'update_by' not in field]
         logging.info(f"成功更新客户画像：tenant_id={tenant_id}, belong_wechat_id={belong_wechat_id}, wechat_id={wechat_id}, 更新字段={updated_fields}")
         return "更新客户画像成功"
         
     except Exception as e:
         logging.error(f"更新客户画像失败：{e}")
         return "更新客户画像失败"
-    
\ No newline at end of file
+    
+
+if __name__ == "__main__":
+    # 基准测试：同一组查询分别用拼接好的 SQL 文本（每次参数不同，文本也不同）和注册的参数化语句执行，比较单次查询耗时
+    # 用法: python -m utils.db_queries [数据库配置文件 ...]，默认对比 SQLite 和 MySQL 两份配置，连不上的配置会跳过
+    import sys
+    import time
+    from sqlalchemy import text
+    from tools.database import DatabaseManager
+
+    config_paths = sys.argv[1:] or ['configs/database_sqlite.yaml', 'configs/database.yaml']
+    rounds = 2000
+    benchmarks = [
+        ("select_wechat_name", _WECHAT_NAME_SQL),
+        ("select_sale_system_prompt", _SALE_SYSTEM_PROMPT_SQL),
+        ("select_sale_process", _SALE_PROCESS_SQL),
+        ("select_product", _PRODUCT_SQL),
+        ("select_ai_data", _AI_DATA_SQL),
+    ]
+    print(f"已注册语句 {len(statements.names())} 条")
+    for config_path in config_paths:
+        try:
+            manager = DatabaseManager(config_path)
+            with manager.engine.connect() as connection:
+                connection.execute(text("SELECT 1"))
+        except Exception as e:
+            print(f"{config_path}: 无法连接，跳过 ({e.__class__.__name__})")
+            continue
+        print(f"{config_path} ({manager.engine.dialect.name}), 每条查询执行 {rounds} 次, 参数各不相同")
+        print(f"{'语句':<28} {'拼接SQL(us/次)':>14} {'参数化(us/次)':>14}")
+        for name, statement in benchmarks:
+            params_list = [
+                {"tenant_id": 1 + i % 50, "task_id": 1 + i % 500, "wechat_id": f"wxid_{i % 500}"}
+                for i in range(rounds)
+            ]
+            used = {key: None for key in statement.compile().params}
+            literal_sql = [
+                str(statement.bindparams(**{key: params[key] for key in used}).compile(
+                    manager.engine, compile_kwargs={"literal_binds": True}))
+                for params in params_list
+            ]
+            with manager.engine.connect() as connection:
+                started = time.perf_counter()
+                for sql in literal_sql:
+                    connection.execute(text(sql)).fetchall()
+                inline = (time.perf_counter() - started) / rounds * 1e6
+                started = time.perf_counter()
+                for params in params_list:
+                    connection.execute(statement, params).fetchall()
+                bound = (time.perf_counter() - started) / rounds * 1e6
+            print(f"{name:<28} {inline:>14.1f} {bound:>14.1f}")
@@ -0,0 +1,392 @@
+"""
+持久化任务队列
+
+基于 DatabaseManager 的 SQLAlchemy 引擎（SQLite / MySQL 均可）实现的轻量任务队列，
+用来替代守护线程，保证服务重启或发布时已接收的任务不会丢失：
+- 租约/确认：lease() 领取任务并设置租约到期时间，处理完成后 ack()，失败后 nack()，入队后被拒绝的请求 discard()，
+  领取后未能开始处理的任务 release()
+- 失败重试：nack() 按指数退避重新排队，超过最大尝试次数后标记为 dead
+- 崩溃恢复：服务启动时 recover() 把上次进程遗留的租约释放回待处理状态
+- 定期清理：消费方调用 cleanup_if_due()，按间隔删除超过保留时间的已完成和 dead 任务
+"""
+
+import json
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import BigInteger, Column, Float, Index, Integer, MetaData, String, Table, Text
+from sqlalchemy import and_, delete, func, insert, or_, select, update
+
+from tools.database import DatabaseManager
+from utils.logger_config import get_database_logger
+
+logger = get_database_logger()
+
+JOB_PENDING = "pending"
+JOB_LEASED = "leased"
+JOB_DONE = "done"
+JOB_DEAD = "dead"
+
+metadata = MetaData()
+
+job_table = Table(
+    "ai_job_queue",
+    metadata,
+    Column("id", BigInteger().with_variant(Integer, "sqlite"), primary_key=True, autoincrement=True),
+    Column("queue_name", String(64), nullable=False),
+    Column("payload", Text, nullable=False),
+    Column("status", String(16), nullable=False, default=JOB_PENDING),
+    Column("attempts", Integer, nullable=False, default=0),
+    Column("max_attempts", Integer, nullable=False),
+    Column("available_at", Float, nullable=False),
+    Column("lease_until", Float, nullable=True),
+    Column("last_error", Text, nullable=True),
+    Column("create_time", Float, nullable=False),
+    Column("update_time", Float, nullable=False),
+    Index("idx_ai_job_queue_fetch", "queue_name", "status", "available_at"),
+)
+
+
+@dataclass
+class Job:
+    id: int
+    queue_name: str
+    payload: Dict[str, Any]
+    attempts: int
+    max_attempts: int
+
+    @property
+    def final_attempt(self) -> bool:
+        """是否是最后一次尝试（失败后不会再重试）"""
+        return self.attempts >= self.max_attempts
+
+
+class PersistentJobQueue:
+    def __init__(self, db_manager: DatabaseManager, queue_name: str, max_attempts: int = 3, base_backoff_seconds: float = 5, max_backoff_seconds: float = 300,
+                 cleanup_interval_seconds: float = 3600, retention_seconds: float = 7 * 24 * 3600):
+        """
+        初始化任务队列，任务表不存在时自动创建
+
+        Args:
+            db_manager: 数据库管理器，读取使用它的 SQLAlchemy 引擎，写入通过它的 transaction()（SQLite 下串行写入）
+            queue_name: 队列名称，同一张表中可以存放多个队列
+            max_attempts: 单个任务的最大尝试次数
+            base_backoff_seconds: 第一次重试前的等待时间（秒），之后每次翻倍
+            max_backoff_seconds: 重试等待时间上限（秒）
+            cleanup_interval_seconds: cleanup_if_due() 的清理间隔（秒），小于等于0时不清理
+            retention_seconds: 已完成和 dead 任务的保留时间（秒）
+        """
+        self.db_manager = db_manager
+        self.engine = db_manager.engine
+        self.queue_name = queue_name
+        self.max_attempts = max_attempts
+        self.base_backoff_seconds = base_backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.cleanup_interval_seconds = cleanup_interval_seconds
+        self.retention_seconds = retention_seconds
+        self._next_cleanup = time.monotonic() + cleanup_interval_seconds
+        self._cleanup_lock = threading.Lock()
+        metadata.create_all(self.engine, tables=[job_table], checkfirst=True)
+
+    def enqueue(self, payload: Dict[str, Any], lease_seconds: Optional[float] = None) -> int:
+        """
+        添加任务
+
+        Args:
+            payload: 任务数据，需可被 JSON 序列化
+            lease_seconds: 不为 None 时，任务在入队的同时被当前进程领取（计一次尝试），
+                           调用方直接处理，无需再经过 lease()
+
+        Returns:
+            int: 任务ID
+        """
+        now = time.time()
+        values = {
+            "queue_name": self.queue_name,
+            "payload": json.dumps(payload, ensure_ascii=False, default=str),
+            "status": JOB_PENDING,
+            "attempts": 0,
+            "max_attempts": self.max_attempts,
+            "available_at": now,
+            "create_time": now,
+            "update_time": now,
+        }
+        if lease_seconds is not None:
+            values.update(status=JOB_LEASED, attempts=1, lease_until=now + lease_seconds)
+        with self.db_manager.transaction() as connection:
+            result = connection.execute(insert(job_table).values(**values))
+            job_id = result.inserted_primary_key[0]
+        logger.info(f"[任务队列:{self.queue_name}] 任务入队 - id: {job_id}")
+        return job_id
+
+    def lease(self, limit: int = 1, lease_seconds: float = 300) -> List[Job]:
+        """
+        领取到期的待处理任务（包括租约已过期的任务），每次领取计一次尝试
+
+        Args:
+            limit: 最多领取的任务数
+            lease_seconds: 租约时长（秒），超过该时间未 ack/nack 的任务可被重新领取
+
+        Returns:
+            List[Job]: 成功领取的任务
+        """
+        if limit <= 0:
+            return []
+        now = time.time()
+        claimable = and_(
+            job_table.c.queue_name == self.queue_name,
+            or_(
+                and_(job_table.c.status == JOB_PENDING, job_table.c.available_at <= now),
+                and_(job_table.c.status == JOB_LEASED, job_table.c.lease_until < now),
+            ),
+        )
+        jobs = []
+        with self.db_manager.transaction() as connection:
+            candidates = connection.execute(
+                select(job_table).where(claimable).order_by(job_table.c.id).limit(limit)
+            ).fetchall()
+            for row in candidates:
+                # 条件更新保证多个进程同时领取时只有一个能成功
+                result = connection.execute(
+                    update(job_table)
+                    .where(and_(job_table.c.id == row.id, claimable))
+                    .values(status=JOB_LEASED, attempts=job_table.c.attempts + 1, lease_until=now + lease_seconds, update_time=now)
+                )
+                if result.rowcount == 1:
+                    jobs.append(Job(
+                        id=row.id,
+                        queue_name=row.queue_name,
+                        payload=json.loads(row.payload),
+                        attempts=row.attempts + 1,
+                        max_attempts=row.max_attempts,
+                    ))
+        if jobs:
+            logger.info(f"[任务队列:{self.queue_name}] 领取任务 - ids: {[job.id for job in jobs]}")
+        return jobs
+
+    def ack(self, job_id: int):
+        """确认任务处理完成"""
+        now = time.time()
+        with self.db_manager.transaction() as connection:
+            connection.execute(
+                update(job_table)
+                .where(job_table.c.id == job_id)
+                .values(status=JOB_DONE, lease_until=None, update_time=now)
+            )
+
+    def nack(self, job_id: int, error: str = "") -> bool:
+        """
+        任务处理失败，未超过最大尝试次数时按指数退避重新排队
+
+        Args:
+            job_id: 任务ID
+            error: 失败原因
+
+        Returns:
+            bool: True 表示会重试，False 表示已达到最大尝试次数，任务被标记为 dead
+        """
+        now = time.time()
+        with self.db_manager.transaction() as connection:
+            row = connection.execute(
+                select(job_table.c.attempts, job_table.c.max_attempts).where(job_table.c.id == job_id)
+            ).fetchone()
+            if row is None:
+                return False
+            will_retry = row.attempts < row.max_attempts
+            if will_retry:
+                backoff = min(self.max_backoff_seconds, self.base_backoff_seconds * (2 ** max(row.attempts - 1, 0)))
+                values = {"status": JOB_PENDING, "available_at": now + backoff}
+            else:
+                values = {"status": JOB_DEAD}
+            connection.execute(
+                update(job_table)
+                .where(job_table.c.id == job_id)
+                .values(lease_until=None, last_error=error[:2000], update_time=now, **values)
+            )
+        if will_retry:
+            logger.warning(f"[任务队列:{self.queue_name}] 任务 {job_id} 第 {row.attempts} 次处理失败，{backoff:.0f}秒后重试: {error}")
+        else:
+            logger.error(f"[任务队列:{self.queue_name}] 任务 {job_id} 已达到最大尝试次数 {row.max_attempts}，不再重试: {error}")
+        return will_retry
+
+    def release(self, job_ids: List[int]) -> int:
+        """
+        归还已领取但未开始处理的任务：立即放回待处理状态，并撤销领取时计的尝试次数
+
+        Args:
+            job_ids: 任务ID
+
+        Returns:
+            int: 归还的任务数
+        """
+        if not job_ids:
+            return 0
+        now = time.time()
+        with self.db_manager.transaction() as connection:
+            result = connection.execute(
+                update(job_table)
+                .where(and_(job_table.c.id.in_(job_ids), job_table.c.status == JOB_LEASED))
+                .values(status=JOB_PENDING, attempts=job_table.c.attempts - 1, available_at=now, lease_until=None, update_time=now)
+            )
+        logger.info(f"[任务队列:{self.queue_name}] 归还任务 - ids: {job_ids}")
+        return result.rowcount
+
+    def discard(self, job_id: int, reason: str = ""):
+        """
+        放弃任务：直接标记为 dead，不再重试（如请求入队后被拒绝，调用方会自行重试）
+
+        Args:
+            job_id: 任务ID
+            reason: 放弃原因
+        """
+        now = time.time()
+        with self.db_manager.transaction() as connection:
+            connection.execute(
+                update(job_table)
+                .where(job_table.c.id == job_id)
+                .values(status=JOB_DEAD, lease_until=None, last_error=reason[:2000], update_time=now)
+            )
+        logger.info(f"[任务队列:{self.queue_name}] 任务 {job_id} 已放弃: {reason}")
+
+    def recover(self) -> int:
+        """
+        崩溃恢复：把本队列中所有处于租约中的任务放回待处理状态。
+        只能在没有其他进程消费同一队列时（即服务启动时）调用。
+
+        Returns:
+            int: 恢复的任务数
+        """
+        now = time.time()
+        with self.db_manager.transaction() as connection:
+            result = connection.execute(
+                update(job_table)
+                .where(and_(job_table.c.queue_name == self.queue_name, job_table.c.status == JOB_LEASED))
+                .values(status=JOB_PENDING, available_at=now, lease_until=None, update_time=now)
+            )
+        if result.rowcount:
+            logger.warning(f"[任务队列:{self.queue_name}] 恢复了 {result.rowcount} 个未完成的任务")
+        return result.rowcount
+
+    def cleanup(self, retention_seconds: Optional[float] = None) -> int:
+        """
+        删除超过保留时间的已完成和 dead 任务
+
+        Args:
+            retention_seconds: 保留时间（秒），为 None 时使用初始化时的 retention_seconds
+
+        Returns:
+            int: 删除的任务数
+        """
+        with self.db_manager.transaction() as connection:
+            result = connection.execute(
+                delete(job_table).where(and_(
+                    job_table.c.queue_name == self.queue_name,
+                    job_table.c.status.in_([JOB_DONE, JOB_DEAD]),
+                    job_table.c.update_time < time.time() - (self.retention_seconds if retention_seconds is None else retention_seconds),
+                ))
+            )
+        if result.rowcount:
+            logger.info(f"[任务队列:{self.queue_name}] 清理了 {result.rowcount} 个过期任务")
+        return result.rowcount
+
+    def cleanup_if_due(self) -> int:
+        """
+        距离上次清理超过 cleanup_interval_seconds 时执行 cleanup()，供消费方在轮询中调用（线程安全，同一时间只有一个调用方清理）
+
+        Returns:
+            int: 删除的任务数，未到清理时间时为 0
+        """
+        if self.cleanup_interval_seconds <= 0 or time.monotonic() < self._next_cleanup:
+            return 0
+        if not self._cleanup_lock.acquire(blocking=False):
+            return 0
+        try:
+            self._next_cleanup = time.monotonic() + self.cleanup_interval_seconds
+            return self.cleanup()
+        except Exception as e:
+            logger.error(f"[任务队列:{self.queue_name}] 清理过期任务失败: {e}", exc_info=True)
+            return 0
+        finally:
+            self._cleanup_lock.release()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        获取各状态的任务数
+
+        Returns:
+            Dict[str, int]: {状态: 任务数}
+        """
+        with self.engine.connect() as connection:
+            rows = connection.execute(
+                select(job_table.c.status, func.count())
+                .where(job_table.c.queue_name == self.queue_name)
+                .group_by(job_table.c.status)
+            ).fetchall()
+        counts = {JOB_PENDING: 0, JOB_LEASED: 0, JOB_DONE: 0, JOB_DEAD: 0}
+        counts.update({row[0]: row[1] for row in rows})
+        return counts
+
+
+class JobWorkerThreads:
+    def __init__(self, job_queue: PersistentJobQueue, handler: Callable[[Job], Any], num_workers: int = 4, poll_interval: float = 1.0, lease_seconds: float = 1800):
+        """
+        以固定数量的线程消费任务队列，适用于同步的处理函数
+
+        Args:
+            job_queue: 任务队列
+            handler: 处理函数，正常返回视为成功（ack），抛出异常视为失败（nack）
+            num_workers: 线程数
+            poll_interval: 队列为空时的轮询间隔（秒）
+            lease_seconds: 领取任务时的租约时长（秒），需大于单个任务的最长处理时间
+        """
+        self.job_queue = job_queue
+        self.handler = handler
+        self.num_workers = num_workers
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def start(self):
+        """启动消费线程"""
+        self._stop.clear()
+        for index in range(self.num_workers):
+            thread = threading.Thread(target=self._run, name=f"{self.job_queue.queue_name}_worker_{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"[任务队列:{self.job_queue.queue_name}] 启动 {self.num_workers} 个消费线程")
+
+    def stop(self, timeout: float = 30):
+        """
+        停止消费线程。正在处理的任务会继续执行到结束；超时未结束的任务租约到期后会被重新领取
+
+        Args:
+            timeout: 每个线程的最长等待时间（秒）
+        """
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout=timeout)
+        self._threads = []
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                jobs = self.job_queue.lease(limit=1, lease_seconds=self.lease_seconds)
+            except Exception as e:
+                logger.error(f"[任务队列:{self.job_queue.queue_name}] 领取任务失败: {e}", exc_info=True)
+                self._stop.wait(self.poll_interval)
+                continue
+            if not jobs:
+                self.job_queue.cleanup_if_due()
+                self._stop.wait(self.poll_interval)
+                continue
+            job = jobs[0]
+            try:
+                self.handler(job)
+            except Exception as e:
+                logger.error(f"[任务队列:{self.job_queue.queue_name}] 任务 {job.id} 处理失败: {e}", exc_info=True)
+                self.job_queue.nack(job.id, str(e))
+            else:
+                self.job_queue.ack(job.id)
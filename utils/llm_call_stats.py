@@ -0,0 +1,134 @@
+"""
+智能体模型调用统计
+
+记录每轮对话（一次 call_agent_async）中模型被调用的次数和各工具的调用次数。
+每次工具调用都意味着多一次完整的模型往返，这里的统计用来衡量工具预取（prefetch_tools）等优化的效果。
+"""
+
+import threading
+from collections import Counter
+from typing import Any, Dict, Iterable
+
+_lock = threading.Lock()
+_turns = 0
+_llm_calls = 0
+_tool_calls: Counter = Counter()
+
+
+class TurnCounter:
+    """单轮对话的计数器，由 call_agent_async 逐个喂入非增量事件"""
+
+    def __init__(self):
+        self.llm_calls = 0
+        self.tool_calls: Counter = Counter()
+
+    def observe(self, event: Any):
+        """
+        统计一个事件：作者为模型的事件对应一次模型调用，其中的 function_call 对应工具调用
+
+        Args:
+            event: ADK 事件（非增量）
+        """
+        if not event.content or event.content.role != "model":
+            return
+        self.llm_calls += 1
+        for call in event.get_function_calls():
+            self.tool_calls[call.name] += 1
+
+    def finish(self):
+        """本轮结束，计入全局统计"""
+        record_turn(self.llm_calls, self.tool_calls.elements())
+
+
+def record_turn(llm_calls: int, tool_names: Iterable[str] = ()):
+    """
+    记录一轮对话
+
+    Args:
+        llm_calls: 本轮模型调用次数
+        tool_names: 本轮调用的工具名（每次调用一项）
+    """
+    global _turns, _llm_calls
+    with _lock:
+        _turns += 1
+        _llm_calls += llm_calls
+        _tool_calls.update(tool_names)
+
+
+def llm_call_stats() -> Dict[str, Any]:
+    """
+    获取模型调用统计
+
+    Returns:
+        Dict[str, Any]: 对话轮数、模型调用总数、平均每轮模型调用次数、各工具调用次数
+    """
+    with _lock:
+        return {
+            "turns": _turns,
+            "llm_calls": _llm_calls,
+            "llm_calls_per_turn": round(_llm_calls / _turns, 2) if _turns else 0.0,
+            "tool_calls": dict(_tool_calls),
+        }
+
+
+def reset_llm_call_stats():
+    """清空统计"""
+    global _turns, _llm_calls
+    with _lock:
+        _turns = 0
+        _llm_calls = 0
+        _tool_calls.clear()
+
+
+if __name__ == "__main__":
+    # 基准测试：对同一组客户消息分别关闭、开启工具预取，比较每轮的模型调用次数和耗时
+    # 用法: python -m utils.llm_call_stats <tenant_id> <task_id> <工作机微信ID> [客户微信ID]
+    # 会真实调用模型和工具（包括写入客户画像、客户行为），请使用测试租户
+    import asyncio
+    import sys
+    import time
+
+    from google.adk.runners import Runner
+    from google.adk.sessions import InMemorySessionService
+
+    import tools.callbacks as callbacks
+    from one_agents import one_to_N_agent
+    from utils.chat import call_agent_async
+
+    tenant_id, task_id, belong_chat_id = sys.argv[1], sys.argv[2], sys.argv[3]
+    customer_id = sys.argv[4] if len(sys.argv) > 4 else "benchmark_customer"
+    messages = [
+        "你好，你们是做什么的",
+        "有没有产品资料可以发我看看",
+        "这个产品多少钱",
+        "能便宜点吗",
+        "那明天下午两点来我公司聊聊吧，地址是科技园1号楼",
+    ]
+
+    async def run(prefetch: bool) -> Dict[str, Any]:
+        callbacks.PREFETCH_TOOLS = prefetch
+        reset_llm_call_stats()
+        runner = Runner(app_name="llm_call_benchmark", agent=one_to_N_agent, session_service=InMemorySessionService())
+        session_id = f"{customer_id}_{int(prefetch)}_{int(time.time())}"
+        started = time.perf_counter()
+        for index, message in enumerate(messages):
+            request_body = {
+                "tenant_id": tenant_id,
+                "task_id": task_id,
+                "belong_chat_id": belong_chat_id,
+                "wechat_id": customer_id,
+                "session_id": session_id,
+                "user_input": [{"type": "text", "content": message, "timestamp": f"2025-06-10 10:0{index}:00"}],
+            }
+            await call_agent_async(message, runner, task_id, session_id, request_body)
+        stats = llm_call_stats()
+        stats["seconds_per_turn"] = round((time.perf_counter() - started) / len(messages), 2)
+        return stats
+
+    async def main():
+        before = await run(False)
+        after = await run(True)
+        for label, stats in (("关闭预取", before), ("开启预取", after)):
+            print(f"{label}: 每轮模型调用 {stats['llm_calls_per_turn']} 次, 每轮耗时 {stats['seconds_per_turn']}s, 工具调用 {stats['tool_calls']}")
+
+    asyncio.run(main())
@@ -113,4 +113,24 @@ def get_database_logger() -> logging.Logger:
 
 def get_utils_logger() -> logging.Logger:
     """获取工具模块的日志记录器"""
-    return get_logger("utils") 
\ No newline at end of file
+    return get_logger("utils") 
+
+def get_slow_query_logger() -> logging.Logger:
+    """获取慢查询日志记录器，除常规日志外单独写入 logs/slow_query_日期.log"""
+    logger = get_logger("slow_query")
+    if not any(getattr(handler, "slow_query_log", False) for handler in logger.handlers):
+        today = datetime.now().strftime('%Y-%m-%d')
+        slow_query_handler = logging.handlers.RotatingFileHandler(
+            filename=ensure_log_directory() / f"slow_query_{today}.log",
+            maxBytes=10*1024*1024,  # 10MB
+            backupCount=30,
+            encoding='utf-8'
+        )
+        slow_query_handler.slow_query_log = True
+        slow_query_handler.setLevel(logging.WARNING)
+        slow_query_handler.setFormatter(logging.Formatter(
+            fmt='%(asctime)s - %(levelname)s - %(message)s',
+            datefmt='%Y-%m-%d %H:%M:%S'
+        ))
+        logger.addHandler(slow_query_handler)
+    return logger
@@ -0,0 +1,132 @@
+"""
+消息合并（防抖窗口）
+
+客户经常把一句话拆成几条短消息连续发送。同一个会话在窗口期内到达的消息先缓存，
+窗口期内没有新消息（或达到最长等待时间）后合并为一个任务提交给工作池，只触发一次智能体调用。
+所有缓存状态只在工作池的事件循环线程中访问。
+"""
+
+import asyncio
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from utils.agent_worker_pool import AgentWorkerPool, QueueFullError
+from utils.logger_config import get_utils_logger
+
+logger = get_utils_logger()
+
+
+@dataclass
+class _PendingBatch:
+    job: Any
+    first_arrival: float
+    message_count: int = 1
+    handle: Optional[asyncio.TimerHandle] = None
+
+
+class MessageCoalescer:
+    def __init__(self, pool: AgentWorkerPool, merge: Callable[[Any, Any], Any], window_seconds: float = 2.0, max_wait_seconds: float = 8.0,
+                 on_drop: Optional[Callable[[Any], None]] = None):
+        """
+        初始化消息合并器
+
+        Args:
+            pool: 合并后的任务提交到的工作池，计时器运行在它的事件循环上
+            merge: 合并函数 merge(较早的任务, 较新的任务) -> 合并后的任务
+            window_seconds: 防抖窗口（秒），窗口内每来一条新消息就重新计时；小于等于0时不合并，直接提交
+            max_wait_seconds: 从第一条消息到提交的最长等待时间（秒），避免客户持续输入时一直不回复
+            on_drop: 合并批次因工作池排队已满被丢弃时的回调 on_drop(任务)，用于释放该批次占用的资源
+        """
+        self.pool = pool
+        self.merge = merge
+        self.window_seconds = window_seconds
+        self.max_wait_seconds = max(max_wait_seconds, window_seconds)
+        self.on_drop = on_drop
+        self._pending: Dict[Hashable, _PendingBatch] = {}
+        self._received = 0
+        self._flushed = 0
+        self._dropped = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.window_seconds > 0
+
+    def add(self, key: Hashable, job: Any):
+        """
+        添加一条消息（线程安全）。未开启合并时直接提交到工作池
+
+        Args:
+            key: 会话键，同一个 key 的消息会被合并
+            job: 任务对象
+
+        Raises:
+            QueueFullError: 未开启合并且工作池排队已满
+        """
+        if not self.enabled:
+            self.pool.submit(job, key=key)
+            return
+        self.pool.loop.call_soon_threadsafe(self._add, key, job)
+
+    def flush_all(self, timeout: float = 10):
+        """
+        立即提交所有缓存中的批次（服务关闭时调用）
+
+        Args:
+            timeout: 等待提交完成的最长时间（秒）
+        """
+        if not self.enabled or not self.pool.is_running():
+            return
+        asyncio.run_coroutine_threadsafe(self._flush_all(), self.pool.loop).result(timeout=timeout)
+
+    def stats(self):
+        """
+        获取合并器运行状态
+
+        Returns:
+            dict: 缓存中的会话数、收到的消息数、提交的批次数、因排队已满被丢弃的批次数
+        """
+        return {
+            "enabled": self.enabled,
+            "window_seconds": self.window_seconds,
+            "max_wait_seconds": self.max_wait_seconds,
+            "buffered_sessions": len(self._pending),
+            "received_messages": self._received,
+            "flushed_batches": self._flushed,
+            "dropped_batches": self._dropped,
+        }
+
+    def _add(self, key: Hashable, job: Any):
+        loop = self.pool.loop
+        now = loop.time()
+        self._received += 1
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = _PendingBatch(job=job, first_arrival=now)
+            self._pending[key] = pending
+        else:
+            pending.job = self.merge(pending.job, job)
+            pending.message_count += 1
+            pending.handle.cancel()
+        deadline = min(now + self.window_seconds, pending.first_arrival + self.max_wait_seconds)
+        pending.handle = loop.call_at(deadline, self._flush, key)
+
+    def _flush(self, key: Hashable):
+        pending = self._pending.pop(key, None)
+        if pending is None:
+            return
+        if pending.handle:
+            pending.handle.cancel()
+        try:
+            self.pool.submit(pending.job, key=key)
+            self._flushed += 1
+            if pending.message_count > 1:
+                logger.info(f"[消息合并] 会话 {key} 合并了 {pending.message_count} 次请求")
+        except QueueFullError:
+            self._dropped += 1
+            logger.error(f"[消息合并] 工作池排队已满，丢弃会话 {key} 的合并批次（{pending.message_count} 次请求）")
+            if self.on_drop:
+                self.on_drop(pending.job)
+
+    async def _flush_all(self):
+        for key in list(self._pending):
+            self._flush(key)
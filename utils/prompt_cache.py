@@ -0,0 +1,194 @@
+"""
+提示词缓存（带版本号）
+
+智能体每次调用模型前都会重新拼装系统提示词，其中角色设定、销售流程、禁止事项来自数据库，
+一轮带多次工具调用的对话会重复执行同样的查询。这里按 (租户, 任务, 工作机微信) 缓存拼装结果，
+并用数据库中的版本号做失效：角色创建等写入操作调用 bump_prompt_version()，各进程在
+version_check_seconds 内最多读取一次版本号，发现版本变化后重新拼装。
+版本号存放在数据库中，因此角色创建服务与对话服务分属不同进程时同样生效。
+
+另外按租户统计提示词的布局：可被模型服务端前缀缓存复用的前缀占整段提示词的比例，
+以及同一 (任务, 工作机微信) 的前缀发生变化的次数（正常情况下只有角色等更新后才会变化）。
+"""
+
+import threading
+import time
+import zlib
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+from sqlalchemy import Column, Float, Integer, MetaData, String, Table
+from sqlalchemy import insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+from core.database_core import db_manager
+from utils.config_loader import ConfigLoader
+from utils.logger_config import get_utils_logger
+from utils.ttl_cache import TTLCache
+
+logger = get_utils_logger()
+
+metadata = MetaData()
+
+cache_version_table = Table(
+    "ai_cache_version",
+    metadata,
+    Column("scope", String(128), primary_key=True),
+    Column("version", Integer, nullable=False, default=0),
+    Column("update_time", Float, nullable=False),
+)
+
+_config = ConfigLoader().get_agent_service_config('prompt_cache')
+_enabled = _config.get('enabled', True)
+# 缓存的提示词：{(tenant_id, task_id, belong_wechat_id): (版本号, 拼装结果)}，ttl 兜底处理未经过 bump 的直接改库
+_prompt_cache = TTLCache(maxsize=_config.get('max_entries', 2048), ttl=_config.get('ttl_seconds', 600), name="prompt_cache")
+# 本进程读到的版本号：{scope: 版本号}，过期后重新读取数据库
+_version_cache = TTLCache(maxsize=_config.get('max_entries', 2048), ttl=_config.get('version_check_seconds', 10), name="prompt_version")
+_table_ready = False
+# 每个 (租户, 任务, 工作机微信) 最近一次前缀的校验值，用于发现前缀不稳定
+_prefix_digests = TTLCache(maxsize=_config.get('max_entries', 2048), ttl=_config.get('ttl_seconds', 600), name="prompt_prefix")
+_layout_lock = threading.Lock()
+_layout_stats: Dict[str, Dict[str, int]] = {}
+
+
+def _scope(tenant_id: Any, task_id: Any) -> str:
+    return f"prompt:{tenant_id}:{task_id}"
+
+
+def _ensure_table():
+    global _table_ready
+    if not _table_ready:
+        metadata.create_all(db_manager.engine, tables=[cache_version_table], checkfirst=True)
+        _table_ready = True
+
+
+def get_prompt_version(tenant_id: Any, task_id: Any) -> int:
+    """
+    获取 (租户, 任务) 的提示词版本号，version_check_seconds 内复用上次读取的结果
+
+    Returns:
+        int: 版本号，读取失败时返回 -1（此时只依赖 ttl 失效）
+    """
+    scope = _scope(tenant_id, task_id)
+    version = _version_cache.get(scope)
+    if version is not None:
+        return version
+    try:
+        _ensure_table()
+        with db_manager.engine.connect() as connection:
+            row = connection.execute(
+                select(cache_version_table.c.version).where(cache_version_table.c.scope == scope)
+            ).fetchone()
+        version = row.version if row else 0
+    except Exception as e:
+        logger.error(f"[提示词缓存] 读取版本号失败: {e}")
+        version = -1
+    _version_cache.set(scope, version)
+    return version
+
+
+def bump_prompt_version(tenant_id: Any, task_id: Any):
+    """
+    (租户, 任务) 的角色设定、销售流程或禁止事项写入后调用，使所有进程中缓存的提示词失效
+    """
+    scope = _scope(tenant_id, task_id)
+    _version_cache.pop(scope)
+    try:
+        _ensure_table()
+        now = time.time()
+        with db_manager.transaction() as connection:
+            result = connection.execute(
+                update(cache_version_table)
+                .where(cache_version_table.c.scope == scope)
+                .values(version=cache_version_table.c.version + 1, update_time=now)
+            )
+            if result.rowcount == 0:
+                try:
+                    with connection.begin_nested():
+                        connection.execute(insert(cache_version_table).values(scope=scope, version=1, update_time=now))
+                except IntegrityError:
+                    # 其他进程同时插入了该记录
+                    connection.execute(
+                        update(cache_version_table)
+                        .where(cache_version_table.c.scope == scope)
+                        .values(version=cache_version_table.c.version + 1, update_time=now)
+                    )
+        logger.info(f"[提示词缓存] 提示词版本已更新 - tenant_id: {tenant_id}, task_id: {task_id}")
+    except Exception as e:
+        logger.error(f"[提示词缓存] 更新版本号失败，缓存将在过期后失效: {e}")
+
+
+def get_cached_prompt(tenant_id: Any, task_id: Any, key: Hashable, builder: Callable[[], Any]) -> Any:
+    """
+    获取缓存的提示词，不存在或版本已变化时调用 builder 重新拼装
+
+    Args:
+        tenant_id: 租户ID
+        task_id: 任务ID
+        key: (租户, 任务) 之外区分提示词的键，如工作机微信ID
+        builder: 拼装提示词的函数
+
+    Returns:
+        Any: builder 的返回值
+    """
+    if not _enabled:
+        return builder()
+    version = get_prompt_version(tenant_id, task_id)
+    cache_key: Tuple[Any, Any, Hashable] = (str(tenant_id), str(task_id), key)
+    entry = _prompt_cache.get(cache_key)
+    if entry is not None and entry[0] == version:
+        return entry[1]
+    value = builder()
+    _prompt_cache.set(cache_key, (version, value))
+    return value
+
+
+def record_prompt_layout(tenant_id: Any, key: Hashable, prefix: str, prompt: str):
+    """
+    记录一次提示词拼装的布局
+
+    Args:
+        tenant_id: 租户ID
+        key: 租户内区分前缀的键，如 (任务ID, 工作机微信ID)
+        prefix: 与请求无关的前缀
+        prompt: 完整提示词
+    """
+    tenant = str(tenant_id)
+    digest = zlib.crc32(prefix.encode("utf-8"))
+    previous = _prefix_digests.get((tenant, key))
+    _prefix_digests.set((tenant, key), digest)
+    with _layout_lock:
+        stats = _layout_stats.get(tenant)
+        if stats is None:
+            stats = _layout_stats[tenant] = {"renders": 0, "prefix_chars": 0, "total_chars": 0, "prefix_changes": 0}
+        stats["renders"] += 1
+        stats["prefix_chars"] += len(prefix)
+        stats["total_chars"] += len(prompt)
+        if previous is not None and previous != digest:
+            stats["prefix_changes"] += 1
+
+
+def prompt_layout_report() -> Dict[str, Dict[str, Any]]:
+    """
+    按租户汇总提示词布局
+
+    Returns:
+        Dict[str, Dict[str, Any]]: {租户ID: 拼装次数、平均前缀/总长度（字符）、可缓存前缀占比、前缀变化次数}
+    """
+    with _layout_lock:
+        snapshot = {tenant: dict(stats) for tenant, stats in _layout_stats.items()}
+    report = {}
+    for tenant, stats in snapshot.items():
+        renders = stats["renders"]
+        report[tenant] = {
+            "renders": renders,
+            "avg_prefix_chars": round(stats["prefix_chars"] / renders),
+            "avg_total_chars": round(stats["total_chars"] / renders),
+            "prefix_ratio": round(stats["prefix_chars"] / stats["total_chars"], 4) if stats["total_chars"] else 0.0,
+            "prefix_changes": stats["prefix_changes"],
+        }
+    return report
+
+
+def prompt_cache_stats() -> Dict[str, Any]:
+    """提示词缓存和版本号缓存的命中统计，以及各租户的提示词布局"""
+    return {"prompt": _prompt_cache.stats(), "version": _version_cache.stats(), "layout": prompt_layout_report()}
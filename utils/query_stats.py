@@ -0,0 +1,182 @@
+"""
+数据库查询统计
+
+作为 DatabaseManager 的查询钩子（add_query_hook）安装，按语句汇总执行次数、耗时、返回行数和等待连接池的耗时：
+- 超过 slow_query_ms 的语句写入慢查询日志（logs/slow_query_日期.log），附带耗时、行数和截断后的 SQL、参数；
+- query_stats() 给出各语句的汇总，供 /worker_pool/stats 展示；
+- 完整查询结果默认不再写入 INFO 日志，需要排查时把 log_rows 设为 true。
+参数在 configs/agent_service.yaml 的 query_stats 中配置。
+"""
+
+import bisect
+import threading
+from typing import Any, Dict, List
+
+from tools.database import DatabaseManager, QueryEvent, compact_sql
+from utils.config_loader import ConfigLoader
+from utils.logger_config import get_slow_query_logger
+
+_config = ConfigLoader().get_agent_service_config('query_stats')
+
+# 直方图的桶上界，最后一个桶为 "大于最大上界"
+LATENCY_BUCKETS_MS = [1, 5, 20, 100, 500, 2000]
+ROW_BUCKETS = [0, 1, 10, 100, 1000]
+# 超过这个数量的不同语句归入 "其他"，避免拼接 SQL 撑大统计表
+OTHER_STATEMENTS = "其他"
+
+
+def _bucket_labels(bounds: List[float], unit: str = "") -> List[str]:
+    return [f"<={bound}{unit}" for bound in bounds] + [f">{bounds[-1]}{unit}"]
+
+
+def _truncate(value: Any, limit: int) -> str:
+    value = str(value)
+    return value if len(value) <= limit else value[:limit] + f"...(共{len(value)}字符)"
+
+
+class QueryStats:
+    """按语句汇总的查询统计，实例本身即查询钩子"""
+
+    def __init__(self, slow_query_ms: float = 200, max_statements: int = 500, log_chars: int = 1000):
+        """
+        Args:
+            slow_query_ms: 慢查询阈值（毫秒），小于等于 0 时不记录慢查询
+            max_statements: 最多分别统计的语句数
+            log_chars: 慢查询日志中 SQL 和参数各自最多保留的字符数
+        """
+        self.slow_query_ms = slow_query_ms
+        self.max_statements = max_statements
+        self.log_chars = log_chars
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, Any]] = {}
+        self._slow_logger = get_slow_query_logger() if slow_query_ms > 0 else None
+
+    def __call__(self, event: QueryEvent):
+        with self._lock:
+            name = event.name
+            if name not in self._stats and len(self._stats) >= self.max_statements:
+                name = OTHER_STATEMENTS
+            stats = self._stats.get(name)
+            if stats is None:
+                stats = self._stats[name] = {
+                    "calls": 0,
+                    "errors": 0,
+                    "slow": 0,
+                    "total_ms": 0.0,
+                    "max_ms": 0.0,
+                    "pool_wait_ms": 0.0,
+                    "rows": 0,
+                    "max_rows": 0,
+                    "latency_histogram": [0] * (len(LATENCY_BUCKETS_MS) + 1),
+                    "rows_histogram": [0] * (len(ROW_BUCKETS) + 1),
+                }
+            stats["calls"] += 1
+            stats["total_ms"] += event.elapsed_ms
+            stats["max_ms"] = max(stats["max_ms"], event.elapsed_ms)
+            stats["pool_wait_ms"] += event.pool_wait_ms
+            stats["latency_histogram"][bisect.bisect_left(LATENCY_BUCKETS_MS, event.elapsed_ms)] += 1
+            if event.error is not None:
+                stats["errors"] += 1
+            else:
+                rows = max(event.rows, 0)
+                stats["rows"] += rows
+                stats["max_rows"] = max(stats["max_rows"], rows)
+                stats["rows_histogram"][bisect.bisect_left(ROW_BUCKETS, rows)] += 1
+            slow = self._slow_logger is not None and event.elapsed_ms + event.pool_wait_ms >= self.slow_query_ms
+            if slow:
+                stats["slow"] += 1
+        if slow:
+            self._slow_logger.warning(
+                f"慢查询 {event.name}: 耗时 {event.elapsed_ms:.1f}ms, 等待连接 {event.pool_wait_ms:.1f}ms, "
+                f"行数 {event.rows}{', 错误: ' + event.error if event.error else ''}\n"
+                f"SQL: {_truncate(compact_sql(event.sql), self.log_chars)}\n"
+                f"参数: {_truncate(event.params, self.log_chars)}"
+            )
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """
+        各语句的汇总
+
+        Returns:
+            Dict[str, Dict[str, Any]]: {语句名称: 执行次数、错误数、慢查询数、平均/最大耗时、平均等待连接耗时、
+            平均/最大行数、耗时直方图、行数直方图}
+        """
+        latency_labels = _bucket_labels(LATENCY_BUCKETS_MS, "ms")
+        row_labels = _bucket_labels(ROW_BUCKETS)
+        with self._lock:
+            snapshot = {}
+            for name, stats in self._stats.items():
+                calls = stats["calls"]
+                succeeded = calls - stats["errors"]
+                snapshot[name] = {
+                    "calls": calls,
+                    "errors": stats["errors"],
+                    "slow": stats["slow"],
+                    "avg_ms": round(stats["total_ms"] / calls, 3),
+                    "max_ms": round(stats["max_ms"], 3),
+                    "avg_pool_wait_ms": round(stats["pool_wait_ms"] / calls, 3),
+                    "avg_rows": round(stats["rows"] / succeeded, 2) if succeeded else 0.0,
+                    "max_rows": stats["max_rows"],
+                    "latency_histogram": dict(zip(latency_labels, stats["latency_histogram"])),
+                    "rows_histogram": dict(zip(row_labels, stats["rows_histogram"])),
+                }
+        return dict(sorted(snapshot.items(), key=lambda item: -item[1]["avg_ms"] * item[1]["calls"]))
+
+    def reset(self):
+        """清空统计"""
+        with self._lock:
+            self._stats.clear()
+
+
+_query_stats = QueryStats(
+    slow_query_ms=_config.get('slow_query_ms', 200),
+    max_statements=_config.get('max_statements', 500),
+    log_chars=_config.get('log_chars', 1000),
+)
+
+
+def install_query_stats(manager: DatabaseManager):
+    """
+    按配置为 DatabaseManager 安装查询统计钩子，并设置是否输出完整查询结果
+
+    Args:
+        manager: 数据库管理器
+    """
+    manager.log_rows = _config.get('log_rows', False)
+    if _config.get('enabled', True):
+        manager.add_query_hook(_query_stats)
+
+
+def query_stats() -> Dict[str, Dict[str, Any]]:
+    """各语句的查询统计，按总耗时从高到低排列"""
+    return _query_stats.snapshot()
+
+
+def reset_query_stats():
+    """清空查询统计"""
+    _query_stats.reset()
+
+
+if __name__ == "__main__":
+    # 自检：对本地数据库执行几条查询，输出统计和慢查询日志
+    # 用法: python -m utils.query_stats
+    import json
+
+    from core.database_core import db_manager
+    from utils.db_queries import load_task_context, select_wechat_name
+
+    # 阈值设得很低，让每条语句都写入慢查询日志
+    demo_stats = QueryStats(slow_query_ms=0.001)
+    db_manager.add_query_hook(demo_stats)
+    for task_id in range(1, 20):
+        load_task_context(1, task_id, "wxid_demo")
+    select_wechat_name(1, "wxid_demo")
+    db_manager.execute_query("SELECT 1 AS one")
+    db_manager.remove_query_hook(demo_stats)
+    snapshot = demo_stats.snapshot()
+    print(json.dumps(snapshot, ensure_ascii=False, indent=2))
+    assert snapshot["select_sale_process"]["calls"] == 19
+    # 租户的昵称先整体预热，查不到的微信ID只查询一次，之后走昵称缓存
+    assert snapshot["select_wechat_names_by_tenant"]["calls"] == 1
+    assert snapshot["select_wechat_name"]["calls"] == 1
+    print("自检通过，慢查询日志见 logs/slow_query_*.log")
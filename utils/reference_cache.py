@@ -0,0 +1,133 @@
+"""
+任务引用数据缓存
+
+知识库、产品、协作事项、销售流程、禁止事项和 AI 文件很少变化，但几乎每条客户消息都会读取。
+utils/db_queries 中对应的查询经过这里的读穿透缓存，按 (种类, 租户, 任务) 缓存：
+- 每种数据有各自的有效期（ttl_seconds），总条目数超过 max_entries 时按最近最少使用淘汰；
+- 同一个键同时只有一个线程查询数据库，并发的会话等待这次查询的结果，不会一起打到数据库；
+- 写入这些数据的代码（utils/db_insert、tools/notify.send_prohibit_notify）调用 invalidate_references()，
+  本进程内的缓存立即失效，并通知 add_invalidation_hook 注册的钩子（如任务数据缓存）；
+  其他进程中的缓存在有效期后过期。
+参数在 configs/agent_service.yaml 的 reference_cache 中配置。
+"""
+
+import threading
+from typing import Any, Callable, Dict, Iterable, List
+
+from utils.config_loader import ConfigLoader
+from utils.logger_config import get_utils_logger
+from utils.ttl_cache import ReadThroughCache
+
+logger = get_utils_logger()
+
+# 缓存的数据种类，与 TaskContext 的字段同名
+REFERENCE_KINDS = ("knowledge", "products", "collaborate_matters", "sale_process", "forbidden_content", "ai_data")
+
+_config = ConfigLoader().get_agent_service_config('reference_cache')
+_enabled = _config.get('enabled', True)
+_ttl_seconds: Dict[str, float] = dict(_config.get('ttl_seconds') or {})
+_cache = ReadThroughCache(
+    maxsize=_config.get('max_entries', 4096),
+    ttl=_ttl_seconds.get('default', 300),
+    name="reference_data",
+)
+_invalidation_hooks: List[Callable[[Any, Any, tuple], None]] = []
+_hooks_lock = threading.Lock()
+
+
+def _key(kind: str, tenant_id: Any, task_id: Any) -> tuple:
+    return (kind, str(tenant_id), str(task_id))
+
+
+def load_reference(kind: str, tenant_id: Any, task_id: Any, loader: Callable[[], Any]) -> Any:
+    """
+    读取一种任务引用数据，缓存中没有时调用 loader 查询
+
+    Args:
+        kind: 数据种类，见 REFERENCE_KINDS
+        tenant_id: 租户ID
+        task_id: 任务ID
+        loader: 查询函数，无参数，返回值会被多个会话共享，应为只读数据；抛出异常时不缓存
+
+    Returns:
+        Any: 数据
+    """
+    if not _enabled:
+        return loader()
+    return _cache.get_or_load(_key(kind, tenant_id, task_id), loader, ttl=_ttl_seconds.get(kind))
+
+
+def store_reference(kind: str, tenant_id: Any, task_id: Any, value: Any):
+    """写入刚从数据库查询到的数据（调用方绕过缓存重新查询时使用）"""
+    if _enabled:
+        _cache.set(_key(kind, tenant_id, task_id), value, ttl=_ttl_seconds.get(kind))
+
+
+def add_invalidation_hook(hook: Callable[[Any, Any, tuple], None]):
+    """
+    注册失效钩子，invalidate_references() 时以 (tenant_id, task_id, kinds) 调用，task_id 为 None 表示租户下所有任务。
+    钩子抛出的异常只记录日志。
+
+    Args:
+        hook: 钩子
+    """
+    with _hooks_lock:
+        _invalidation_hooks.append(hook)
+
+
+def invalidate_references(tenant_id: Any, task_id: Any = None, kinds: Iterable[str] = REFERENCE_KINDS) -> int:
+    """
+    数据写入后调用，使本进程中缓存的引用数据失效，并调用失效钩子
+
+    Args:
+        tenant_id: 租户ID
+        task_id: 任务ID，为 None 时失效租户下所有任务（写入时不知道任务的情况，如 AI 文件）
+        kinds: 失效的数据种类，为空时只调用钩子（如系统提示词更新只需让任务数据失效）
+
+    Returns:
+        int: 删除的缓存条目数
+    """
+    kinds = tuple(kinds)
+    tenant, task = str(tenant_id), None if task_id is None else str(task_id)
+    removed = _cache.discard_where(
+        lambda key: key[0] in kinds and key[1] == tenant and (task is None or key[2] == task)
+    )
+    with _hooks_lock:
+        hooks = list(_invalidation_hooks)
+    for hook in hooks:
+        try:
+            hook(tenant_id, task_id, kinds)
+        except Exception as e:
+            logger.error(f"[引用数据缓存] 失效钩子执行失败: {e}")
+    logger.info(f"[引用数据缓存] 失效 - tenant_id: {tenant_id}, task_id: {task_id}, kinds: {kinds}, 删除 {removed} 条")
+    return removed
+
+
+def reference_cache_stats() -> Dict[str, Any]:
+    """引用数据缓存的命中率、实际查询次数 (loads) 和合并的并发查询次数 (coalesced)"""
+    return _cache.stats()
+
+
+if __name__ == "__main__":
+    # 自检：并发未命中只查询一次，失效后重新查询
+    # 用法: python -m utils.reference_cache
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+
+    calls = []
+
+    def slow_loader():
+        calls.append(1)
+        time.sleep(0.2)
+        return ("产品A", "产品B")
+
+    with ThreadPoolExecutor(max_workers=32) as executor:
+        results = list(executor.map(lambda _: load_reference("products", 1, 10, slow_loader), range(32)))
+    assert all(result == ("产品A", "产品B") for result in results)
+    assert len(calls) == 1, calls
+    assert load_reference("products", 1, 10, slow_loader) == ("产品A", "产品B") and len(calls) == 1
+    assert invalidate_references(1, 10, ["products"]) == 1
+    load_reference("products", 1, 10, slow_loader)
+    assert len(calls) == 2
+    print(reference_cache_stats())
+    print("自检通过")
@@ -0,0 +1,339 @@
+"""
+会话亲和的多进程部署
+
+单个 uvicorn 进程受 GIL 限制，提示词拼装、JSON 解析、日志等 CPU 工作无法利用多核；
+而直接使用 uvicorn --workers 时请求被随机分配到各进程，同一会话的消息可能在不同进程中并发处理，
+进程内的串行保证、消息合并、幂等记录和缓存也随之失效。
+
+这里由一个监督进程启动 N 个工作进程（各自监听内部端口），并在对外端口上运行一个轻量路由：
+按 session_id + task_id 的哈希把请求固定转发到同一个工作进程。监督进程会在工作进程异常退出时自动重启，
+重启后的进程使用相同的分片编号和端口，会话到进程的映射保持不变。
+工作进程通过环境变量 AGENT_SHARD_INDEX / AGENT_SHARD_COUNT 获知自己的分片编号。
+"""
+
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import zlib
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional
+
+import aiohttp
+from fastapi import FastAPI, Request, Response
+
+from utils.logger_config import get_utils_logger
+
+logger = get_utils_logger()
+
+SHARD_INDEX_ENV = "AGENT_SHARD_INDEX"
+SHARD_COUNT_ENV = "AGENT_SHARD_COUNT"
+
+# 转发时透传的请求头和响应头
+_FORWARD_REQUEST_HEADERS = ("content-type", "idempotency-key")
+_FORWARD_RESPONSE_HEADERS = ("content-type", "retry-after")
+
+
+def shard_for(key: str, num_shards: int) -> int:
+    """
+    计算会话键所属的分片（稳定哈希，与进程和 Python 哈希随机化无关）
+
+    Args:
+        key: 会话键（session_id + task_id）
+        num_shards: 分片数
+
+    Returns:
+        int: 分片编号，范围 [0, num_shards)
+    """
+    return zlib.crc32(key.encode("utf-8")) % num_shards
+
+
+def current_shard() -> Optional[int]:
+    """当前进程的分片编号，不是由监督进程启动时返回 None"""
+    value = os.getenv(SHARD_INDEX_ENV)
+    return int(value) if value is not None else None
+
+
+def session_key_from_body(body: bytes) -> str:
+    """从请求体中取出会话键，无法解析时返回空字符串（固定转发到同一分片，由工作进程返回校验错误）"""
+    try:
+        payload = json.loads(body)
+        return f"{payload.get('session_id', '')}{payload.get('task_id', '')}"
+    except (ValueError, AttributeError):
+        return ""
+
+
+class AgentCluster:
+    def __init__(self, app: str, num_workers: int, base_port: int, host: str = "127.0.0.1", factory: bool = False,
+                 restart_backoff_seconds: float = 1.0, max_restart_backoff_seconds: float = 30.0):
+        """
+        初始化工作进程集群（需调用 start() 后才会启动进程）
+
+        Args:
+            app: 工作进程运行的 ASGI 应用，如 "main_v2:app"
+            num_workers: 工作进程数（即分片数）
+            base_port: 第一个工作进程的内部端口，第 i 个进程监听 base_port + i
+            host: 工作进程监听的地址
+            factory: app 是否是返回应用的工厂函数
+            restart_backoff_seconds: 进程异常退出后首次重启前的等待时间（秒），连续崩溃时翻倍
+            max_restart_backoff_seconds: 重启等待时间上限（秒）
+        """
+        if num_workers < 1:
+            raise ValueError("num_workers 必须大于0")
+        self.app = app
+        self.num_workers = num_workers
+        self.base_port = base_port
+        self.host = host
+        self.factory = factory
+        self.restart_backoff_seconds = restart_backoff_seconds
+        self.max_restart_backoff_seconds = max_restart_backoff_seconds
+        self._processes: List[Optional[subprocess.Popen]] = [None] * num_workers
+        self._restarts = [0] * num_workers
+        self._stop = threading.Event()
+        self._watcher: Optional[threading.Thread] = None
+
+    @property
+    def worker_urls(self) -> List[str]:
+        """各分片工作进程的地址，下标即分片编号"""
+        return [f"http://{self.host}:{self.base_port + index}" for index in range(self.num_workers)]
+
+    def start(self):
+        """启动所有工作进程和监督线程"""
+        self._stop.clear()
+        for index in range(self.num_workers):
+            self._spawn(index)
+        self._watcher = threading.Thread(target=self._watch, name="agent_cluster_watcher", daemon=True)
+        self._watcher.start()
+        logger.info(f"[会话集群] 已启动 {self.num_workers} 个工作进程: {self.worker_urls}")
+
+    def stop(self, timeout: float = 30):
+        """
+        停止所有工作进程：先发送 SIGTERM 让 uvicorn 执行关闭流程（排空工作池），超时后强制结束
+
+        Args:
+            timeout: 等待进程退出的最长时间（秒）
+        """
+        self._stop.set()
+        if self._watcher is not None:
+            self._watcher.join(timeout=5)
+        for process in self._processes:
+            if process is not None and process.poll() is None:
+                process.terminate()
+        deadline = time.monotonic() + timeout
+        for process in self._processes:
+            if process is None:
+                continue
+            try:
+                process.wait(timeout=max(deadline - time.monotonic(), 0.1))
+            except subprocess.TimeoutExpired:
+                process.kill()
+        logger.info("[会话集群] 所有工作进程已停止")
+
+    def wait_ready(self, timeout: float = 60) -> bool:
+        """
+        等待所有工作进程开始监听端口
+
+        Args:
+            timeout: 最长等待时间（秒）
+
+        Returns:
+            bool: 是否全部就绪
+        """
+        import socket
+
+        deadline = time.monotonic() + timeout
+        for index in range(self.num_workers):
+            while True:
+                try:
+                    with socket.create_connection((self.host, self.base_port + index), timeout=1):
+                        break
+                except OSError:
+                    if time.monotonic() > deadline:
+                        return False
+                    time.sleep(0.2)
+        return True
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """各工作进程的 pid、存活状态和重启次数"""
+        return [{
+            "shard": index,
+            "url": url,
+            "pid": process.pid if process else None,
+            "alive": process is not None and process.poll() is None,
+            "restarts": self._restarts[index],
+        } for index, (url, process) in enumerate(zip(self.worker_urls, self._processes))]
+
+    def _spawn(self, index: int):
+        command = [sys.executable, "-m", "uvicorn", self.app, "--host", self.host, "--port", str(self.base_port + index), "--log-level", "warning"]
+        if self.factory:
+            command.append("--factory")
+        env = {**os.environ, SHARD_INDEX_ENV: str(index), SHARD_COUNT_ENV: str(self.num_workers)}
+        self._processes[index] = subprocess.Popen(command, env=env)
+
+    def _watch(self):
+        # 工作进程异常退出时按指数退避重启，运行超过一分钟后退避时间清零
+        backoff = [self.restart_backoff_seconds] * self.num_workers
+        started = [time.monotonic()] * self.num_workers
+        while not self._stop.wait(0.5):
+            for index, process in enumerate(self._processes):
+                if process is None or process.poll() is None:
+                    continue
+                if time.monotonic() - started[index] > 60:
+                    backoff[index] = self.restart_backoff_seconds
+                logger.error(f"[会话集群] 分片 {index} 的工作进程退出（退出码 {process.returncode}），{backoff[index]:.0f}秒后重启")
+                if self._stop.wait(backoff[index]):
+                    return
+                self._spawn(index)
+                self._restarts[index] += 1
+                started[index] = time.monotonic()
+                backoff[index] = min(backoff[index] * 2, self.max_restart_backoff_seconds)
+
+
+def create_router_app(worker_urls: List[str], cluster: Optional[AgentCluster] = None) -> FastAPI:
+    """
+    创建会话亲和路由：/process_user_input 和 /delete_session 按会话键转发到固定的工作进程，
+    /worker_pool/stats 汇总所有工作进程的状态
+
+    Args:
+        worker_urls: 各分片工作进程的地址，下标即分片编号
+        cluster: 工作进程集群，提供时在统计中附带进程状态
+
+    Returns:
+        FastAPI: 路由应用
+    """
+    state: Dict[str, aiohttp.ClientSession] = {}
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        # 与工作进程之间复用长连接
+        state["session"] = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=60))
+        yield
+        await state["session"].close()
+
+    router = FastAPI(title="AI Sales Agent Router", description="按会话把请求固定转发到同一个工作进程", lifespan=lifespan)
+
+    async def forward(request: Request, path: str) -> Response:
+        body = await request.body()
+        shard = shard_for(session_key_from_body(body), len(worker_urls))
+        headers = {name: request.headers[name] for name in _FORWARD_REQUEST_HEADERS if name in request.headers}
+        try:
+            async with state["session"].post(f"{worker_urls[shard]}{path}", data=body, headers=headers) as response:
+                content = await response.read()
+                response_headers = {name: response.headers[name] for name in _FORWARD_RESPONSE_HEADERS if name in response.headers}
+                return Response(content=content, status_code=response.status, headers=response_headers)
+        except aiohttp.ClientError as e:
+            # 不转发到其他分片，否则会破坏会话的串行保证；工作进程重启后客户端重试即可
+            logger.error(f"[会话路由] 分片 {shard} 不可用: {e}")
+            return Response(
+                content=json.dumps({"detail": f"分片 {shard} 暂不可用，请稍后重试"}, ensure_ascii=False),
+                status_code=503,
+                headers={"content-type": "application/json", "retry-after": "1"},
+            )
+
+    @router.post("/process_user_input")
+    async def process_user_input(request: Request):
+        return await forward(request, "/process_user_input")
+
+    @router.post("/delete_session")
+    async def delete_session(request: Request):
+        return await forward(request, "/delete_session")
+
+    @router.get("/worker_pool/stats")
+    async def worker_pool_stats():
+        async def fetch(url: str):
+            try:
+                async with state["session"].get(f"{url}/worker_pool/stats") as response:
+                    return await response.json()
+            except Exception as e:
+                return {"error": str(e)}
+
+        shards = await asyncio.gather(*(fetch(url) for url in worker_urls))
+        return {
+            "shards": [{"shard": index, **stats} for index, stats in enumerate(shards)],
+            "processes": cluster.stats() if cluster else None,
+        }
+
+    return router
+
+
+def create_benchmark_app() -> FastAPI:
+    """
+    压测用的工作进程应用：模拟一次请求中的 CPU 工作（提示词拼装、JSON 序列化与解析），
+    返回处理它的进程 pid 以及该会话在本进程中收到的序号
+    """
+    bench = FastAPI()
+    session_counts: Dict[str, int] = {}
+
+    @bench.post("/process_user_input")
+    async def process_user_input(request: Request):
+        payload = await request.json()
+        key = f"{payload['session_id']}{payload['task_id']}"
+        prompt = "\n".join(f"[{index}] {json.dumps(payload, ensure_ascii=False)}" for index in range(200))
+        parsed = [json.loads(line.split(" ", 1)[1]) for line in prompt.splitlines()]
+        session_counts[key] = session_counts.get(key, 0) + 1
+        return {"pid": os.getpid(), "seq": session_counts[key], "size": len(parsed)}
+
+    @bench.get("/worker_pool/stats")
+    async def worker_pool_stats():
+        return {"pid": os.getpid(), "sessions": len(session_counts)}
+
+    return bench
+
+
+if __name__ == "__main__":
+    # 本地扩展性压测：分别用 1/2/4/... 个工作进程运行模拟 CPU 负载，经路由并发发送请求，
+    # 输出吞吐量曲线，并检查同一会话的请求始终由同一个进程按顺序处理
+    # 运行方式: python -m utils.session_cluster [最大进程数]
+    import uvicorn
+
+    max_workers = int(sys.argv[1]) if len(sys.argv) > 1 else (os.cpu_count() or 1)
+    num_sessions, messages_per_session, router_port, base_port = 200, 10, 18480, 18500
+
+    async def drive(url: str):
+        pids: Dict[str, set] = {}
+        errors = []
+
+        async def run_session(http: aiohttp.ClientSession, session_index: int):
+            key = f"s{session_index}t1"
+            for seq in range(1, messages_per_session + 1):
+                body = {"tenant_id": "1", "task_id": "t1", "wechat_id": f"s{session_index}", "session_id": f"s{session_index}",
+                        "user_input": [{"type": "text", "content": f"消息{seq}", "timestamp": "2025-06-10 10:00:00"}]}
+                async with http.post(f"{url}/process_user_input", json=body) as response:
+                    result = await response.json()
+                pids.setdefault(key, set()).add(result["pid"])
+                if result["seq"] != seq:
+                    errors.append(f"会话 {key} 序号错误: 期望 {seq}, 实际 {result['seq']}")
+
+        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=200)) as http:
+            started = time.monotonic()
+            await asyncio.gather(*(run_session(http, index) for index in range(num_sessions)))
+            elapsed = time.monotonic() - started
+        errors.extend(f"会话 {key} 被多个进程处理: {sorted(p)}" for key, p in pids.items() if len(p) > 1)
+        return elapsed, errors
+
+    results = []
+    workers = 1
+    while workers <= max_workers:
+        cluster = AgentCluster("utils.session_cluster:create_benchmark_app", workers, base_port, factory=True)
+        cluster.start()
+        server = uvicorn.Server(uvicorn.Config(create_router_app(cluster.worker_urls, cluster), host="127.0.0.1", port=router_port, log_level="warning"))
+        thread = threading.Thread(target=server.run, daemon=True)
+        try:
+            if not cluster.wait_ready():
+                raise RuntimeError("工作进程启动超时")
+            thread.start()
+            while not server.started:
+                time.sleep(0.1)
+            elapsed, errors = asyncio.run(drive(f"http://127.0.0.1:{router_port}"))
+        finally:
+            server.should_exit = True
+            thread.join(timeout=10)
+            cluster.stop()
+        total = num_sessions * messages_per_session
+        results.append((workers, total / elapsed))
+        print(f"工作进程数: {workers}, 请求数: {total}, 耗时: {elapsed:.2f}s, 吞吐量: {total / elapsed:.1f} req/s, "
+              f"加速比: {total / elapsed / results[0][1]:.2f}x, {'会话亲和检查通过' if not errors else errors[:5]}")
+        workers *= 2
@@ -0,0 +1,152 @@
+"""
+流式 JSON 增量提取
+
+智能体以流式方式输出回复时，逐段喂入文本，每当 content_list 数组的某个元素完整闭合，
+立即解析并返回该元素，不必等整段回复生成完再解析。
+只有遇到 "content_list": [ 之后才开始提取，回复中夹杂的普通文本（包括其中的花括号）、```json 代码块标记
+以及其他字段都会被跳过；一段回复中可以有多个 JSON 对象（与 parse_agent_response 的输入格式一致）。
+"""
+
+import json
+import re
+from typing import Any, Dict, List, Optional
+
+from utils.logger_config import get_utils_logger
+
+logger = get_utils_logger()
+
+
+class ContentListExtractor:
+    def __init__(self, list_key: str = "content_list"):
+        """
+        初始化提取器
+
+        Args:
+            list_key: 需要增量提取的数组字段名
+        """
+        self.list_key = list_key
+        self._list_start = re.compile(r'"' + re.escape(list_key) + r'"\s*:\s*\[')
+        self._key_text = f'"{list_key}"'
+        self._buffer = ""
+        self._pos = 0
+        self._in_list = False
+        self._depth = 0               # 数组内的嵌套深度，0 表示位于数组元素之间
+        self._in_string = False
+        self._escape = False
+        self._item_start: Optional[int] = None
+        self._emitted_counts: List[int] = []
+
+    @property
+    def emitted_counts(self) -> List[int]:
+        """每个 content_list 数组已提取出的元素个数，按数组出现顺序排列"""
+        return list(self._emitted_counts)
+
+    def feed(self, text: str) -> List[Dict[str, Any]]:
+        """
+        喂入一段新生成的文本
+
+        Args:
+            text: 增量文本
+
+        Returns:
+            List[Dict[str, Any]]: 本次新闭合的 content_list 元素
+        """
+        self._buffer += text
+        items = []
+        while self._pos < len(self._buffer):
+            if not self._in_list and not self._find_list():
+                break
+            if self._in_list:
+                self._scan_list(items)
+        return items
+
+    def _find_list(self) -> bool:
+        # 在数组之外查找下一个 "content_list": [，找不到时保留可能被截断的开头，等待后续文本
+        buffer = self._buffer
+        match = self._list_start.search(buffer, self._pos)
+        if match is not None:
+            self._pos = match.end()
+            self._in_list = True
+            self._depth = 0
+            self._emitted_counts.append(0)
+            return True
+        last_key = buffer.rfind(self._key_text, self._pos)
+        if last_key != -1 and not buffer[last_key + len(self._key_text):].strip(" \t\r\n:"):
+            self._pos = last_key
+        else:
+            self._pos = max(self._pos, len(buffer) - len(self._key_text) + 1)
+        return False
+
+    def _scan_list(self, items: List[Dict[str, Any]]):
+        buffer = self._buffer
+        for index in range(self._pos, len(buffer)):
+            char = buffer[index]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+            if char == '"':
+                self._in_string = True
+            elif char in "{[":
+                if self._depth == 0 and char == "{":
+                    self._item_start = index
+                self._depth += 1
+            elif char in "}]":
+                if self._depth == 0:
+                    # content_list 数组结束，继续查找下一个
+                    self._in_list = False
+                    self._pos = index + 1
+                    return
+                self._depth -= 1
+                if self._depth == 0 and self._item_start is not None:
+                    item = self._parse_item(buffer[self._item_start:index + 1])
+                    self._item_start = None
+                    if item is not None:
+                        items.append(item)
+                        self._emitted_counts[-1] += 1
+        self._pos = len(buffer)
+
+    def _parse_item(self, text: str) -> Optional[Dict[str, Any]]:
+        try:
+            return json.loads(text)
+        except ValueError as e:
+            logger.warning(f"[流式解析] content_list 元素解析失败: {e}, 原始内容: {text}")
+            return None
+
+
+if __name__ == "__main__":
+    # 自检：把一段典型回复按随机长度切块喂入，检查提取结果与整体解析一致
+    # 运行方式: python -m utils.stream_json
+    import random
+
+    reply = '好的```json\n{"content_list": [{"type": "text", "content": "你好，{在的}\\"引号\\""}, ' \
+            '{"type": "file", "url": "https://x/y.pdf"}], "collaborate_list": [{"id": 1, "content": "跟进"}], ' \
+            '"follow_up": {"is_follow_up": 1, "follow_up_content": ["a"]}}\n```\n```json\n' \
+            '{"collaborate_list": [], "content_list": [{"type": "text", "content": "第二条"}]}```'
+    expected = [{"type": "text", "content": "你好，{在的}\"引号\""}, {"type": "file", "url": "https://x/y.pdf"},
+                {"type": "text", "content": "第二条"}]
+    for _ in range(200):
+        extractor = ContentListExtractor()
+        got, pos = [], 0
+        while pos < len(reply):
+            step = random.randint(1, 7)
+            got.extend(extractor.feed(reply[pos:pos + step]))
+            pos += step
+        assert got == expected, got
+        assert extractor.emitted_counts == [2, 1], extractor.emitted_counts
+
+    # 代码块之前的普通文本中带花括号（未闭合）时，也只提取 content_list 中的元素
+    reply = '好的，报价单 {含税价} 和折扣 {见下方 稍后发您：```json\n' \
+            '{"follow_up": {"is_follow_up": 0}, "content_list": [{"type": "text", "content": "[1] {a}"}]}\n```'
+    for step in range(1, 9):
+        extractor = ContentListExtractor()
+        got = []
+        for pos in range(0, len(reply), step):
+            got.extend(extractor.feed(reply[pos:pos + step]))
+        assert got == [{"type": "text", "content": "[1] {a}"}], got
+        assert extractor.emitted_counts == [1], extractor.emitted_counts
+    print("检查通过")
@@ -0,0 +1,324 @@
+"""
+智能体工具结果缓存
+
+同一轮对话（一次 call_agent_async）中模型经常用相同的参数重复调用同一个只读工具，
+这里按 (工具名, 参数) 缓存工具结果：
+- 本轮缓存：call_agent_async 通过 begin_invocation() / end_invocation() 为每轮对话开启，轮次结束即丢弃；
+- 跨轮缓存：只对配置了 ttl_seconds 的纯读取工具生效（如按 URL 识别图片），在有效期内跨会话复用。
+只有 configs/agent_service.yaml 的 tool_memo.tools 中列出的工具会被包装，写入类工具（更新客户画像等）不缓存。
+
+模型在一次响应中返回多个工具调用时，ADK 会逐个执行。start_tool_calls() 在模型响应后立即把其中的只读工具
+全部并发启动，结果放进本轮缓存，随后 ADK 逐个调用时直接等待已在运行的任务，工具阶段耗时接近最慢的一个。
+同步工具在独立的线程池中执行，不阻塞事件循环。
+"""
+
+import asyncio
+import contextvars
+import copy
+import functools
+import inspect
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+from utils.config_loader import ConfigLoader
+from utils.ttl_cache import TTLCache
+
+_config = ConfigLoader().get_agent_service_config('tool_memo')
+_enabled = _config.get('enabled', True)
+_memo_tools = set(_config.get('tools') or [])
+_ttl_seconds: Dict[str, float] = _config.get('ttl_seconds') or {}
+
+# 当前轮次的工具结果：{(工具名, 参数): 执行该调用的 asyncio.Task}，未开启时为 None
+_invocation_memo: contextvars.ContextVar[Optional[Dict[Hashable, asyncio.Task]]] = contextvars.ContextVar("tool_invocation_memo", default=None)
+_ttl_caches: Dict[str, TTLCache] = {}
+# 已包装的工具：{工具名: 包装后的工具}，供 start_tool_calls 按名称启动
+_registry: Dict[str, Callable[..., Any]] = {}
+tool_executor = ThreadPoolExecutor(max_workers=_config.get('max_workers', 16), thread_name_prefix="tool_executor")
+_stats_lock = threading.Lock()
+_stats: Dict[str, Dict[str, int]] = {}
+
+_MISSING = object()
+# 查询类工具失败时返回的错误信息，如 "查询任务的产品失败: ..."（tools/core_logic.py）
+_ERROR_TEXT = re.compile(r"^查询\S*失败[:：]")
+
+
+def begin_invocation() -> contextvars.Token:
+    """
+    开启一轮对话的工具结果缓存
+
+    Returns:
+        contextvars.Token: 传给 end_invocation 结束本轮
+    """
+    return _invocation_memo.set({})
+
+
+def end_invocation(token: contextvars.Token):
+    """结束本轮对话，丢弃本轮缓存的工具结果，取消预先启动但没有被用到的工具调用"""
+    memo = _invocation_memo.get()
+    _invocation_memo.reset(token)
+    for task in (memo or {}).values():
+        if not task.done():
+            task.cancel()
+
+
+@contextmanager
+def invocation_scope():
+    """开启一轮对话的工具结果缓存，with 块结束后丢弃"""
+    token = begin_invocation()
+    try:
+        yield
+    finally:
+        end_invocation(token)
+
+
+def _freeze(value: Any) -> Hashable:
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+def _record(name: str, outcome: str):
+    with _stats_lock:
+        stats = _stats.get(name)
+        if stats is None:
+            stats = _stats[name] = {"calls": 0, "invocation_hits": 0, "ttl_hits": 0, "prefetched": 0}
+        if outcome == "prefetched":
+            stats["prefetched"] += 1
+            return
+        stats["calls"] += 1
+        if outcome != "miss":
+            stats[outcome] += 1
+
+
+def _consume_exception(task: asyncio.Task):
+    # 预先启动的调用可能没有人等待，读取异常避免 "exception was never retrieved" 警告
+    if not task.cancelled():
+        task.exception()
+
+
+def _is_error_text(value: Any) -> bool:
+    return isinstance(value, str) and _ERROR_TEXT.match(value) is not None
+
+
+def _is_error(result: Any) -> bool:
+    # 工具在失败时返回错误信息而不是抛出异常，失败结果不做跨轮缓存；
+    # 正常结果也可能是字符串（如 select_wechat_name 返回昵称），只按错误标记判断
+    if _is_error_text(result):
+        return True
+    if isinstance(result, dict) and result.get("status") in ("error", "failed"):
+        return True
+    return isinstance(result, list) and any(_is_error_text(item) for item in result)
+
+
+def memoize_tool(func: Callable[..., Any], ttl: Optional[float] = None) -> Callable[..., Any]:
+    """
+    为工具加上结果缓存，名称、参数签名和文档字符串保持不变
+
+    Args:
+        func: 工具函数，同步函数或协程函数均可
+        ttl: 跨轮缓存的有效期（秒），为空或 0 时只在同一轮内缓存
+
+    Returns:
+        Callable: 包装后的工具，统一为协程函数（同步工具在 tool_executor 线程池中执行）
+    """
+    name = func.__name__
+    signature = inspect.signature(func)
+    ttl_cache = None
+    if ttl:
+        ttl_cache = _ttl_caches[name] = TTLCache(maxsize=_config.get('max_entries', 1024), ttl=ttl, name=f"tool_{name}")
+
+    async def execute(key: Hashable, args: tuple, kwargs: dict) -> Any:
+        if inspect.iscoroutinefunction(func):
+            result = await func(*args, **kwargs)
+        else:
+            loop = asyncio.get_running_loop()
+            context = contextvars.copy_context()
+            result = await loop.run_in_executor(tool_executor, functools.partial(context.run, func, *args, **kwargs))
+        if ttl_cache is not None and not _is_error(result):
+            ttl_cache.set(key, copy.deepcopy(result))
+        return result
+
+    def start(args: tuple, kwargs: dict, prefetch: bool = False) -> Tuple[Optional[asyncio.Task], Any]:
+        """返回 (执行该调用的任务, 跨轮缓存中的结果)，两者之一有效"""
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        key = (name, _freeze(bound.arguments))
+        memo = _invocation_memo.get()
+        if memo is not None and key in memo:
+            if not prefetch:
+                _record(name, "invocation_hits")
+            return memo[key], _MISSING
+        if ttl_cache is not None:
+            value = ttl_cache.get(key, _MISSING)
+            if value is not _MISSING:
+                if not prefetch:
+                    _record(name, "ttl_hits")
+                return None, value
+        if prefetch and memo is None:
+            return None, _MISSING
+        task = asyncio.ensure_future(execute(key, args, kwargs))
+        task.add_done_callback(_consume_exception)
+        if memo is not None:
+            memo[key] = task
+        _record(name, "prefetched" if prefetch else "miss")
+        return task, _MISSING
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        task, value = start(args, kwargs)
+        if task is None:
+            return copy.deepcopy(value)
+        # shield：本次调用被取消时不影响本轮其他等待同一结果的调用
+        return copy.deepcopy(await asyncio.shield(task))
+
+    wrapper.start = start
+    _registry[name] = wrapper
+    return wrapper
+
+
+def start_tool_calls(function_calls: Iterable[Tuple[str, Dict[str, Any]]]) -> int:
+    """
+    并发启动一次模型响应中的多个工具调用，结果放进本轮缓存
+
+    只启动经过 memoize_tool 包装的工具，其余（写入类）工具仍由 ADK 按顺序执行；
+    需要在本轮缓存开启时（call_agent_async 中）调用。
+
+    Args:
+        function_calls: [(工具名, 参数)]
+
+    Returns:
+        int: 启动的调用数
+    """
+    started = 0
+    for name, arguments in function_calls:
+        tool = _registry.get(name)
+        if tool is None:
+            continue
+        try:
+            task, _ = tool.start((), dict(arguments or {}), prefetch=True)
+        except TypeError:
+            # 模型给出的参数与工具签名不符，交给 ADK 按原流程报错
+            continue
+        if task is not None:
+            started += 1
+    return started
+
+
+def memoize_tools(tools: Iterable[Callable[..., Any]]) -> List[Callable[..., Any]]:
+    """
+    按配置包装智能体的工具列表：tool_memo.tools 中列出的工具加上结果缓存，其余原样返回
+
+    Args:
+        tools: 工具列表
+
+    Returns:
+        List[Callable]: 包装后的工具列表，顺序不变
+    """
+    if not _enabled:
+        return list(tools)
+    wrapped = []
+    for tool in tools:
+        name = getattr(tool, "__name__", None)
+        if name in _memo_tools:
+            wrapped.append(memoize_tool(tool, _ttl_seconds.get(name)))
+        else:
+            wrapped.append(tool)
+    return wrapped
+
+
+def tool_memo_stats() -> Dict[str, Dict[str, Any]]:
+    """
+    各工具的调用次数和缓存命中率
+
+    Returns:
+        Dict[str, Dict[str, Any]]: {工具名: 调用次数、本轮命中次数、跨轮命中次数、并发预启动次数、命中率}
+    """
+    with _stats_lock:
+        snapshot = {name: dict(stats) for name, stats in _stats.items()}
+    for stats in snapshot.values():
+        hits = stats["invocation_hits"] + stats["ttl_hits"]
+        stats["hit_rate"] = round(hits / stats["calls"], 4) if stats["calls"] else 0.0
+    return snapshot
+
+
+if __name__ == "__main__":
+    # 自检：同一轮内重复调用只执行一次，跨轮只有配置了 ttl 的工具命中，失败结果不跨轮缓存；
+    # 一次响应中的多个慢工具并发执行，总耗时接近最慢的一个
+    import time
+
+    executed = []
+
+    def select_demo(tenant_id: int, task_id: int) -> list:
+        """演示工具"""
+        executed.append(("select_demo", tenant_id, task_id))
+        return [{"id": task_id}]
+
+    async def describe_demo(url: str) -> dict:
+        """演示工具"""
+        executed.append(("describe_demo", url))
+        if "bad" in url:
+            return {"status": "error", "error_message": "下载失败"}
+        return {"status": "success", "image_description": url}
+
+    def name_demo(wechat_id: str) -> str:
+        """演示工具"""
+        executed.append(("name_demo", wechat_id))
+        if wechat_id == "bad":
+            return "查询微信昵称失败: 连接超时"
+        return "小王"
+
+    def slow_demo(name: str) -> dict:
+        """演示工具"""
+        time.sleep(0.3)
+        return {"status": "success", "name": name}
+
+    select_tool = memoize_tool(select_demo)
+    describe_tool = memoize_tool(describe_demo, ttl=60)
+    name_tool = memoize_tool(name_demo, ttl=60)
+    slow_tool = memoize_tool(slow_demo)
+    assert select_tool.__name__ == "select_demo" and inspect.signature(select_tool) == inspect.signature(select_demo)
+
+    async def main():
+        for _ in range(2):
+            with invocation_scope():
+                await select_tool(1, 2)
+                await select_tool(1, task_id=2)
+                await describe_tool("https://a")
+                await describe_tool("https://a")
+                await describe_tool("https://bad")
+                await name_tool("wx_sales")
+                await name_tool("bad")
+        # 没有开启本轮缓存时，只有跨轮缓存生效
+        await select_tool(1, 2)
+
+        calls = [("slow_demo", {"name": name}) for name in ("a", "b", "c")]
+        with invocation_scope():
+            started = time.perf_counter()
+            for _, arguments in calls:
+                await slow_tool(**arguments)
+            sequential = time.perf_counter() - started
+        with invocation_scope():
+            started = time.perf_counter()
+            assert start_tool_calls(calls) == 3
+            # ADK 随后按顺序逐个执行
+            results = [await slow_tool(**arguments) for _, arguments in calls]
+            concurrent = time.perf_counter() - started
+        assert [result["name"] for result in results] == ["a", "b", "c"]
+        print(f"3 个 0.3s 的工具: 顺序执行 {sequential:.2f}s, 并发预启动 {concurrent:.2f}s")
+        assert concurrent < sequential / 2
+
+    asyncio.run(main())
+    assert executed.count(("select_demo", 1, 2)) == 3, executed
+    assert executed.count(("describe_demo", "https://a")) == 1, executed
+    assert executed.count(("describe_demo", "https://bad")) == 2, executed
+    # 返回字符串的工具正常结果跨轮缓存，错误信息不缓存
+    assert executed.count(("name_demo", "wx_sales")) == 1, executed
+    assert executed.count(("name_demo", "bad")) == 2, executed
+    assert not _is_error([{"title": "协作事项"}]) and _is_error(["查询协作事项失败: 超时"])
+    print(tool_memo_stats())
+    print("自检通过")
@@ -0,0 +1,264 @@
+"""
+有界 TTL 缓存
+
+线程安全的内存缓存：每个条目有过期时间，超过容量时按最近最少使用（LRU）淘汰。
+ReadThroughCache 在此基础上提供读穿透加载：同一个键同时只有一个线程执行加载，其余线程等待结果。
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple, Union
+
+_MISSING = object()
+
+
+class TTLCache:
+    def __init__(self, maxsize: int = 1024, ttl: float = 300, name: str = "ttl_cache"):
+        """
+        初始化缓存
+
+        Args:
+            maxsize: 最大条目数，超过后淘汰最久未使用的条目
+            ttl: 默认过期时间（秒）
+            name: 缓存名称，用于统计
+        """
+        if maxsize < 1:
+            raise ValueError("maxsize 必须大于0")
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.name = name
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        获取未过期的缓存值
+
+        Args:
+            key: 缓存键
+            default: 不存在或已过期时的返回值
+
+        Returns:
+            Any: 缓存值
+        """
+        with self._lock:
+            value = self._get_locked(key)
+            if value is _MISSING:
+                self._misses += 1
+                return default
+            self._hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """
+        写入缓存
+
+        Args:
+            key: 缓存键
+            value: 缓存值
+            ttl: 过期时间（秒），为 None 时使用默认值
+        """
+        with self._lock:
+            self._set_locked(key, value, ttl)
+
+    def setdefault(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> Tuple[Any, bool]:
+        """
+        键不存在（或已过期）时写入，原子操作
+
+        Args:
+            key: 缓存键
+            value: 要写入的值
+            ttl: 过期时间（秒），为 None 时使用默认值
+
+        Returns:
+            Tuple[Any, bool]: (缓存中的值, 是否是本次写入的)
+        """
+        with self._lock:
+            existing = self._get_locked(key)
+            if existing is not _MISSING:
+                self._hits += 1
+                return existing, False
+            self._misses += 1
+            self._set_locked(key, value, ttl)
+            return value, True
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """删除并返回缓存值"""
+        with self._lock:
+            entry = self._data.pop(key, None)
+        if entry is None or entry[0] <= time.monotonic():
+            return default
+        return entry[1]
+
+    def discard_where(self, predicate: Callable[[Hashable], bool]) -> int:
+        """
+        删除键满足条件的所有条目
+
+        Args:
+            predicate: 以缓存键为参数，返回 True 的条目被删除
+
+        Returns:
+            int: 删除的条目数
+        """
+        with self._lock:
+            return self._discard_where_locked(predicate)
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return self._get_locked(key, touch=False) is not _MISSING
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        获取缓存统计
+
+        Returns:
+            Dict[str, Any]: 条目数、容量、命中/未命中次数、命中率、淘汰次数
+        """
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "name": self.name,
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 4) if lookups else 0.0,
+                "evictions": self._evictions,
+            }
+
+    def _get_locked(self, key: Hashable, touch: bool = True) -> Any:
+        entry = self._data.get(key)
+        if entry is None:
+            return _MISSING
+        if entry[0] <= time.monotonic():
+            del self._data[key]
+            return _MISSING
+        if touch:
+            self._data.move_to_end(key)
+        return entry[1]
+
+    def _discard_where_locked(self, predicate: Callable[[Hashable], bool]) -> int:
+        keys = [key for key in self._data if predicate(key)]
+        for key in keys:
+            del self._data[key]
+        return len(keys)
+
+    def _set_locked(self, key: Hashable, value: Any, ttl: Optional[float]):
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self._evictions += 1
+
+
+class _Flight:
+    """一次进行中的加载，等待同一个键的线程共享它的结果"""
+    __slots__ = ("done", "value", "error", "stale")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value: Any = None
+        self.error: Optional[BaseException] = None
+        # 加载期间该键被失效，结果只返回给本次的调用方，不写入缓存
+        self.stale = False
+
+
+class ReadThroughCache(TTLCache):
+    """读穿透缓存：未命中时调用加载函数，并发的未命中合并为一次加载（single-flight）"""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300, name: str = "read_through_cache"):
+        super().__init__(maxsize=maxsize, ttl=ttl, name=name)
+        self._flights: Dict[Hashable, _Flight] = {}
+        self._loads = 0
+        self._coalesced = 0
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], Any], ttl: Union[float, Callable[[Any], float], None] = None) -> Any:
+        """
+        获取缓存值，不存在或已过期时调用 loader 加载并写入缓存。
+        同一个键正在加载时等待那次加载的结果；加载抛出的异常传给所有等待的调用方，不写入缓存。
+
+        Args:
+            key: 缓存键
+            loader: 加载函数，无参数
+            ttl: 过期时间（秒），或以加载结果为参数返回过期时间的函数（如未找到的结果用较短的有效期），为 None 时使用默认值
+
+        Returns:
+            Any: 缓存值或加载结果
+        """
+        with self._lock:
+            value = self._get_locked(key)
+            if value is not _MISSING:
+                self._hits += 1
+                return value
+            self._misses += 1
+            flight = self._flights.get(key)
+            owner = flight is None
+            if owner:
+                flight = self._flights[key] = _Flight()
+                self._loads += 1
+            else:
+                self._coalesced += 1
+
+        if not owner:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = loader()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+                if flight.error is None and not flight.stale:
+                    self._set_locked(key, flight.value, ttl(flight.value) if callable(ttl) else ttl)
+            flight.done.set()
+        return flight.value
+
+    def invalidate(self, key: Hashable) -> bool:
+        """
+        使一个键失效：删除缓存值，正在进行的加载结果不再写入缓存
+
+        Returns:
+            bool: 是否删除了缓存值
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                flight.stale = True
+            return self._data.pop(key, None) is not None
+
+    def discard_where(self, predicate: Callable[[Hashable], bool]) -> int:
+        with self._lock:
+            for key, flight in self._flights.items():
+                if predicate(key):
+                    flight.stale = True
+            return self._discard_where_locked(predicate)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        获取缓存统计
+
+        Returns:
+            Dict[str, Any]: TTLCache.stats() 的内容，以及实际加载次数 (loads) 和合并到进行中加载的次数 (coalesced)
+        """
+        stats = super().stats()
+        with self._lock:
+            stats.update(loads=self._loads, coalesced=self._coalesced)
+        return stats